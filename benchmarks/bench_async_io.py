@@ -0,0 +1,134 @@
+"""Report loading with concurrent I/O on a simulated network share.
+
+SlowFileSystem adds a fixed latency to every directory listing, stat, open
+and read, like a report on an NFS/SMB mount. The report index and the job
+history, sync history and engine.log loads run through AsyncReader at each
+concurrency; concurrency 1 is the sequential baseline. The results are
+checked against the regular loaders.
+
+    python -m benchmarks.bench_async_io [--scale small] [--latency-ms 5] [--concurrency 1 4 16 64]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from qnaphbslog.analysis import get_hbs, load_job_histories, load_sync_histories, load_tasks
+from qnaphbslog.async_io import (AsyncReader, LocalFileSystem, load_job_histories_async,
+                                 load_sync_histories_async, load_tasks_async)
+from qnaphbslog.report_index import build_report_index
+from qnaphbslog.results import job_history_result, sync_history_result, task_result
+
+from .bench_suite import SCALES, prepare_report
+
+
+class SlowFileSystem(LocalFileSystem):
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def round_trip(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def list_dir(self, path):
+        self.round_trip()
+        return super().list_dir(path)
+
+    def mtime_ns(self, path):
+        self.round_trip()
+        return super().mtime_ns(path)
+
+    def open(self, path):
+        self.round_trip()
+        return super().open(path)
+
+    def pread(self, fd, size, offset):
+        self.round_trip()
+        return super().pread(fd, size, offset)
+
+    def read_stream(self, path):
+        self.round_trip()
+        return super().read_stream(path)
+
+
+def summarize(job_results, sync_results, task_results):
+    summary = [job_history_result(job.name, r.value) if r.ok else r.error
+               for job, r in job_results]
+    summary += [message or (sync_history_result(job.name, r.value) if r.ok else r.error)
+                for job, message, r in sync_results]
+    summary += [task_result(job, *r.value) if r.ok else r.error for job, r in task_results]
+    return summary
+
+
+def load_sync(report):
+    index = build_report_index(report)
+    jobs = get_hbs(report).jobs
+    sync_jobs = [job for job in jobs if job.job_type == 'sync']
+    return summarize(load_job_histories(None, index, jobs),
+                     load_sync_histories(None, index, sync_jobs),
+                     load_tasks(None, index, jobs))
+
+
+def load_async(report, concurrency, latency, block_size):
+    fs = SlowFileSystem(latency)
+    reader = AsyncReader(concurrency, block_size=block_size, fs=fs)
+    try:
+        timings = dict()
+        start = time.perf_counter()
+        index = reader.build_report_index(report)
+        timings['index'] = time.perf_counter() - start
+        jobs = get_hbs(report).jobs
+        sync_jobs = [job for job in jobs if job.job_type == 'sync']
+
+        start = time.perf_counter()
+        job_results = load_job_histories_async(reader, index, jobs)
+        timings['job_history'] = time.perf_counter() - start
+        start = time.perf_counter()
+        sync_results = load_sync_histories_async(reader, index, sync_jobs)
+        timings['sync_history'] = time.perf_counter() - start
+        start = time.perf_counter()
+        task_results = load_tasks_async(reader, index, jobs)
+        timings['task'] = time.perf_counter() - start
+    finally:
+        reader.close()
+    return timings, fs.calls, summarize(job_results, sync_results, task_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--latency-ms', type=float, default=5, dest='latency_ms',
+                        help='Added latency of every file system call')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--block-size', type=int, default=256, dest='block_size_kb',
+                        help='Read block size in KiB')
+    parser.add_argument('--work-dir', dest='work_dir',
+                        default=os.path.join(tempfile.gettempdir(), 'qnaphbslog-bench'),
+                        help='Directory of the generated reports')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    report = prepare_report(args.work_dir, args.scale)
+    expected = load_sync(report)
+    latency = args.latency_ms / 1000
+    block_size = args.block_size_kb * 1024
+
+    print(f'{args.scale} report, {args.latency_ms:g} ms per call, '
+          f'{args.block_size_kb} KiB blocks')
+    print(f'{"concurrency":>11} {"calls":>7} {"index":>8} {"job hist":>8} '
+          f'{"sync":>8} {"task":>8} {"total":>8} {"speedup":>8}')
+    baseline = None
+    for concurrency in args.concurrency:
+        timings, calls, summary = load_async(report, concurrency, latency, block_size)
+        if summary != expected:
+            raise SystemExit(f'concurrency {concurrency}: results differ from the regular loaders')
+        total = sum(timings.values())
+        baseline = baseline or total
+        print(f'{concurrency:>11} {calls:>7} {timings["index"]:>8.3f} '
+              f'{timings["job_history"]:>8.3f} {timings["sync_history"]:>8.3f} '
+              f'{timings["task"]:>8.3f} {total:>8.3f} {baseline / total:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Bytes per record of the history record representations.
+
+Records are built from freshly json-decoded lines, like the CLI does, so
+repeated strings are separate objects unless they are interned. The sync
+history is measured with --unique-names file names and again with every
+name unique, in each SyncFileHistory mode: aggregates only (the CLI
+default), with records (--export-sync-records) and with file states
+(--top-files). Each row is also given relative to the object list before.
+
+    python -m benchmarks.bench_memory [--records N] [--unique-names N]
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+
+from qnaphbslog.job_history_record import JobHistoryRecord
+from qnaphbslog.sync_file_history import SyncFileHistory, SyncFileHistoryRecord
+
+ACTIONS = ['upload', 'delete', 'mkdir', 'rename']
+EXCEPTIONS = [None, None, None, 'ConnectionError', 'TimeoutError']
+STATUSES = ['Finished', 'Finished with warnings', 'Failed', 'Stopped']
+
+
+class LegacySyncFileHistoryRecord:
+    def __init__(self, name, timestamp, action, result, exception, is_dir):
+        self.name = name
+        self.timestamp = timestamp
+        self.action = action
+        self.result = result
+        self.exception = exception
+        self.is_dir = is_dir
+
+
+class LegacyJobHistoryRecord:
+    def __init__(self, start_time, elapse_time, stop_time, status,
+                 upload_bytes_per_second=None, download_bytes_per_second=None):
+        self.start_time = start_time
+        self.elapse_time = elapse_time
+        self.stop_time = stop_time
+        self.status = status
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.download_bytes_per_second = download_bytes_per_second
+
+
+def make_history_lines(n, unique_names):
+    return [json.dumps({'name': f'/share/data/file{i % unique_names}.bin',
+                        'timestamp': 1614592800 + i * 0.5,
+                        'action': random.choice(ACTIONS),
+                        'result': random.choice(['success', 'fail']),
+                        'exception': random.choice(EXCEPTIONS),
+                        'is_dir': False})
+            for i in range(n)]
+
+
+def make_job_history_lines(n):
+    return [json.dumps({'start_time': 1614592800 + i * 3600,
+                        'elapse_time': random.randint(1, 3600),
+                        'stop_time': 1614592800 + i * 3600 + 600,
+                        'status': random.choice(STATUSES),
+                        'upload_bytes_per_second': random.randint(1, 10 ** 8)})
+            for i in range(n)]
+
+
+def measure(build, lines):
+    gc.collect()
+    tracemalloc.start()
+    kept = build(lines)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / len(lines)
+
+
+def build_sync_records(cls):
+    def build(lines):
+        records = list()
+        for line in lines:
+            h = json.loads(line)
+            records.append(cls(h['name'], h['timestamp'], h['action'],
+                               h['result'], h['exception'], h['is_dir']))
+        return records
+    return build
+
+
+def build_sync_columns(keep_records, track_states=False):
+    def build(lines):
+        history = SyncFileHistory(keep_records=keep_records, track_states=track_states)
+        for line in lines:
+            h = json.loads(line)
+            history.add(h['name'], h['timestamp'], h['action'],
+                        h['result'], h['exception'], h['is_dir'])
+        return history
+    return build
+
+
+def build_job_records(cls):
+    def build(lines):
+        records = list()
+        for line in lines:
+            h = json.loads(line)
+            records.append(cls(h['start_time'], h['elapse_time'], h['stop_time'],
+                               h['status'], h['upload_bytes_per_second']))
+        return records
+    return build
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--unique-names', type=int, default=20000)
+    args = parser.parse_args()
+
+    for unique_names in dict.fromkeys([args.unique_names, args.records]):
+        history_lines = make_history_lines(args.records, unique_names)
+        print(f'{args.records} sync history records, {unique_names} unique file names')
+        print_rows([
+            ('SyncFileHistoryRecord (dict, before)',
+             measure(build_sync_records(LegacySyncFileHistoryRecord), history_lines)),
+            ('SyncFileHistoryRecord (slots)',
+             measure(build_sync_records(SyncFileHistoryRecord), history_lines)),
+            ('SyncFileHistory aggregates only',
+             measure(build_sync_columns(False), history_lines)),
+            ('SyncFileHistory with records',
+             measure(build_sync_columns(True), history_lines)),
+            ('SyncFileHistory with file states',
+             measure(build_sync_columns(False, True), history_lines)),
+        ])
+
+    job_lines = make_job_history_lines(args.records)
+    print(f'{args.records} job history records')
+    print_rows([
+        ('JobHistoryRecord (dict, before)',
+         measure(build_job_records(LegacyJobHistoryRecord), job_lines)),
+        ('JobHistoryRecord (slots, after)',
+         measure(build_job_records(JobHistoryRecord), job_lines)),
+    ])
+
+
+def print_rows(rows):
+    # The first row is the representation before, the others are relative to it
+    baseline = rows[0][1]
+    for label, bytes_per_record in rows:
+        print(f'  {label:<38} {bytes_per_record:8.1f} bytes/record '
+              f'{bytes_per_record / baseline:6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
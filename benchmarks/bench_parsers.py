@@ -0,0 +1,90 @@
+"""Per-line cost of the engine.log and syncengine-history.log parsers.
+
+Compares the original str.find/split based functions and per-line
+json.loads with qnaphbslog.parsers.
+
+    python -m benchmarks.bench_parsers [--lines N]
+"""
+import argparse
+import json
+import random
+import timeit
+
+from qnaphbslog.parsers import (get_json_loads, iter_history_rows, parse_task_name,
+                                parse_upload_size)
+from qnaphbslog.sync_file_history import SyncFileHistoryRecord
+
+
+def legacy_get_task_name(line):
+    start = line.find('task submitted: ') + len('task submitted: ')
+    end = line.find('(')
+    return line[start:end]
+
+
+def legacy_get_upload_size(line):
+    return int(line[line.find("'size': ") + len("'size': "):].split(',')[0])
+
+
+def legacy_history_records(lines):
+    records = list()
+    for line in lines:
+        h = json.loads(line)
+        records.append(SyncFileHistoryRecord(name=h['name'],
+                                             timestamp=h['timestamp'],
+                                             action=h['action'],
+                                             result=h['result'],
+                                             exception=h['exception'],
+                                             is_dir=h['is_dir']))
+    return records
+
+
+def make_task_lines(n):
+    return [f"2021-03-01 10:00:{i % 60:02d},000 INFO task submitted: UploadTask("
+            f"{{'path': '/share/data/file{i}.bin', 'size': {random.randint(0, 2**31)}, "
+            f"'mtime': 1614592800}})\n"
+            for i in range(n)]
+
+
+def make_history_lines(n):
+    return [json.dumps({'name': f'/share/data/file{i}.bin',
+                        'timestamp': 1614592800 + i * 0.5,
+                        'action': random.choice(['upload', 'delete', 'mkdir']),
+                        'result': 'success',
+                        'exception': None,
+                        'is_dir': False}) + '\n'
+            for i in range(n)]
+
+
+def bench(label, func, lines, repeat=5):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f'{label:<40} {best / len(lines) * 1e9:8.0f} ns/line')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=100000)
+    args = parser.parse_args()
+
+    task_lines = make_task_lines(args.lines)
+    task_lines_bytes = [line.encode() for line in task_lines]
+    history_lines = make_history_lines(args.lines)
+    history_lines_bytes = [line.encode() for line in history_lines]
+
+    print(f'{args.lines} lines, orjson: {get_json_loads() is not json.loads}')
+    old = bench('legacy task name + size',
+                lambda: [(legacy_get_task_name(line), legacy_get_upload_size(line))
+                         for line in task_lines], task_lines)
+    new = bench('parsers task name + size',
+                lambda: [(parse_task_name(line), parse_upload_size(line))
+                         for line in task_lines_bytes], task_lines)
+    print(f'{"speedup":<40} {old / new:8.2f}x')
+    old = bench('legacy json.loads + record',
+                lambda: legacy_history_records(history_lines), history_lines)
+    new = bench('parsers batched history rows',
+                lambda: list(iter_history_rows(history_lines_bytes)), history_lines)
+    print(f'{"speedup":<40} {old / new:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Import time of each CLI mode against a startup budget.
+
+Every mode runs under `python -X importtime -m qnaphbslog` and the self time
+of the modules it imports beyond a bare interpreter is added up. A mode is
+over budget when that import time exceeds its budget (times --budget-factor,
+for slower machines) or when it imports one of the modules it never needs.
+The exit status is 1 when any mode is over budget.
+
+    python -m benchmarks.bench_startup [--repeat 5] [--budget-factor 1.5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import qnaphbslog
+
+from .bench_suite import prepare_report
+
+# Only the modes that parse logs may load these
+HEAVY_MODULES = ('asyncio', 'multiprocessing', 'concurrent.futures.process', 'sqlite3',
+                 'pickle', 'orjson', 'tarfile', 'zipfile', 'gzip', 'cProfile')
+PARSE_MODULES = ('asyncio', 'multiprocessing', 'concurrent.futures.process', 'tarfile',
+                 'zipfile', 'gzip', 'cProfile')
+# (name, arguments, import time budget in ms, modules it must not import)
+STARTUP_MODES = [
+    ('help', ['--help'], 60, HEAVY_MODULES),
+    ('query help', ['query', '--help'], 60, HEAVY_MODULES),
+    ('hbs summary', ['{report}', '--hbs-summary'], 80, HEAVY_MODULES),
+    ('job history', ['{report}', '--job-history', '--no-parse-cache'], 100, PARSE_MODULES),
+    ('sync history', ['{report}', '--sync-history', '--no-parse-cache'], 110, PARSE_MODULES),
+    ('query summary', ['query', '{db}', '--hbs-summary'], 90,
+     tuple(m for m in HEAVY_MODULES if m != 'sqlite3')),
+]
+
+
+def make_env():
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(qnaphbslog.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    return env
+
+
+def import_times(args, env):
+    # {module: self time in us} of one run, and its wall time
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)} exited with {proc.returncode}')
+    times = dict()
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us)
+    return times, seconds
+
+
+def measure_mode(args, baseline, env, repeat):
+    best_ms, best_wall, modules = None, None, set()
+    for _ in range(repeat):
+        times, seconds = import_times(['-m', 'qnaphbslog'] + args, env)
+        extra = {name: us for name, us in times.items() if name not in baseline}
+        modules = set(extra)
+        ms = sum(extra.values()) / 1000
+        best_ms = ms if best_ms is None else min(best_ms, ms)
+        best_wall = seconds if best_wall is None else min(best_wall, seconds)
+    return best_ms, best_wall, modules
+
+
+def prepare_db(work_dir, report, env):
+    path = os.path.join(work_dir, 'report-small.db')
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(report):
+        subprocess.run([sys.executable, '-m', 'qnaphbslog', report, '--export-db', path,
+                        '--no-index-cache', '--no-parse-cache'],
+                       stdout=subprocess.DEVNULL, env=env, check=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per mode, the fastest one is kept')
+    parser.add_argument('--budget-factor', type=float, default=1.0, dest='budget_factor',
+                        help='Multiply every import time budget by this factor')
+    parser.add_argument('--work-dir', dest='work_dir',
+                        default=os.path.join(tempfile.gettempdir(), 'qnaphbslog-bench'),
+                        help='Where the synthetic report is generated and kept')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    env = make_env()
+    report = prepare_report(args.work_dir, 'small')
+    db = prepare_db(args.work_dir, report, env)
+    baseline, interpreter = None, None
+    for _ in range(args.repeat):
+        times, seconds = import_times(['-c', 'pass'], env)
+        baseline = set(times)
+        interpreter = seconds if interpreter is None else min(interpreter, seconds)
+
+    print(f'interpreter startup {interpreter * 1000:.1f} ms')
+    print(f'{"mode":<16} {"modules":>7} {"import ms":>9} {"budget":>7} {"wall ms":>8}')
+    failures = list()
+    for name, mode_args, budget_ms, forbidden in STARTUP_MODES:
+        mode_args = [a.format(report=report, db=db) for a in mode_args]
+        ms, wall, modules = measure_mode(mode_args, baseline, env, args.repeat)
+        budget_ms *= args.budget_factor
+        line = (f'{name:<16} {len(modules):>7} {ms:>9.1f} {budget_ms:>7.0f} '
+                f'{wall * 1000:>8.1f}')
+        loaded = sorted(m for m in forbidden if m in modules)
+        if ms > budget_ms:
+            line += ' OVER BUDGET'
+            failures.append(name)
+        if loaded:
+            line += f' imports {", ".join(loaded)}'
+            failures.append(name)
+        print(line)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
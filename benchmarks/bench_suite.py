@@ -0,0 +1,282 @@
+"""Time every CLI mode and the core parsers on synthetic reports.
+
+Reports are generated once per scale under --work-dir and reused. CLI modes
+run in a child process with cold caches, plus a second warm-cache run for
+the log modes; peak memory is the child's max RSS. Core functions run in
+process; their peak memory is the tracemalloc peak of one extra run.
+
+    python -m benchmarks.bench_suite [--scales small medium] [--save out.json]
+    python -m benchmarks.bench_suite --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import qnaphbslog
+from qnaphbslog.analysis import (get_hbs, get_job_history, load_job_history,
+                                 load_sync_history_chunk)
+from qnaphbslog.engine_log import analyze_engine_log
+from qnaphbslog.report_index import build_report_index
+from qnaphbslog.server_log import replace_job_id_with_name, scan_server_log
+from qnaphbslog.sync_file_history import SyncFileHistory
+from qnaphbslog.timeline import correlate
+
+from .report_generator import ReportSpec, generate_report
+
+RESULTS_VERSION = 1
+SCALES = {
+    'small': ReportSpec(jobs=3, engine_lines=5000, history_lines=5000,
+                        server_lines=20000, job_runs=100),
+    'medium': ReportSpec(jobs=6, engine_lines=50000, history_lines=50000,
+                         server_lines=200000, job_runs=1000),
+    'large': ReportSpec(jobs=12, engine_lines=500000, history_lines=500000,
+                        server_lines=2000000, job_runs=5000),
+}
+# Runs the CLI and records its own VmHWM at exit. The child's rusage max RSS
+# also counts the pages of this parent process at fork time
+CLI_LAUNCHER = '''
+import atexit, os, runpy, sys
+
+def save_peak():
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmHWM:'):
+                with open(os.environ['QNAPHBSLOG_BENCH_PEAK'], 'w') as out:
+                    out.write(line.split()[1])
+
+if os.path.exists('/proc/self/status'):
+    atexit.register(save_peak)
+sys.argv[0] = 'qnaphbslog'
+runpy.run_module('qnaphbslog', run_name='__main__', alter_sys=True)
+'''
+CLI_MODES = [
+    ('--hbs-summary', False),
+    ('--job-history', False),
+    ('--job-stats', False),
+    ('--sync-history', True),
+    ('--task', True),
+    ('--replace-job-id-with-name-in-server-log', False),
+    ('--server-log-stats', True),
+    ('--timeline', False),
+]
+
+
+class BenchResult:
+    def __init__(self, scale, name, seconds, peak_kb):
+        self.scale = scale
+        self.name = name
+        self.seconds = seconds
+        self.peak_kb = peak_kb
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def prepare_report(work_dir, scale) -> str:
+    spec = SCALES[scale]
+    path = os.path.join(work_dir, f'report-{scale}')
+    spec_path = os.path.join(work_dir, f'report-{scale}.json')
+    try:
+        with open(spec_path) as fp:
+            if json.load(fp) == spec.to_dict() and os.path.isdir(path):
+                return path
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+    print(f'generating {scale} report under {path}', file=sys.stderr)
+    generate_report(path, spec)
+    with open(spec_path, 'w') as fp:
+        json.dump(spec.to_dict(), fp)
+    return path
+
+
+def run_cli(report, args, cache_dir, out_dir):
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(qnaphbslog.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    env['QNAPHBSLOG_CACHE_DIR'] = cache_dir
+    peak_path = os.path.join(out_dir, 'peak')
+    env['QNAPHBSLOG_BENCH_PEAK'] = peak_path
+    if os.path.exists(peak_path):
+        os.remove(peak_path)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', CLI_LAUNCHER, report] + args,
+                            stdout=subprocess.DEVNULL, cwd=out_dir, env=env)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f'qnaphbslog {" ".join(args)} exited with {proc.returncode}')
+    try:
+        with open(peak_path) as fp:
+            peak_kb = int(fp.read())
+    except OSError:
+        peak_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return seconds, peak_kb
+
+
+def bench_cli(scale, report, work_dir, repeat):
+    results = list()
+    out_dir = os.path.join(work_dir, 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    for mode, cacheable in CLI_MODES:
+        cache_dir = tempfile.mkdtemp(dir=work_dir, prefix='cache-')
+        try:
+            runs = [run_cli(report, [mode, '--no-index-cache', '--no-parse-cache'],
+                            cache_dir, out_dir) for _ in range(repeat)]
+            results.append(BenchResult(scale, f'cli {mode}', min(r[0] for r in runs),
+                                       max(r[1] for r in runs)))
+            if cacheable:
+                run_cli(report, [mode], cache_dir, out_dir)
+                runs = [run_cli(report, [mode], cache_dir, out_dir) for _ in range(repeat)]
+                results.append(BenchResult(scale, f'cli {mode} (warm cache)',
+                                           min(r[0] for r in runs), max(r[1] for r in runs)))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak // 1024
+
+
+def make_function_benches(report, work_dir):
+    index = build_report_index(report)
+    hbs = get_hbs(report)
+    sync_job = next(j for j in hbs.jobs if j.job_type == 'sync')
+    job_files = index.get_job(sync_job.name)
+    history_paths = job_files.sync_history_logs
+    engine_path = job_files.engine_logs[0]
+    server_log = os.path.join(report, 'cloud', 'server', 'server.log')
+    server_out = os.path.join(work_dir, 'out', 'server.log')
+
+    records = SyncFileHistory(keep_records=True, track_states=True)
+    for path in history_paths:
+        load_sync_history_chunk(path, job_history=records)
+    middle = records.start_time() + (records.end_time() - records.start_time()) / 2
+    runs = load_job_history(job_files.job_history_path, sync_job.job_type)
+
+    return [
+        ('build_report_index', lambda: build_report_index(report)),
+        ('load_job_history', lambda: load_job_history(job_files.job_history_path,
+                                                      sync_job.job_type)),
+        ('get_job_history', lambda: get_job_history(history_paths)),
+        ('analyze_engine_log', lambda: analyze_engine_log(engine_path)),
+        ('timeline.correlate', lambda: correlate(runs, job_files.engine_logs,
+                                                 history_paths)),
+        ('replace_job_id_with_name', lambda: replace_job_id_with_name(
+            server_log, server_out, hbs.job_id_name_map)),
+        ('scan_server_log', lambda: scan_server_log(hbs.job_id_name_map, server_log)),
+        ('SyncFileHistory.count_files', lambda: [
+            records.count_files(action=a, result='fail', exclude_result='success')
+            for a in records.action_types()]),
+        ('SyncFileHistory.count_between', lambda: records.count_between(t1=middle)),
+        ('SyncFileHistory.get_sync_between', lambda: sum(
+            1 for _ in records.get_sync_between(t1=middle))),
+        ('SyncFileHistory.bucket_sync', lambda: records.bucket_sync('hour')),
+        ('SyncFileHistory.most_retried', lambda: records.most_retried(10)),
+        ('SyncFileHistory.slowest_to_succeed', lambda: records.slowest_to_succeed(10)),
+    ]
+
+
+def bench_functions(scale, report, work_dir, repeat):
+    results = list()
+    os.makedirs(os.path.join(work_dir, 'out'), exist_ok=True)
+    for name, func in make_function_benches(report, work_dir):
+        seconds, peak_kb = measure(func, repeat)
+        results.append(BenchResult(scale, name, seconds, peak_kb))
+    return results
+
+
+def save_results(path, results):
+    with open(path, 'w') as fp:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': [r.to_dict() for r in results],
+        }, fp, indent=1)
+
+
+def load_results(path):
+    with open(path) as fp:
+        d = json.load(fp)
+    if d.get('version') != RESULTS_VERSION:
+        raise ValueError(f'{path} is not a version {RESULTS_VERSION} results file')
+    return [BenchResult(**r) for r in d['results']]
+
+
+def print_results(results, baseline=None, threshold=1.25):
+    previous = {(r.scale, r.name): r for r in baseline or list()}
+    regressions = list()
+    print(f'{"scale":<8} {"benchmark":<56} {"seconds":>9} {"peak KiB":>10}'
+          + (f' {"vs base":>8}' if baseline else ''))
+    for r in results:
+        line = f'{r.scale:<8} {r.name:<56} {r.seconds:9.3f} {r.peak_kb:10d}'
+        base = previous.get((r.scale, r.name))
+        if base is not None and base.seconds > 0:
+            ratio = r.seconds / base.seconds
+            line += f' {ratio:7.2f}x'
+            if ratio > threshold:
+                line += ' REGRESSION'
+                regressions.append(r)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small'])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark, the fastest one is kept')
+    parser.add_argument('--only', choices=['cli', 'functions'],
+                        help='Run only the CLI or the function benchmarks')
+    parser.add_argument('--work-dir', dest='work_dir',
+                        default=os.path.join(tempfile.gettempdir(), 'qnaphbslog-bench'),
+                        help='Where the synthetic reports are generated and kept')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the results saved in this file')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = list()
+    for scale in args.scales:
+        report = prepare_report(args.work_dir, scale)
+        if args.only in (None, 'functions'):
+            results.extend(bench_functions(scale, report, args.work_dir, args.repeat))
+        if args.only in (None, 'cli'):
+            results.extend(bench_cli(scale, report, args.work_dir, args.repeat))
+
+    baseline = load_results(args.compare) if args.compare else None
+    regressions = print_results(results, baseline, args.threshold)
+    if args.save:
+        save_results(args.save, results)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Parse cache reuse and invalidation against a cold parse.
+
+A syncengine-history.log and an engine.log are parsed through the parse
+cache while they change like logs on a live NAS: unchanged, appended to,
+ending in a partial line, truncated, rotated and rewritten in place with
+the same size. After every step the cached result must equal a cold parse
+of the file, and the cache must be reused exactly as planned: fully when
+nothing changed, from the last parsed offset after an append, not at all
+otherwise. A gzip-rotated copy checks the whole-stream path. The exit
+status is 1 when any step differs.
+
+    python -m benchmarks.check_parse_cache [--lines 2000] [--chunk-size 4096] [--workers 1]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+from functools import partial
+
+from qnaphbslog.analysis import (load_sync_history_chunk, merge_sync_file_history,
+                                 new_sync_file_history)
+from qnaphbslog.chunked_io import DEFAULT_CHUNK_SIZE
+from qnaphbslog.engine_log import analyze_engine_log, make_aggregators, merge_aggregators
+from qnaphbslog.parallel import make_executor
+from qnaphbslog.parse_cache import ParseCache, load_log_files, plan_incremental
+from qnaphbslog.results import aggregators_result, sync_history_result
+
+from .report_generator import ACTIONS, EXCEPTIONS, RESULTS, START_TIME, TASKS, format_log_time
+
+# Cache reuse a step expects
+NO_REUSE = 'none'
+FULL_REUSE = 'full'
+INCREMENTAL_REUSE = 'incremental'
+
+
+def history_lines(rng, t0, n):
+    lines = list()
+    for i in range(n):
+        result = rng.choice(RESULTS)
+        lines.append(json.dumps({
+            'name': f'/share/data/dir{i % 20}/file{rng.randrange(n // 4 + 1)}.bin',
+            'timestamp': t0 + i * 0.5,
+            'action': rng.choice(ACTIONS),
+            'result': result,
+            'exception': None if result == 'success' else rng.choice(EXCEPTIONS),
+            'is_dir': False,
+        }) + '\n')
+    return lines
+
+
+def engine_lines(rng, t0, n):
+    lines = list()
+    for i in range(n):
+        ts = format_log_time(t0 + i)
+        if i % 3:
+            lines.append(f'{ts} DEBUG [worker-{i % 8}] poll queue, {i % 97} pending\n')
+            continue
+        lines.append(f"{ts} INFO [scheduler] task submitted: {rng.choice(TASKS)}("
+                     f"{{'path': '/share/data/file{i}.bin', "
+                     f"'size': {rng.randrange(10 ** 9)}, 'mtime': {t0 + i}}})\n")
+    return lines
+
+
+class LogKind:
+    def __init__(self, kind, file_name, make_lines, parse, new, merge, summarize):
+        self.kind = kind
+        self.file_name = file_name
+        self.make_lines = make_lines
+        self.parse = parse
+        self.new = new
+        self.merge = merge
+        self.summarize = summarize
+
+
+LOG_KINDS = [
+    LogKind('sync_history:states', 'syncengine-history.log', history_lines,
+            partial(load_sync_history_chunk, track_states=True),
+            partial(new_sync_file_history, False, True), merge_sync_file_history,
+            lambda value: sync_history_result('job', value, top_files=5)),
+    LogKind('engine_log', 'engine.log', engine_lines, analyze_engine_log,
+            make_aggregators, merge_aggregators, aggregators_result),
+]
+
+
+class LogFile:
+    def __init__(self, path, log_kind: LogKind, lines, seed):
+        self.path = path
+        self.log_kind = log_kind
+        self.lines = lines
+        self.rng = random.Random(seed)
+        self.t0 = START_TIME
+        self.mtime_ns = 0
+
+    def make_lines(self, n):
+        lines = self.log_kind.make_lines(self.rng, self.t0, n)
+        self.t0 += n
+        return lines
+
+    def write(self, data: str, mode='w'):
+        opener = gzip.open if self.path.endswith('.gz') else open
+        with opener(self.path, mode + 't', encoding='utf-8') as fp:
+            fp.write(data)
+        # A coarse file system clock must not hide a rewrite
+        self.mtime_ns = max(os.stat(self.path).st_mtime_ns, self.mtime_ns + 10 ** 9)
+        os.utime(self.path, ns=(self.mtime_ns, self.mtime_ns))
+
+    def steps(self):
+        half = self.lines // 2
+        yield 'cold', NO_REUSE, lambda: self.write(''.join(self.make_lines(self.lines)))
+        yield 'unchanged', FULL_REUSE, lambda: None
+        yield 'append', INCREMENTAL_REUSE, \
+            lambda: self.write(''.join(self.make_lines(half)), 'a')
+        partial_line = self.make_lines(1)[0]
+        yield 'append partial line', INCREMENTAL_REUSE, \
+            lambda: self.write(partial_line[:len(partial_line) // 2], 'a')
+        yield 'complete partial line', INCREMENTAL_REUSE, \
+            lambda: self.write(partial_line[len(partial_line) // 2:], 'a')
+        yield 'truncate', NO_REUSE, self.truncate
+        yield 'rotate', NO_REUSE, self.rotate
+        yield 'same size rewrite', NO_REUSE, self.rewrite_tail
+        yield 'unchanged after rewrite', FULL_REUSE, lambda: None
+
+    def gzip_steps(self):
+        yield 'cold', NO_REUSE, lambda: self.write(''.join(self.make_lines(self.lines)))
+        yield 'unchanged', FULL_REUSE, lambda: None
+        yield 'rewrite', NO_REUSE, \
+            lambda: self.write(''.join(self.make_lines(self.lines + 1)))
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as fp:
+            return fp.read()
+
+    def truncate(self):
+        lines = self.read().splitlines(keepends=True)
+        self.write(''.join(lines[:len(lines) // 3]))
+
+    def rotate(self):
+        # The current file moves to .1 and the log starts over with newer lines
+        os.replace(self.path, self.path + '.1')
+        self.write(''.join(self.make_lines(self.lines)))
+
+    def rewrite_tail(self):
+        # Same size and same first block, only the last line differs
+        data = self.read()
+        last = data.rstrip('\n').rfind('\n') + 1
+        tail = data[last:].replace('file', 'elif', 1)
+        if len(tail) != len(data) - last or tail == data[last:]:
+            tail = data[last:].replace('DEBUG', 'DEBUX', 1)
+        self.write(data[:last] + tail)
+
+
+def classify(plan):
+    if plan.value is None:
+        return NO_REUSE
+    if plan.start >= plan.size:
+        return FULL_REUSE
+    return INCREMENTAL_REUSE
+
+
+def parse(executor, cache, log_kind: LogKind, path, chunk_size):
+    result = load_log_files(executor, cache, log_kind.kind, log_kind.parse, log_kind.new,
+                            log_kind.merge, [[path]], chunk_size)[0]
+    if not result.ok:
+        # A JSON line cut in half fails a cold parse too, only the exception
+        # type is compared since the reported offsets depend on the chunks
+        return 'error', result.error.split(':', 1)[0]
+    return log_kind.summarize(result.value)
+
+
+def check_steps(executor, cache, log: LogFile, steps, chunk_size):
+    failures = 0
+    for step, expected_reuse, change in steps:
+        change()
+        reuse = classify(plan_incremental(cache, log.path, log.log_kind.kind))
+        cached = parse(executor, cache, log.log_kind, log.path, chunk_size)
+        cold = parse(executor, None, log.log_kind, log.path, DEFAULT_CHUNK_SIZE)
+        ok = reuse == expected_reuse and cached == cold
+        failures += not ok
+        if cached != cold:
+            outcome = 'DIFFERS FROM COLD PARSE'
+        elif reuse != expected_reuse:
+            outcome = 'UNEXPECTED CACHE REUSE'
+        elif isinstance(cold, tuple):
+            outcome = f'ok, both fail with {cold[1]}'
+        else:
+            outcome = 'ok'
+        print(f'  {step:<26} reuse {reuse:<11} (expected {expected_reuse:<11}) {outcome}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=2000, help='Lines per log file')
+    parser.add_argument('--chunk-size', type=int, default=4096, dest='chunk_size',
+                        help='Chunk size in bytes of the cached parse')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    executor = make_executor(args.workers)
+    failures = 0
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            cache = ParseCache.open(os.path.join(root, 'cache'))
+            if cache is None:
+                raise SystemExit('Cannot open a parse cache')
+            for seed, log_kind in enumerate(LOG_KINDS):
+                print(f'{log_kind.file_name} ({log_kind.kind})')
+                log = LogFile(os.path.join(root, log_kind.file_name), log_kind,
+                              args.lines, seed)
+                failures += check_steps(executor, cache, log, log.steps(), args.chunk_size)
+                print(f'{log_kind.file_name}.1.gz ({log_kind.kind})')
+                gz = LogFile(os.path.join(root, log_kind.file_name + '.1.gz'), log_kind,
+                             args.lines, seed + 100)
+                failures += check_steps(executor, cache, gz, gz.gzip_steps(), args.chunk_size)
+            cache.close()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if failures:
+        raise SystemExit(f'{failures} step(s) failed')
+    print('parse cache matches cold parses')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""SyncFileHistory queries against a brute force scan of the records.
+
+Random history records are added to a SyncFileHistory and every query is
+compared with the same answer computed from the plain record list. Time
+range queries must build the sorted time index lazily: not while records
+are added, on the first range query, and again after more records arrive.
+File states are checked against the records of each file, and file counts
+after every batch of added records and after merges. The exit status is 1
+when any check fails.
+
+    python -m benchmarks.check_sync_history [--records 20000] [--seed 1]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+
+from qnaphbslog.sync_file_history import SyncFileHistory
+
+from .report_generator import ACTIONS, EXCEPTIONS, RESULTS, START_TIME
+
+
+def make_rows(rng, n, t0=START_TIME):
+    rows = list()
+    for i in range(n):
+        result = rng.choice(RESULTS)
+        # Out of order timestamps, like rotated logs merged in any order
+        rows.append((f'/share/data/file{rng.randrange(n // 4 + 1)}.bin',
+                     t0 + rng.randrange(n) * 0.5,
+                     rng.choice(ACTIONS), result,
+                     None if result == 'success' else rng.choice(EXCEPTIONS),
+                     False))
+    return rows
+
+
+class Checker:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, label, ok):
+        self.failures += not ok
+        print(f'  {label:<56} {"ok" if ok else "FAILED"}')
+
+
+def between(rows, t0, t1):
+    return sorted(((row[1], i) for i, row in enumerate(rows)
+                   if (t0 is None or row[1] >= t0) and (t1 is None or row[1] <= t1)))
+
+
+def record_keys(history, t0, t1):
+    return [(r.name, r.timestamp, r.action, r.result, r.exception, r.is_dir)
+            for r in history.get_sync_between(t0, t1)]
+
+
+def check_time_index(checker: Checker, rows, more_rows):
+    print('time range queries')
+    history = SyncFileHistory(keep_records=True)
+    for row in rows:
+        history.add(*row)
+    checker.check('no time index while records are added', history._sorted_rows is None)
+
+    t0 = START_TIME + len(rows) * 0.1
+    t1 = START_TIME + len(rows) * 0.3
+    expected = [rows[i] for _, i in between(rows, t0, t1)]
+    checker.check('count_between equals a scan', history.count_between(t0, t1) == len(expected))
+    checker.check('time index built by the first range query', history._sorted_rows is not None)
+    index = history._sorted_rows
+    checker.check('get_sync_between equals a scan', record_keys(history, t0, t1) == expected)
+    checker.check('time index reused by the next query', history._sorted_rows is index)
+
+    aware = datetime.fromtimestamp(t0, timezone(timedelta(hours=8)))
+    checker.check('aware datetime bounds equal timestamps',
+                  history.count_between(aware, None) == len(between(rows, t0, None)))
+
+    for row in more_rows:
+        history.add(*row)
+    checker.check('time index dropped when records are added', history._sorted_rows is None)
+    all_rows = rows + more_rows
+    expected = [all_rows[i] for _, i in between(all_rows, None, t1)]
+    checker.check('get_sync_between after more records', record_keys(history, None, t1) == expected)
+
+
+def scan_file_state(rows, name, action):
+    matching = [row for row in rows if row[0] == name and row[2] == action]
+    if not matching:
+        return None
+    # The latest attempt wins, ties go to the record added last
+    last = max(reversed(matching), key=lambda row: row[1])
+    successes = [row[1] for row in matching if row[3] == 'success']
+    return (min(row[1] for row in matching), last[1], len(matching),
+            sum(row[3] != 'success' for row in matching), last[3], last[4],
+            min(successes) if successes else None)
+
+
+def check_file_states(checker: Checker, rows, rng):
+    print('file states')
+    history = SyncFileHistory(keep_records=False, track_states=True)
+    for row in rows:
+        history.add(*row)
+    differ = 0
+    for name, _, action, _, _, _ in rng.sample(rows, min(len(rows), 500)):
+        state = history.file_state(name, action)
+        found = None if state is None else (
+            state.first_time, state.last_time, state.attempts, state.failures,
+            state.last_result, state.last_exception, state.first_success_time)
+        differ += found != scan_file_state(rows, name, action)
+    checker.check('file_state equals a scan', differ == 0)
+    checker.check('file_state of an unknown file is None',
+                  history.file_state('/no/such/file', rows[0][2]) is None)
+    checker.check('file_state of an unknown action is None',
+                  history.file_state(rows[0][0], 'no-such-action') is None)
+
+
+def scan_file_counts(rows, action):
+    results = dict()
+    for name, _, row_action, result, _, _ in rows:
+        if row_action == action:
+            results.setdefault(name, set()).add(result)
+    return (len(results),
+            sum('success' in r for r in results.values()),
+            sum('fail' in r and 'success' not in r for r in results.values()))
+
+
+def file_counts(history, action):
+    return (history.count_files(action=action),
+            history.count_files(action=action, result='success'),
+            history.count_files(action=action, result='fail', exclude_result='success'))
+
+
+def check_file_counts(checker: Checker, rows, more_rows):
+    print('file counts')
+    # Records arrive in batches like --follow refreshes, the counts must hold
+    # after every batch and after merging histories parsed in chunks
+    history = SyncFileHistory(keep_records=False)
+    differ = 0
+    step = max(len(rows) // 20, 1)
+    for end in range(step, len(rows) + step, step):
+        for row in rows[end - step:end]:
+            history.add(*row)
+        seen = rows[:end]
+        differ += sum(file_counts(history, a) != scan_file_counts(seen, a) for a in ACTIONS)
+    checker.check('file counts equal a scan after every batch', differ == 0)
+
+    merged = SyncFileHistory(keep_records=False)
+    for part in (more_rows, rows):
+        chunk = SyncFileHistory(keep_records=False)
+        for row in part:
+            chunk.add(*row)
+        merged.merge(chunk)
+    all_rows = more_rows + rows
+    checker.check('file counts equal a scan after merges', all(
+        file_counts(merged, a) == scan_file_counts(all_rows, a) for a in ACTIONS))
+    checker.check('file counts of an unknown action are 0',
+                  file_counts(merged, 'no-such-action') == (0, 0, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = make_rows(rng, args.records)
+    more_rows = make_rows(rng, args.records // 10)
+    checker = Checker()
+    check_time_index(checker, rows, more_rows)
+    check_file_states(checker, rows, rng)
+    check_file_counts(checker, rows, more_rows)
+    if checker.failures:
+        raise SystemExit(f'{checker.failures} check(s) failed')
+    print('SyncFileHistory queries match the records')
+
+
+if __name__ == '__main__':
+    main()
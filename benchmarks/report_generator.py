@@ -0,0 +1,201 @@
+"""Write a synthetic HBS diagnosis report.
+
+The layout and line formats follow real reports: config.json with cloud and
+local accounts and jobs, data/system/<job>/job_history.json, rotated
+engine.log* with task submitted lines, rotated syncengine-history.log* JSON
+lines, cloud/server/server.log, qpkg.conf and cc3_build_number.
+
+    python -m benchmarks.report_generator OUT [--jobs N] [--engine-lines N] ...
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import time
+
+ACTIONS = ['upload', 'upload', 'delete', 'mkdir', 'rename']
+RESULTS = ['success', 'success', 'success', 'fail']
+EXCEPTIONS = ['ConnectionError', 'TimeoutError', 'PermissionError', 'QuotaExceeded']
+STATUSES = ['Finished', 'Finished', 'Finished with warnings', 'Failed', 'Stopped']
+TASKS = ['UploadTask', 'UploadTask', 'UploadTask', 'DeleteTask', 'MkdirTask', 'RenameTask']
+LEVELS = ['INFO', 'INFO', 'INFO', 'DEBUG', 'WARNING', 'ERROR']
+UPLOAD_SIZES = [4 * 1024, 3 * 1024 * 1024, 50 * 1024 * 1024, 600 * 1024 * 1024,
+                3 * 1024 * 1024 * 1024]
+JOB_TYPES = ['sync', 'backup', 'restore']
+START_TIME = 1600000000
+
+
+class ReportSpec:
+    def __init__(self, jobs=6, accounts=2, job_runs=100, engine_lines=10000,
+                 history_lines=10000, rotations=2, files=5000, server_lines=50000,
+                 gzip_rotated=False, seed=1):
+        self.jobs = jobs
+        self.accounts = accounts
+        self.job_runs = job_runs
+        # Lines per log file, each rotation is a file of its own
+        self.engine_lines = engine_lines
+        self.history_lines = history_lines
+        self.rotations = rotations
+        self.files = files
+        self.server_lines = server_lines
+        self.gzip_rotated = gzip_rotated
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def format_log_time(timestamp):
+    seconds = int(timestamp)
+    millis = int((timestamp - seconds) * 1000)
+    return f'{time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))},{millis:03d}'
+
+
+def make_config(spec: ReportSpec, rng):
+    accounts = [{'_id': f'account-{i:04d}', '_type': 'cloud',
+                 'remote.provider_type': rng.choice(['S3', 'Azure', 'GoogleDrive', 'Wasabi']),
+                 'name': f'account{i}'}
+                for i in range(spec.accounts)]
+    accounts.append({'_id': 'local-storage', '_type': 'local', 'name': 'local'})
+
+    jobs = list()
+    for i in range(spec.jobs):
+        job_type = JOB_TYPES[i % len(JOB_TYPES)]
+        job = {'_id': f'{rng.getrandbits(64):016x}', '_type': 'cloud',
+               'account_id': f'account-{i % spec.accounts:04d}' if spec.accounts else '',
+               'name': f'job{i}', 'job_type': job_type}
+        if job_type == 'backup':
+            job['backup.type'] = rng.choice(['normal', 'incremental'])
+        elif job_type == 'restore':
+            job['restore.type'] = rng.choice(['full', 'partial'])
+        else:
+            job['sync.direction'] = rng.choice(['upload', 'download', 'two-way'])
+            job['sync.operation'] = rng.choice(['one-way', 'mirror'])
+        jobs.append(job)
+    jobs.append({'_id': 'local-job', '_type': 'local', 'name': 'local job',
+                 'job_type': 'sync'})
+    return {'accounts': accounts, 'jobs': jobs}
+
+
+def open_log(path, gzipped):
+    if gzipped:
+        return gzip.open(f'{path}.gz', 'wt')
+    return open(path, 'w')
+
+
+def rotated_names(name, rotations):
+    # name, name.1, name.2, ... oldest last
+    return [name if k == 0 else f'{name}.{k}' for k in range(rotations)]
+
+
+def write_job_history(path, spec: ReportSpec, rng):
+    history = list()
+    for r in range(spec.job_runs):
+        start = START_TIME + r * 3600
+        elapse = rng.randint(30, 3000)
+        history.append({'start_time': start, 'stop_time': start + elapse,
+                        'elapse_time': elapse, 'status': rng.choice(STATUSES),
+                        'transfer_bytes_per_second': rng.randint(10 ** 4, 10 ** 8),
+                        'upload_bytes_per_second': rng.randint(10 ** 4, 10 ** 8),
+                        'download_bytes_per_second': rng.randint(10 ** 4, 10 ** 8)})
+    with open(path, 'w') as fp:
+        json.dump({'history': history}, fp)
+
+
+def write_engine_logs(log_path, spec: ReportSpec, rng):
+    for k, name in enumerate(rotated_names('engine.log', spec.rotations)):
+        t0 = START_TIME + (spec.rotations - k) * spec.engine_lines
+        with open_log(os.path.join(log_path, name), spec.gzip_rotated and k > 0) as fp:
+            for n in range(spec.engine_lines):
+                ts = format_log_time(t0 + n)
+                if n % 4:
+                    fp.write(f'{ts} DEBUG [worker-{n % 8}] poll queue, {n % 97} pending\n')
+                    continue
+                task = rng.choice(TASKS)
+                size = rng.choice(UPLOAD_SIZES) + rng.randint(0, 1024)
+                fp.write(f"{ts} INFO [scheduler] task submitted: {task}("
+                         f"{{'path': '/share/data/dir{n % 50}/file{rng.randrange(spec.files)}.bin', "
+                         f"'size': {size}, 'mtime': {t0 + n}}})\n")
+
+
+def write_history_logs(log_path, spec: ReportSpec, rng):
+    for k, name in enumerate(rotated_names('syncengine-history.log', spec.rotations)):
+        t0 = START_TIME + (spec.rotations - k) * spec.history_lines
+        with open_log(os.path.join(log_path, name), spec.gzip_rotated and k > 0) as fp:
+            for n in range(spec.history_lines):
+                result = rng.choice(RESULTS)
+                is_dir = rng.random() < 0.1
+                fp.write(json.dumps({
+                    'name': f'/share/data/dir{n % 50}/'
+                            + (f'sub{rng.randrange(20)}' if is_dir
+                               else f'file{rng.randrange(spec.files)}.bin'),
+                    'timestamp': t0 + n * 0.5,
+                    'action': 'mkdir' if is_dir else rng.choice(ACTIONS),
+                    'result': result,
+                    'exception': None if result == 'success' else rng.choice(EXCEPTIONS),
+                    'is_dir': is_dir,
+                }))
+                fp.write('\n')
+
+
+def write_server_log(path, config, spec: ReportSpec, rng):
+    job_ids = [j['_id'] for j in config['jobs']]
+    with open(path, 'w') as fp:
+        for n in range(spec.server_lines):
+            job_id = rng.choice(job_ids)
+            level = rng.choice(LEVELS)
+            fp.write(f'{format_log_time(START_TIME + n * 0.25)} [{level}] '
+                     f'job {job_id} request /v1/jobs/{job_id}/status took '
+                     f'{rng.randint(1, 2000)} ms\n')
+
+
+def generate_report(root, spec: ReportSpec = None):
+    spec = spec or ReportSpec()
+    rng = random.Random(spec.seed)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'qpkg.conf'), 'w') as fp:
+        fp.write('[CloudConnector3]\nName = CloudConnector3\nVersion = 1.2.3\n'
+                 '[HybridBackup]\nName = HybridBackup\nVersion = 3.0.210412\n')
+    with open(os.path.join(root, 'cc3_build_number'), 'w') as fp:
+        fp.write('1570\n')
+
+    config = make_config(spec, rng)
+    with open(os.path.join(root, 'config.json'), 'w') as fp:
+        json.dump(config, fp)
+
+    for job in config['jobs']:
+        if job['_type'] != 'cloud':
+            continue
+        job_path = os.path.join(root, 'data', 'system', job['name'])
+        log_path = os.path.join(job_path, 'log')
+        os.makedirs(log_path, exist_ok=True)
+        write_job_history(os.path.join(job_path, 'job_history.json'), spec, rng)
+        write_engine_logs(log_path, spec, rng)
+        if job['job_type'] == 'sync':
+            write_history_logs(log_path, spec, rng)
+
+    server_path = os.path.join(root, 'cloud', 'server')
+    os.makedirs(server_path, exist_ok=True)
+    write_server_log(os.path.join(server_path, 'server.log'), config, spec, rng)
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', help='Directory of the report to write')
+    defaults = ReportSpec()
+    for name, value in defaults.to_dict().items():
+        option = '--' + name.replace('_', '-')
+        if isinstance(value, bool):
+            parser.add_argument(option, action='store_true', dest=name)
+        else:
+            parser.add_argument(option, type=type(value), default=value, dest=name)
+    args = vars(parser.parse_args())
+    output = args.pop('output')
+    generate_report(output, ReportSpec(**args))
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,233 +1,423 @@
 import argparse
 import os
-import json
-from collections import Counter
-
-from .hbs import HybridBackupSync
-from .account import Account
-from .job import Job, make_job
-from .job_history import JobHistory
-from .job_history_record import (get_upload_bytes_per_second_key,
-                                 get_download_bytes_per_second_key,
-                                 JobHistoryRecord)
-from .sync_file_history import SyncFileHistoryRecord, SyncFileHistory
-
-SYNC_HISTORY_LOG_FILE_NAME = 'syncengine-history.log'
-
-
-def main():
-    parser = argparse.ArgumentParser(description='Analyze the QNAP HBS log')
-    parser.add_argument('hbs_log', help='Path of HBS diagnosis report')
+import sys
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import TYPE_CHECKING
+
+from .chunked_io import DEFAULT_CHUNK_SIZE
+from . import instrument, report_fs
+from .output import FORMATS, make_writer
+from .results import (hbs_summary_result, job_history_result, sync_history_result,
+                      task_result, error_result, refresh_result, fleet_report_result,
+                      fleet_summary_result, format_time, server_log_file_result,
+                      server_log_result, server_log_minute_result, timeline_result)
+
+if TYPE_CHECKING:
+    from .engine_log import TaskCounter, UploadSizeHistogram
+    from .fleet import FleetOptions, FleetSummary
+    from .hbs import HybridBackupSync
+    from .job_history import JobHistory
+    from .report_db import ReportDB
+    from .report_index import ReportIndex
+    from .server_log import ServerLogStats
+
+# Startup time adds up when automation runs the CLI hundreds of times. Each
+# mode imports what it needs when it runs, so --hbs-summary or a query never
+# loads multiprocessing, asyncio, the parse cache or the archive readers.
+# benchmarks/bench_startup.py keeps track of it
+
+
+def add_report_arguments(parser):
     parser.add_argument('--hbs-summary', action='store_true',
                         dest='hbs_summary', help='Print HBS summary')
     parser.add_argument('--job-history', action='store_true',
                         dest='job_history', help='Print Job History')
+    parser.add_argument('--job-stats', action='store_true',
+                        dest='job_stats',
+                        help='Print duration and throughput percentiles and '
+                             'throughput regressions with the job history')
     parser.add_argument('--sync-history', action='store_true',
                         dest='sync_history', help='Analyze sync file action')
     parser.add_argument('--task', action='store_true',
                         dest='task', help='Analyze task')
+    parser.add_argument('--timeline', action='store_true',
+                        help='Charge engine.log tasks and sync actions to the job '
+                             'run they happened in and print per-run task counts, '
+                             'bytes uploaded and failures')
+    parser.add_argument('--top-files', type=int, default=0, dest='top_files',
+                        help='With --sync-history, also list the N most retried '
+                             'files and the N slowest to succeed per job')
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--format', choices=FORMATS, default='text',
+                        help='Print reports as text, a JSON array, JSON Lines '
+                             'or long-format CSV (type, job, field, value)')
+    parser.add_argument('--timings', action='store_true',
+                        help='Print wall/CPU time, bytes, lines and lines/sec per '
+                             'analysis stage and the peak RSS to stderr')
+    parser.add_argument('--trace', help='Write the stage spans to this Chrome trace '
+                                        'JSON file (chrome://tracing, Perfetto)')
+    parser.add_argument('--profile', help='Write cProfile stats of the main process '
+                                          'to this file (read with pstats)')
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description='Analyze the QNAP HBS log. "qnaphbslog query DB ..." '
+                    'queries a database written by --export-db')
+    parser.add_argument('hbs_log', nargs='+',
+                        help='Path of HBS diagnosis report. Several paths or a '
+                             'quoted glob analyze a fleet of reports')
+    add_report_arguments(parser)
+    parser.add_argument('--server-log-stats', action='store_true',
+                        dest='server_log_stats',
+                        help='Analyze server.log per job: records per level, '
+                             'request latency percentiles, busiest error and '
+                             'slowest minutes and the --top error signatures')
+    parser.add_argument('--server-log-minutes', action='store_true',
+                        dest='server_log_minutes',
+                        help='With --server-log-stats, also print every minute bucket')
     parser.add_argument('--replace-job-id-with-name-in-server-log',
                         action='store_true',
                         dest='replace_job_id_with_name_server_log',
                         help='Replace job id with name in server.log')
-    args = parser.parse_args()
-
-    hbs_log_path = args.hbs_log
+    parser.add_argument('--export-sync-records', dest='export_sync_records',
+                        help='Write every sync history record of the sync jobs '
+                             'to this columnar binary file')
+    parser.add_argument('--export-db', dest='export_db',
+                        help='Load jobs, accounts, job runs, sync history records '
+                             'and submitted tasks into this SQLite database '
+                             '(replaced if it exists)')
+    parser.add_argument('--server-log', dest='server_log',
+                        help='server.log to analyze or rewrite instead of the one '
+                             'in the report ("-" reads stdin)')
+    parser.add_argument('-o', '--output', default='server.log',
+                        help='Output path of the rewritten server.log '
+                             '("-" writes stdout)')
+    parser.add_argument('-j', '--jobs', '--workers', type=int, default=None,
+                        dest='workers',
+                        help='Number of worker processes for per-job analysis, or for '
+                             'the reports of a fleet (0 means one per CPU; default 1, '
+                             'one per CPU for a fleet)')
+    parser.add_argument('--async-io', action='store_true', dest='async_io',
+                        help='Read the report with many concurrent I/O requests, '
+                             'for reports on NFS/SMB shares (bypasses the parse cache)')
+    parser.add_argument('--io-concurrency', type=int, dest='io_concurrency',
+                        help='Maximum number of I/O requests in flight with --async-io '
+                             '(default 16)')
+    parser.add_argument('--chunk-size', type=int,
+                        default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        dest='chunk_size_mb',
+                        help='Split log files into chunks of this many MiB '
+                             'for parallel parsing')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='Keep following the logs of a live HBS log '
+                             'directory and re-print --sync-history/--task')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='Seconds between --follow refreshes')
+    parser.add_argument('--follow-count', type=int, default=0,
+                        dest='follow_count',
+                        help='Stop --follow after this many refreshes '
+                             '(0 means never)')
+    parser.add_argument('--no-index-cache', action='store_false',
+                        dest='index_cache',
+                        help='Do not persist the report index between runs')
+    parser.add_argument('--no-parse-cache', action='store_false',
+                        dest='parse_cache',
+                        help='Do not reuse or store parsed log results')
+    parser.add_argument('--fleet', action='store_true',
+                        help='Print merged fleet totals even for a single report')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of most common exceptions and tasks in '
+                             'the fleet summary and of error signatures per job '
+                             'with --server-log-stats')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Directory of the report index and parse cache')
+    add_output_arguments(parser)
+    return parser
+
+
+def parse_utc_time(value):
+    # Epoch seconds or an ISO 8601 time, UTC unless it has an offset
+    try:
+        return float(value)
+    except ValueError:
+        t = datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+
+def make_query_parser():
+    parser = argparse.ArgumentParser(
+        prog='qnaphbslog query',
+        description='Print reports and run indexed queries on a report '
+                    'database written by --export-db')
+    parser.add_argument('db', help='Path of the report database')
+    add_report_arguments(parser)
+    parser.add_argument('--sql', help='Run this read-only SQL query and print the rows')
+    parser.add_argument('--param', action='append', default=list(), dest='params',
+                        help='Value of the next ? placeholder in --sql')
+    parser.add_argument('--files', action='store_true',
+                        help='List sync history records matching the filters below, '
+                             'oldest first')
+    parser.add_argument('--job', help='Only records of this job')
+    parser.add_argument('--action', help='Only records of this action (upload, delete, ...)')
+    parser.add_argument('--result', help='Only records with this result (success, fail)')
+    parser.add_argument('--exception', help='Only records with this exception')
+    parser.add_argument('--since', type=parse_utc_time,
+                        help='Only records at or after this time (ISO 8601 or epoch, UTC)')
+    parser.add_argument('--until', type=parse_utc_time,
+                        help='Only records at or before this time (ISO 8601 or epoch, UTC)')
+    parser.add_argument('--limit', type=int, help='Print at most this many records')
+    add_output_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] and argv[0] in COMMANDS:
+        command_parser, command = COMMANDS[argv[0]]
+        argv = argv[1:]
+    else:
+        command_parser, command = make_parser, run
+    args = command_parser().parse_args(argv)
+
+    if args.timings or args.trace:
+        instrument.enable()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    wall, cpu = time.perf_counter(), time.process_time()
+    writer = make_writer(args.format)
+    try:
+        if profiler is not None:
+            profiler.enable()
+        command(args, writer)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if writer is not None:
+            writer.close()
+        report_fs.close_archives()
+        if args.timings:
+            instrument.print_timings(time.perf_counter() - wall, time.process_time() - cpu)
+        if args.trace:
+            instrument.write_chrome_trace(args.trace)
+
+
+# Options of a single report that the fleet summary has no place for
+FLEET_UNSUPPORTED = [
+    ('hbs_summary', '--hbs-summary'),
+    ('timeline', '--timeline'),
+    ('server_log_stats', '--server-log-stats'),
+    ('server_log_minutes', '--server-log-minutes'),
+    ('replace_job_id_with_name_server_log', '--replace-job-id-with-name-in-server-log'),
+    ('server_log', '--server-log'),
+    ('export_db', '--export-db'),
+    ('export_sync_records', '--export-sync-records'),
+    ('follow', '--follow'),
+    ('async_io', '--async-io'),
+    ('io_concurrency', '--io-concurrency'),
+    ('top_files', '--top-files'),
+]
+
+
+def run(args, writer=None):
+    hbs_log_paths = report_fs.expand_report_paths(args.hbs_log)
+    if args.fleet or len(hbs_log_paths) > 1:
+        unsupported = [flag for dest, flag in FLEET_UNSUPPORTED if getattr(args, dest)]
+        if unsupported:
+            make_parser().error(f'{", ".join(unsupported)} cannot be used with several '
+                                f'reports or --fleet')
+        run_fleet(args, hbs_log_paths, writer)
+        return
+    if len(hbs_log_paths) == 0:
+        print(f'{args.hbs_log[0]} not exists')
+        return
+    hbs_log_path = hbs_log_paths[0]
 
     if not os.path.exists(hbs_log_path):
         print(f'{hbs_log_path} not exists')
+        return
+    hbs_log_path = report_fs.find_report_root(hbs_log_path)
+
+    from .analysis import (get_server_log_path, get_hbs_version, get_cc3_version,
+                           get_hbs, load_job_histories, load_sync_histories, load_tasks,
+                           load_timelines)
+    from .parallel import make_executor
+    from .report_index import build_report_index, load_report_index
+
+    reader = None
+    if args.async_io and report_fs.resolve(hbs_log_path)[0] is None:
+        from .async_io import (AsyncReader, load_job_histories_async,
+                               load_sync_histories_async, load_tasks_async)
+        # Archives are read sequentially anyway, only plain directories benefit
+        reader = AsyncReader(args.io_concurrency)
+
+    index = None
+    if args.job_history or args.job_stats or args.sync_history or args.task \
+            or args.timeline or args.export_sync_records or args.export_db:
+        index = load_report_index(hbs_log_path, persist=args.index_cache,
+                                  cache_dir=args.cache_dir,
+                                  build=reader.build_report_index if reader is not None
+                                  else build_report_index)
+
+    hbs = get_hbs(hbs_log_path)
 
     if args.hbs_summary:
-        hbs_version = get_hbs_version(hbs_log_path)
-        cc3_version = get_cc3_version(hbs_log_path)
-        accounts = get_accounts(hbs_log_path)
-        jobs = get_jobs(hbs_log_path)
-        hbs = HybridBackupSync(hbs_version, cc3_version, accounts, jobs)
-        print_hbs_summary(hbs)
-
-    if args.job_history:
-        jobs = get_jobs(hbs_log_path)
-        for job in jobs:
-            job_history_file = get_job_history_file(hbs_log_path, job.name)
-            if job_history_file is None:
-                continue
-            with open(job_history_file, 'r') as fp:
-                content = fp.read()
-
-            job_history = JobHistory()
-            upload_key = get_upload_bytes_per_second_key(job.job_type)
-            download_key = get_download_bytes_per_second_key(job.job_type)
-            for h in json.loads(content)['history']:
-                record = JobHistoryRecord(start_time=h['start_time'],
-                                          elapse_time=h.get('elapse_time'),
-                                          stop_time=h['stop_time'],
-                                          status=h['status'],
-                                          upload_bytes_per_second=h.get(upload_key),
-                                          download_bytes_per_second=h.get(download_key)
-                                          )
-                job_history.add(record)
-
-            print_job_history(job.name, job_history)
-
-    if args.sync_history:
-        jobs = get_jobs(hbs_log_path)
-        for job in jobs:
-            if job.job_type != 'sync':
-                continue
-            job_log_path = get_job_log_path(hbs_log_path, job.name)
-            print_sync_history(job.name, job_log_path)
-
-    if args.task:
-        jobs = get_jobs(hbs_log_path)
-        for job in jobs:
-            print_task(hbs_log_path, job)
+        hbs.hbs_version = get_hbs_version(hbs_log_path)
+        hbs.cc3_build_number = get_cc3_version(hbs_log_path)
+        print_hbs_summary(hbs, writer)
+
+    if args.follow and (args.sync_history or args.task):
+        if reader is not None:
+            reader.close()
+        follow_jobs(index, hbs.jobs, args.sync_history, args.task,
+                    args.interval, args.follow_count, writer, args.top_files)
+        return
+
+    chunk_size = args.chunk_size_mb * 1024 * 1024
+    cache = None
+    if (index is not None or args.server_log_stats) and args.parse_cache and reader is None:
+        from .parse_cache import ParseCache
+        cache = ParseCache.open(args.cache_dir)
+    executor = make_executor(1 if args.workers is None else args.workers)
+    try:
+        job_results = None
+        if args.job_history or args.job_stats or args.timeline:
+            if reader is not None:
+                job_results = load_job_histories_async(reader, index, hbs.jobs)
+            else:
+                job_results = load_job_histories(executor, index, hbs.jobs, cache)
+        if args.job_history or args.job_stats:
+            print_job_histories(job_results, args.job_stats, writer)
+
+        sync_jobs = [job for job in hbs.jobs if job.job_type == 'sync']
+        if args.sync_history:
+            # Per file states are only needed for the --top-files lists
+            track_states = args.top_files > 0
+            if reader is not None:
+                sync_results = load_sync_histories_async(reader, index, sync_jobs,
+                                                         track_states=track_states)
+            else:
+                sync_results = load_sync_histories(executor, index, sync_jobs, chunk_size,
+                                                   cache, track_states=track_states)
+            print_sync_histories(sync_results, writer, args.top_files)
+
+        if args.export_sync_records:
+            from .columnar import export_sync_records
+            export_sync_records(args.export_sync_records,
+                                iter_sync_records(executor, reader, index, sync_jobs,
+                                                  chunk_size))
+
+        if args.task:
+            if reader is not None:
+                task_results = load_tasks_async(reader, index, hbs.jobs)
+            else:
+                task_results = load_tasks(executor, index, hbs.jobs, chunk_size, cache)
+            print_tasks(task_results, writer)
+
+        if args.timeline:
+            print_timelines(load_timelines(executor, index, job_results), writer)
+
+        if args.export_db:
+            from .report_db import export_report_db, print_export_counts
+            counts = export_report_db(args.export_db, hbs_log_path, hbs, index, executor,
+                                      cache)
+            print_export_counts(args.export_db, counts)
+
+        if args.server_log_stats:
+            from .analysis import load_server_log_stats
+            server_log_path = args.server_log or get_server_log_path(hbs_log_path)
+            result = load_server_log_stats(executor, server_log_path, hbs.job_id_name_map,
+                                           chunk_size, cache)
+            if result.ok:
+                print_server_log_stats(server_log_path, result.value,
+                                       hbs.job_id_name_map.values(), args.top,
+                                       args.server_log_minutes, writer)
+            else:
+                print_job_message(None, result.error, writer)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cache is not None:
+            cache.close()
+        if reader is not None:
+            reader.close()
 
     if args.replace_job_id_with_name_server_log:
-        server_log_path = get_server_log_path(hbs_log_path)
-        config = get_config(hbs_log_path)
-        job_id_name_map = get_job_id_name_map(config)
-        with open(server_log_path, 'r') as src_fp, open('server.log', 'w') as dst_fp:
-            for line in src_fp:
-                for job_id in job_id_name_map.keys():
-                    if job_id in line:
-                        line = line.replace(job_id, job_id_name_map[job_id])
-                dst_fp.write(line)
-
-
-def get_server_log_path(hbs_log_path):
-    return os.path.join(hbs_log_path, 'cloud/server/server.log')
-
-
-def get_job_id_name_map(config):
-    job_id_name_map = dict()
-    for j in config['jobs']:
-        if j['_id'] not in job_id_name_map:
-            job_id_name_map[j['_id']] = j['name']
-    return job_id_name_map
-
-
-def print_task(hbs_log_path, job):
-    task_counter = count_task(hbs_log_path, job)
-    total_tasks = 0
-    for count in task_counter.values():
-        total_tasks += count
-
-    file_sizes = get_upload_file_size(hbs_log_path, job)
-    mb = 1024*1024
-    total_upload_files = 0
-    num_file_size_smaller_than_5mb = 0
-    num_file_size_5mb_to_100mb = 0
-    num_file_size_100mb_to_1gb = 0
-    num_file_size_larger_than_1gb = 0
-    for size in file_sizes:
-        total_upload_files += 1
-        if size <= 5*mb:
-            num_file_size_smaller_than_5mb += 1
-        elif size <= 100*mb:
-            num_file_size_5mb_to_100mb += 1
-        elif size <= 1000*mb:
-            num_file_size_100mb_to_1gb += 1
-        else:
-            num_file_size_larger_than_1gb += 1
+        from .server_log import replace_job_id_with_name
+        server_log_path = args.server_log or get_server_log_path(hbs_log_path)
+        replace_job_id_with_name(server_log_path, args.output, hbs.job_id_name_map)
+
+
+def print_job_error(job_name, error, writer=None):
+    if writer is not None:
+        writer.write(error_result(job_name, error))
+        return
+    print(f'Job Name: {job_name}, analyze failed: {error}')
+
+
+def print_job_message(job_name, message, writer=None):
+    if writer is not None:
+        writer.write(error_result(job_name, message))
+        return
+    print(message)
+
 
+def print_job_histories(job_results, stats=False, writer=None):
+    for job, result in job_results:
+        if not result.ok:
+            print_job_error(job.name, result.error, writer)
+            continue
+        print_job_history_report(job.name, result.value, stats, writer)
+
+
+def print_job_history_report(job_name, job_history: 'JobHistory', stats=False, writer=None):
+    if writer is not None:
+        writer.write(job_history_result(job_name, job_history, stats))
+        return
+    print_job_history(job_name, job_history)
+    if stats:
+        print_job_history_stats(job_history)
+
+
+def print_tasks(task_results, writer=None):
+    for job, result in task_results:
+        if not result.ok:
+            print_job_error(job.name, result.error, writer)
+            continue
+        task_counter, upload_size_histogram = result.value
+        print_task(job, task_counter, upload_size_histogram, writer)
+
+
+@instrument.timed('render: task')
+def print_task(job, task_counter: 'TaskCounter',
+               upload_size_histogram: 'UploadSizeHistogram', writer=None):
+    if writer is not None:
+        writer.write(task_result(job, task_counter, upload_size_histogram))
+        return
+    buckets = ''.join(f'\n    {label}: {count}'
+                      for label, count in upload_size_histogram.buckets())
     print(f'{job}\n'
-          f'  Total submit {total_tasks} tasks\n'
+          f'  Total submit {task_counter.total()} tasks\n'
           f'  Most common task: {task_counter.most_common(3)}\n'
-          f'  Upload {total_upload_files} files\n'
-          f'    ~5MB: {num_file_size_smaller_than_5mb}\n'
-          f'    5MB~100MB: {num_file_size_5mb_to_100mb}\n'
-          f'    100MB~1GB: {num_file_size_100mb_to_1gb}\n'
-          f'    1GB~: {num_file_size_larger_than_1gb}'
+          f'  Upload {upload_size_histogram.total()} files'
+          f'{buckets}'
           )
 
 
-def count_task(hbs_log_path, job):
-    task_counter = Counter()
-    for file in list_job_log_file(hbs_log_path, job.name):
-        with open(file, 'r') as fp:
-            for line in fp:
-                if 'task submitted:' not in line:
-                    continue
-                task_name = get_task_name(line)
-                task_counter.update({task_name: 1})
-    return task_counter
-
-
-def get_upload_file_size(hbs_log_path, job):
-    file_sizes = list()
-    for file in list_job_log_file(hbs_log_path, job.name):
-        with open(file, 'r') as fp:
-            for line in fp:
-                if 'task submitted:' not in line:
-                    continue
-                task_name = get_task_name(line)
-                if task_name == 'UploadTask':
-                    size = get_upload_size(line)
-                    file_sizes.append(size)
-    return file_sizes
-
-
-def get_upload_size(line):
-    size = int(line[line.find("'size': ") + len("'size': "):].split(',')[0])
-    return size
-
-
-def get_task_name(line):
-    start = line.find('task submitted: ') + len('task submitted: ')
-    end = line.find('(')
-    return line[start:end]
-
-
-def get_hbs_version(hbs_log_path):
-    qpkg_conf_path = os.path.join(hbs_log_path, 'qpkg.conf')
-    with open(qpkg_conf_path, 'r') as fp:
-        hbs_section = False
-        for line in fp:
-            if '[HybridBackup]' in line:
-                hbs_section = True
-            if hbs_section and 'Version' in line:
-                hbs_version = line.split()[-1]
-                return hbs_version
-
-
-def get_cc3_version(hbs_log_path):
-    cc3_build_number_path = os.path.join(hbs_log_path, 'cc3_build_number')
-    with open(cc3_build_number_path, 'r') as fp:
-        cc3_build_number = int(fp.read())
-    return cc3_build_number
-
-
-def get_accounts(hbs_log_path):
-    config = get_config(hbs_log_path)
-    accounts = list()
-    for acc in config['accounts']:
-        if acc['_type'] == 'cloud':
-            account = Account(_id=acc['_id'],
-                              provider_type=acc['remote.provider_type'],
-                              name=acc['name'])
-            accounts.append(account)
-    return accounts
-
-
-def get_jobs(hbs_log_path):
-    config = get_config(hbs_log_path)
-    jobs = list()
-    for j in config['jobs']:
-        job = make_job(j)
-        if job:
-            jobs.append(job)
-    return jobs
-
-
-def get_config(hbs_log_path):
-    config_path = os.path.join(hbs_log_path, 'config.json')
-    with open(config_path, 'r') as fp:
-        content = fp.read()
-        config = json.loads(content)
-    return config
-
-
-def print_hbs_summary(hbs: HybridBackupSync):
+@instrument.timed('render: hbs summary')
+def print_hbs_summary(hbs: 'HybridBackupSync', writer=None):
+    if writer is not None:
+        writer.write(hbs_summary_result(hbs))
+        return
     print('HybridBackupSync Summary')
     print(f'HBS version: {hbs.hbs_version}')
     print(f'CC3 version: {hbs.cc3_build_number}')
@@ -243,17 +433,7 @@ def print_hbs_summary(hbs: HybridBackupSync):
             print(f'  {job} provider type: {account.provider_type}')
 
 
-def get_job_history_file(hbs_log_path, job_name):
-    for root, dirs, files in os.walk(hbs_log_path):
-        if not root.endswith('system'):
-            continue
-        for dir in dirs:
-            if dir == job_name:
-                job_path = os.path.join(root, dir)
-                job_history_path = os.path.join(job_path, 'job_history.json')
-                return job_history_path
-
-
+@instrument.timed('render: job history')
 def print_job_history(job_name, job_history):
     print(f'Job Name: {job_name}, '
           f'total run {job_history.total_run_times()} times, '
@@ -262,95 +442,464 @@ def print_job_history(job_name, job_history):
           f'stopped: {job_history.total_stop_times()}')
 
 
-def get_job_log_path(hbs_log_path, job_name):
-    for root, dirs, files in os.walk(hbs_log_path):
-        if not root.endswith('system'):
-            continue
-        for dir in dirs:
-            if dir == job_name:
-                job_path = os.path.join(root, dir)
-                job_log_path = os.path.join(job_path, 'log')
-                return job_log_path
+def format_percentiles(percentiles, fmt):
+    return ', '.join(f'p{p}: {fmt(v)}' for p, v in percentiles.items() if v is not None)
 
 
-def print_sync_history(job_name, log_path):
-    if not os.path.exists(log_path):
-        print(f'{log_path} not exists')
-        return
-
-    history_paths = get_history_paths(log_path)
-    if len(history_paths) == 0:
-        print(f'{SYNC_HISTORY_LOG_FILE_NAME} not exist under {log_path}')
-        return
+def format_duration(seconds):
+    return f'{seconds:.0f}s'
 
-    job_history = get_job_history(history_paths)
-    print_sync_history_report(job_name, job_history)
 
+def format_throughput(bytes_per_second):
+    return f'{bytes_per_second / (1024 * 1024):.2f}MB/s'
 
-def get_history_paths(log_path):
-    return get_log_paths(log_path, SYNC_HISTORY_LOG_FILE_NAME)
 
-
-def get_log_paths(log_path, log_name):
-    paths = list()
-    for f in os.listdir(log_path):
-        if log_name in f:
-            paths.append(os.path.join(log_path, f))
-    return paths
+@instrument.timed('render: job stats')
+def print_job_history_stats(job_history: 'JobHistory', regressions=True):
+    durations = job_history.percentiles('elapse_time')
+    if any(v is not None for v in durations.values()):
+        print(f'  duration {format_percentiles(durations, format_duration)}')
+    for field, label in (('upload_bytes_per_second', 'upload'),
+                         ('download_bytes_per_second', 'download')):
+        throughput = job_history.percentiles(field)
+        if all(v is None for v in throughput.values()):
+            continue
+        print(f'  {label} {format_percentiles(throughput, format_throughput)}')
+        if not regressions:
+            continue
+        for r in job_history.detect_regressions(field):
+            print(f'    regression at run {r.run} (start {r.start_time}): '
+                  f'{format_throughput(r.value)}, '
+                  f'{r.ratio:.0%} of rolling median {format_throughput(r.baseline)}')
 
 
-def get_job_history(history_paths) -> SyncFileHistory:
-    job_history = SyncFileHistory()
-    for p in history_paths:
-        with open(p, 'r') as fp:
-            for line in fp:
-                h = json.loads(line)
-                history_record = SyncFileHistoryRecord(name=h['name'],
-                                                       timestamp=h['timestamp'],
-                                                       action=h['action'],
-                                                       result=h['result'],
-                                                       exception=h['exception'],
-                                                       is_dir=h['is_dir'])
-                job_history.add_history(history_record)
-    return job_history
+def print_sync_histories(sync_results, writer=None, top_files=0):
+    for job, message, result in sync_results:
+        if message is not None:
+            print_job_message(job.name, message, writer)
+            continue
+        if not result.ok:
+            print_job_error(job.name, result.error, writer)
+            continue
+        print_sync_history_report(job.name, result.value, writer, top_files)
 
 
-def print_sync_history_report(job_name, job_history):
-    jh = job_history
-    print(f'Job Name: {job_name}')
-    if jh.total_files() == 0:
+def iter_sync_records(executor, reader, index, jobs, chunk_size):
+    # Record columns are far bigger than the aggregates: load one job at a
+    # time, outside the parse cache, and let it go once it is written
+    for job in jobs:
+        if reader is not None:
+            from .async_io import load_sync_histories_async
+            results = load_sync_histories_async(reader, index, [job], keep_records=True)
+        else:
+            from .analysis import load_sync_histories
+            results = load_sync_histories(executor, index, [job], chunk_size,
+                                          keep_records=True)
+        _, message, result = results[0]
+        del results
+        if message is None and result.ok:
+            yield job.name, result.value
+        del result
+
+
+def print_sync_history_report(job_name, job_history, writer=None, top_files=0):
+    with instrument.span('query: sync history'):
+        summary = sync_history_result(job_name, job_history, top_files)
+    print_sync_history_summary(summary, writer)
+
+
+@instrument.timed('render: sync history')
+def print_sync_history_summary(summary, writer=None):
+    if writer is not None:
+        writer.write(summary)
+        return
+    print(f'Job Name: {summary["job"]}')
+    if summary['total_files'] == 0:
         print('No Sync History')
         return
-    print(f'Sync History from {jh.start_time()} to {jh.end_time()}')
-    print(f'* Total sync: {jh.total_sync()}')
-    print(f'* Total files: {jh.total_files()}')
-    print(f'* Total folders: {jh.total_folders()}')
+    print(f'Sync History from {datetime.fromisoformat(summary["start_time"])} '
+          f'to {datetime.fromisoformat(summary["end_time"])}')
+    print(f'* Total sync: {summary["total_sync"]}')
+    print(f'* Total files: {summary["total_files"]}')
+    print(f'* Total folders: {summary["total_folders"]}')
     print('\nAction summary:')
-    for action in jh.action_types():
-        sync_count =jh.total_sync(action=action)
-        total_files = jh.get_files(action=action)
-        success_files = jh.get_files(action=action, result='success')
-        fail_files = jh.get_files(action=action, result='fail')
-
-        print(f'* [{action.upper()}] try {sync_count} times, '
-              f'total files: {len(total_files)}, '
-              f'success: {len(success_files)}, '
-              f'fail: {len(fail_files.difference(success_files))}')
-    if len(jh.exception_types()) == 0:
+    for action in summary['actions']:
+        print(f'* [{action["action"].upper()}] try {action["sync"]} times, '
+              f'total files: {action["files"]}, '
+              f'success: {action["success"]}, '
+              f'fail: {action["fail"]}')
+    if len(summary['exceptions']) == 0:
         print('\nNo exception')
     else:
         print('\nException summary:')
-        for exception in jh.exception_types():
-            print(f'* {exception}: happens {len(jh.get_sync(exception=exception))} times')
+        for exception in summary['exceptions']:
+            print(f'* {exception["exception"]}: happens {exception["count"]} times')
+    if 'most_retried' in summary:
+        print('\nMost retried files:')
+        for state in summary['most_retried']:
+            exception = f' ({state["last_exception"]})' if state['last_exception'] else ''
+            print(f'* [{state["action"].upper()}] {state["name"]}: '
+                  f'{state["attempts"]} attempts, {state["failures"]} failed, '
+                  f'last {state["last_result"]}{exception} at '
+                  f'{datetime.fromisoformat(state["last_time"])}')
+        print('\nSlowest to succeed:')
+        for state in summary['slowest_to_succeed']:
+            print(f'* [{state["action"].upper()}] {state["name"]}: '
+                  f'{format_duration(state["time_to_success"])} after the first attempt, '
+                  f'{state["attempts"]} attempts')
+
+
+def print_timelines(timeline_results, writer=None):
+    for job, result in timeline_results:
+        if result.ok:
+            with instrument.span('query: timeline'):
+                summary = timeline_result(job.name, result.value)
+            print_timeline_summary(summary, writer)
+        else:
+            print_job_error(job.name, result.error, writer)
+
+
+def format_run_activity(run):
+    tasks = ', '.join(f'{name}: {count}' for name, count in run['task_counts'].items())
+    return (f'{run["tasks"]} tasks ({tasks or "none"}), '
+            f'{run["upload_bytes"] / (1024 * 1024):.2f}MB uploaded, '
+            f'{run["sync_actions"]} sync actions, {run["sync_failures"]} failed')
+
+
+@instrument.timed('render: timeline')
+def print_timeline_summary(summary, writer=None):
+    if writer is not None:
+        writer.write(summary)
+        return
+    print(f'Job Name: {summary["job"]}')
+    if summary['events'] == 0:
+        print('No task or sync action\n')
+        return
+    print(f'Timeline from {datetime.fromisoformat(summary["first_event"])} '
+          f'to {datetime.fromisoformat(summary["last_event"])}: {summary["events"]} events, '
+          f'{len(summary["runs"])} of {summary["total_runs"]} runs in the logged period')
+    for run in summary['runs']:
+        stop = run['stop_time']
+        stop = datetime.fromisoformat(stop) if stop is not None else 'running'
+        print(f'* Run {run["run"]} {datetime.fromisoformat(run["start_time"])} ~ {stop} '
+              f'[{run["status"]}]: {format_run_activity(run)}')
+    outside = summary['outside_runs']
+    if outside['tasks'] or outside['sync_actions']:
+        print(f'* Outside runs: {format_run_activity(outside)}')
+    print()
+
+
+def print_server_log_stats(path, stats: 'ServerLogStats', job_names, top=10, minutes=False,
+                           writer=None):
+    print_server_log_file(server_log_file_result(path, stats), writer)
+    # Jobs in config order, lines without a known job id last
+    names = [name for name in dict.fromkeys(job_names) if name in stats.jobs]
+    if None in stats.jobs:
+        names.append(None)
+    for name in names:
+        job = stats.jobs[name]
+        with instrument.span('query: server log'):
+            summary = server_log_result(name, job, top)
+        print_server_log_summary(summary, writer)
+        if minutes:
+            for minute in sorted(job.minutes):
+                print_server_log_minute(
+                    server_log_minute_result(name, minute, job.minutes[minute]), writer)
+
+
+def print_server_log_file(summary, writer=None):
+    if writer is not None:
+        writer.write(summary)
+        return
+    print(f'Server log {summary["path"]}: {summary["lines"]} lines, '
+          f'{summary["continuation_lines"]} continuation lines, {summary["jobs"]} jobs\n')
+
 
+def format_levels(levels):
+    return ', '.join(f'{level}: {count}' for level, count in levels.items() if count)
 
-def list_job_log_file(hbs_log_path, job_name):
-    for root, dirs, files in os.walk(hbs_log_path):
-        if not root.endswith(f'{job_name}/log'):
+
+def format_latency(latency):
+    if latency['count'] == 0:
+        return 'no request latency'
+    return (f'{latency["count"]} requests, mean {latency["mean"]:.0f} ms, '
+            f'p50/p95/p99 {latency["p50"]:.0f}/{latency["p95"]:.0f}/{latency["p99"]:.0f} ms, '
+            f'max {latency["max"]:.0f} ms')
+
+
+@instrument.timed('render: server log')
+def print_server_log_summary(summary, writer=None):
+    if writer is not None:
+        writer.write(summary)
+        return
+    print(f'Job Name: {summary["job"] or "(no job)"}')
+    print(f'Server log from {datetime.fromisoformat(summary["start_minute"])} '
+          f'to {datetime.fromisoformat(summary["end_minute"])}, '
+          f'{summary["minutes"]} active minutes')
+    print(f'* Records: {summary["records"]} ({format_levels(summary["levels"])})')
+    print(f'* Latency: {format_latency(summary["latency"])}')
+    if summary['error_minutes']:
+        print('\nBusiest error minutes:')
+        for minute in summary['error_minutes']:
+            print(f'* {datetime.fromisoformat(minute["minute"])}: {minute["errors"]} errors')
+    if summary['slowest_minutes']:
+        print('\nSlowest minutes:')
+        for minute in summary['slowest_minutes']:
+            print(f'* {datetime.fromisoformat(minute["minute"])}: p95 {minute["p95"]:.0f} ms, '
+                  f'{minute["requests"]} requests')
+    if len(summary['error_signatures']) == 0:
+        print('\nNo error')
+    else:
+        print('\nError signatures:')
+        for signature in summary['error_signatures']:
+            # Counts with an error are upper bounds, the log had more signatures than tracked
+            bound = f' (at most {signature["error"]} over)' if signature['error'] else ''
+            print(f'* {signature["signature"]}: happens {signature["count"]} times{bound}')
+    print()
+
+
+def print_server_log_minute(summary, writer=None):
+    if writer is not None:
+        writer.write(summary)
+        return
+    latency = summary['latency']
+    p95 = f', p95 {latency["p95"]:.0f} ms' if latency['count'] else ''
+    print(f'{datetime.fromisoformat(summary["minute"])} {summary["job"] or "(no job)"}: '
+          f'{summary["records"]} records ({format_levels(summary["levels"])}), '
+          f'{latency["count"]} requests{p95}')
+
+
+def run_query(args, writer=None):
+    import sqlite3
+    from .report_db import JOB_HISTORY, SYNC_HISTORY, TASK, ReportDB
+    try:
+        db = ReportDB(args.db)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(e)
+        return
+    try:
+        hbs = db.hbs()
+        if args.hbs_summary:
+            print_hbs_summary(hbs, writer)
+
+        if args.job_history or args.job_stats:
+            errors = db.errors(JOB_HISTORY)
+            for job in hbs.jobs:
+                if job.name in errors:
+                    print_job_error(job.name, errors[job.name][0], writer)
+                elif db.has_job_history(job.name):
+                    with instrument.span('query: job history'):
+                        job_history = db.job_history(job.name)
+                    print_job_history_report(job.name, job_history, args.job_stats, writer)
+
+        if args.sync_history:
+            errors = db.errors(SYNC_HISTORY)
+            for job in hbs.get_job_by_type('sync'):
+                if job.name in errors:
+                    error, failed = errors[job.name]
+                    if failed:
+                        print_job_error(job.name, error, writer)
+                    else:
+                        print_job_message(job.name, error, writer)
+                    continue
+                with instrument.span('query: sync history'):
+                    summary = db.sync_history_result(job.name, args.top_files)
+                print_sync_history_summary(summary, writer)
+
+        if args.task:
+            errors = db.errors(TASK)
+            for job in hbs.jobs:
+                if job.name in errors:
+                    print_job_error(job.name, errors[job.name][0], writer)
+                    continue
+                with instrument.span('query: task'):
+                    aggregators = db.task_aggregators(job.name)
+                print_task(job, *aggregators, writer)
+
+        if args.files:
+            with instrument.span('query: sync files'):
+                print_sync_files(db.sync_files(args.job, args.action, args.result,
+                                               args.exception, args.since, args.until,
+                                               args.limit), writer)
+
+        if args.sql:
+            with instrument.span('query: sql'):
+                print_sql(db, args.sql, args.params, writer)
+    finally:
+        db.close()
+
+
+def print_sync_files(records, writer=None):
+    for record in records:
+        if writer is not None:
+            writer.write(record)
             continue
-        for file in files:
-            if 'engine.log' in file:
-                yield os.path.join(root, file)
+        t = format_time(datetime.utcfromtimestamp(record['timestamp']))
+        exception = f' {record["exception"]}' if record['exception'] is not None else ''
+        print(f'{t} {record["job"]} [{record["action"].upper()}] {record["result"]} '
+              f'{record["name"]}{exception}')
+
+
+def print_sql(db: 'ReportDB', sql, params, writer=None):
+    import sqlite3
+    try:
+        cursor = db.execute(sql, params)
+    except sqlite3.Error as e:
+        print(f'Query failed: {e}', file=sys.stderr)
+        return
+    if cursor.description is None:
+        return
+    columns = [d[0] for d in cursor.description]
+    if writer is None:
+        print('\t'.join(columns))
+    for row in cursor:
+        if writer is not None:
+            record = {'type': 'row'}
+            record.update(zip(columns, row))
+            writer.write(record)
+        else:
+            print('\t'.join('' if v is None else str(v) for v in row))
+
+
+def follow_jobs(index: 'ReportIndex', jobs, sync_history, task, interval, count=0,
+                writer=None, top_files=0):
+    from .analysis import add_sync_history_data, new_sync_file_history
+    from .engine_log import make_aggregators, scan_engine_data
+    from .follow import LogFollower, list_log_files
+    from .report_index import ENGINE_LOG_FILE_NAME, SYNC_HISTORY_LOG_FILE_NAME
+    followers = list()
+    sync_reports = list()
+    task_reports = list()
+    for job in jobs:
+        job_files = index.get_job(job.name)
+        if job_files is None:
+            continue
+        if sync_history and job.job_type == 'sync':
+            job_history = new_sync_file_history(track_states=top_files > 0)
+            followers.append(LogFollower(
+                partial(list_log_files, job_files.log_path, SYNC_HISTORY_LOG_FILE_NAME),
+                partial(add_sync_history_data, job_history)))
+            sync_reports.append(partial(print_sync_history_report, job.name, job_history,
+                                        writer=writer, top_files=top_files))
+        if task:
+            aggregators = make_aggregators()
+            followers.append(LogFollower(
+                partial(list_log_files, job_files.log_path, ENGINE_LOG_FILE_NAME),
+                lambda path, data, aggregators=aggregators: scan_engine_data(data, aggregators)))
+            task_reports.append(partial(print_task, job, *aggregators, writer=writer))
+
+    refreshes = 0
+    try:
+        while True:
+            for follower in followers:
+                follower.poll()
+            if writer is not None:
+                writer.write(refresh_result(datetime.now()))
+            else:
+                print(f'=== {datetime.now():%Y-%m-%d %H:%M:%S} ===')
+            for report in sync_reports + task_reports:
+                report()
+            refreshes += 1
+            if count and refreshes >= count:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_fleet(args, hbs_log_paths, writer=None):
+    if len(hbs_log_paths) == 0:
+        print(f'No report matches {" ".join(args.hbs_log)}')
+        return
+    from .fleet import FleetOptions, analyze_fleet
+    from .parallel import make_executor
+    options = FleetOptions(job_history=args.job_history or args.job_stats,
+                           sync_history=args.sync_history, task=args.task,
+                           chunk_size=args.chunk_size_mb * 1024 * 1024,
+                           index_cache=args.index_cache, parse_cache=args.parse_cache,
+                           cache_dir=args.cache_dir)
+    # Reports are independent, by default each CPU analyzes one at a time
+    workers = args.workers
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(hbs_log_paths))
+    executor = make_executor(workers)
+    try:
+        fleet = analyze_fleet(executor, hbs_log_paths, options)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print_fleet_summary(fleet, options, args.job_stats, args.top, writer)
+
+
+@instrument.timed('render: fleet summary')
+def print_fleet_summary(fleet: 'FleetSummary', options: 'FleetOptions', stats=False, top=10,
+                        writer=None):
+    if writer is not None:
+        for report in fleet.reports:
+            writer.write(fleet_report_result(report))
+        writer.write(fleet_summary_result(fleet, options, stats, top))
+        return
+    print(f'Fleet Summary: {len(fleet.reports) + len(fleet.failed)} reports, '
+          f'analyzed: {len(fleet.reports)}, failed: {len(fleet.failed)}')
+    for path, error in fleet.failed:
+        print(f'  {path} analyze failed: {error}')
+
+    print('\nPer report:')
+    for report in fleet.reports:
+        parts = [f'jobs: {report.jobs}']
+        if report.job_history is not None:
+            jh = report.job_history
+            parts.append(f'runs: {jh.total_run_times()}, '
+                         f'fail: {jh.total_fail_times()}')
+        if report.sync is not None:
+            parts.append(f'sync: {report.sync.total_sync}, '
+                         f'exceptions: {sum(report.sync.exceptions.values())}')
+        if report.aggregators is not None:
+            parts.append(f'tasks: {report.aggregators[0].total()}')
+        print(f'* {report.path} {", ".join(parts)}')
+        for error in report.errors:
+            print(f'    analyze failed: {error}')
+
+    if options.job_history:
+        print()
+        print_job_history('(fleet)', fleet.job_history)
+        if stats:
+            # Runs of different jobs are interleaved, a rolling median means nothing
+            print_job_history_stats(fleet.job_history, regressions=False)
+
+    if options.sync_history:
+        sync = fleet.sync
+        print(f'\nFleet sync history\n'
+              f'* Total sync: {sync.total_sync}\n'
+              f'* Total files: {sync.total_files}\n'
+              f'* Total folders: {sync.total_folders}')
+        for action, sync_count in sync.action_sync.items():
+            print(f'* [{action.upper()}] try {sync_count} times, '
+                  f'total files: {sync.action_files[action]}, '
+                  f'success: {sync.action_success[action]}, '
+                  f'fail: {sync.action_fail[action]}')
+        if len(sync.exceptions) == 0:
+            print('\nNo exception')
+        else:
+            print('\nMost common exceptions:')
+            for exception, count in sync.exceptions.most_common(top):
+                print(f'* {exception}: happens {count} times in '
+                      f'{fleet.exception_reports[exception]} reports')
+
+    if options.task:
+        task_counter, upload_size_histogram = fleet.aggregators
+        buckets = ''.join(f'\n    {label}: {count}'
+                          for label, count in upload_size_histogram.buckets())
+        print(f'\nFleet tasks\n'
+              f'  Total submit {task_counter.total()} tasks\n'
+              f'  Most common task: {task_counter.most_common(top)}\n'
+              f'  Upload {upload_size_histogram.total()} files'
+              f'{buckets}')
+
+
+COMMANDS = {
+    'query': (make_query_parser, run_query),
+}
 
 
 if __name__ == '__main__':
@@ -1,5 +1,19 @@
+from typing import Optional
+
+
 class Account:
+    __slots__ = ('id', 'provider_type', 'name')
+
     def __init__(self, _id, provider_type, name):
         self.id = _id
         self.provider_type = provider_type
         self.name = name
+
+
+def make_account(account_conf) -> Optional[Account]:
+    if account_conf['_type'] != 'cloud':
+        return None
+
+    return Account(_id=account_conf['_id'],
+                   provider_type=account_conf['remote.provider_type'],
+                   name=account_conf['name'])
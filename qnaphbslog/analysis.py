@@ -0,0 +1,247 @@
+import json
+import os
+from functools import partial
+from typing import List, Optional, Tuple
+
+from . import instrument, report_fs
+from .chunked_io import DEFAULT_CHUNK_SIZE, iter_file_lines, iter_lines
+from .engine_log import analyze_engine_log, make_aggregators, merge_aggregators
+from .hbs import HybridBackupSync
+from .job import Job
+from .job_history import JobHistory
+from .job_history_record import (get_upload_bytes_per_second_key,
+                                 get_download_bytes_per_second_key,
+                                 JobHistoryRecord)
+from .parallel import TaskResult, run_parallel
+from .parsers import iter_history_rows
+from .report_index import SYNC_HISTORY_LOG_FILE_NAME, ReportIndex
+from .sync_file_history import SyncFileHistory
+
+JobResult = Tuple[Job, TaskResult]
+SyncHistoryResult = Tuple[Job, Optional[str], TaskResult]
+
+
+def get_server_log_path(hbs_log_path):
+    return os.path.join(hbs_log_path, 'cloud/server/server.log')
+
+
+def get_hbs_version(hbs_log_path):
+    qpkg_conf_path = os.path.join(hbs_log_path, 'qpkg.conf')
+    with report_fs.open_text(qpkg_conf_path) as fp:
+        hbs_section = False
+        for line in fp:
+            if '[HybridBackup]' in line:
+                hbs_section = True
+            if hbs_section and 'Version' in line:
+                hbs_version = line.split()[-1]
+                return hbs_version
+
+
+def get_cc3_version(hbs_log_path):
+    cc3_build_number_path = os.path.join(hbs_log_path, 'cc3_build_number')
+    with report_fs.open_text(cc3_build_number_path) as fp:
+        cc3_build_number = int(fp.read())
+    return cc3_build_number
+
+
+def get_hbs(hbs_log_path) -> HybridBackupSync:
+    return HybridBackupSync.from_config(get_config(hbs_log_path))
+
+
+def get_config(hbs_log_path):
+    config_path = os.path.join(hbs_log_path, 'config.json')
+    with instrument.span('discovery: config.json') as s:
+        with report_fs.open_binary(config_path) as fp:
+            content = fp.read()
+        s.add(bytes=len(content))
+        return json.loads(content)
+
+
+def get_job_history_file(index: ReportIndex, job_name):
+    job_files = index.get_job(job_name)
+    if job_files is None:
+        return None
+    return job_files.job_history_path
+
+
+def get_job_log_path(index: ReportIndex, job_name):
+    job_files = index.get_job(job_name)
+    if job_files is None:
+        return None
+    return job_files.log_path
+
+
+def get_history_paths(index: ReportIndex, job_name):
+    job_files = index.get_job(job_name)
+    if job_files is None:
+        return list()
+    return job_files.sync_history_logs
+
+
+def list_job_log_file(index: ReportIndex, job_name):
+    job_files = index.get_job(job_name)
+    if job_files is None:
+        return list()
+    return job_files.engine_logs
+
+
+@instrument.timed('parse: job_history.json')
+def load_job_history(job_history_file, job_type) -> JobHistory:
+    with report_fs.open_binary(job_history_file) as fp:
+        content = fp.read()
+    instrument.count(bytes=len(content))
+    job_history = parse_job_history(content, job_type)
+    instrument.count(lines=job_history.total_run_times())
+    return job_history
+
+
+def parse_job_history(content: bytes, job_type) -> JobHistory:
+    job_history = JobHistory()
+    upload_key = get_upload_bytes_per_second_key(job_type)
+    download_key = get_download_bytes_per_second_key(job_type)
+    for h in json.loads(content)['history']:
+        record = JobHistoryRecord(start_time=h['start_time'],
+                                  elapse_time=h.get('elapse_time'),
+                                  stop_time=h['stop_time'],
+                                  status=h['status'],
+                                  upload_bytes_per_second=h.get(upload_key),
+                                  download_bytes_per_second=h.get(download_key)
+                                  )
+        job_history.add(record)
+    return job_history
+
+
+def load_job_histories(executor, index: ReportIndex, jobs, cache=None) -> List[JobResult]:
+    # The parse cache brings in sqlite3 and pickle, config-only modes skip it
+    from .parse_cache import get_cached_value
+    loads = list()
+    for job in jobs:
+        job_history_file = get_job_history_file(index, job.name)
+        if job_history_file is None:
+            continue
+        kind = f'job_history:{job.job_type}'
+        try:
+            job_history, signature = get_cached_value(cache, job_history_file, kind)
+        except OSError:
+            job_history, signature = None, None
+        loads.append((job, job_history_file, kind, job_history, signature))
+
+    misses = [(path, job.job_type) for job, path, _, cached, _ in loads if cached is None]
+    results = iter(run_parallel(executor, load_job_history, misses))
+    job_results = list()
+    for job, path, kind, job_history, signature in loads:
+        if job_history is None:
+            result = next(results)
+            if result.ok and cache is not None and signature is not None:
+                cache.put(path, kind, signature, signature.size, result.value)
+        else:
+            result = TaskResult(value=job_history)
+        job_results.append((job, result))
+    if cache is not None:
+        cache.commit()
+    return job_results
+
+
+def new_sync_file_history(keep_records=False, track_states=False) -> SyncFileHistory:
+    return SyncFileHistory(keep_records=keep_records, track_states=track_states)
+
+
+def get_job_history(history_paths) -> SyncFileHistory:
+    job_history = new_sync_file_history()
+    for p in history_paths:
+        load_sync_history_chunk(p, job_history=job_history)
+    return job_history
+
+
+def merge_sync_file_history(job_history: SyncFileHistory, other: SyncFileHistory):
+    job_history.merge(other)
+    return job_history
+
+
+def load_sync_history_chunk(path, start=0, end=None, job_history=None,
+                            keep_records=False, track_states=False) -> SyncFileHistory:
+    if job_history is None:
+        job_history = new_sync_file_history(keep_records, track_states)
+    with instrument.span('parse: syncengine-history.log') as s:
+        rows = len(job_history)
+        for row in iter_history_rows(iter_file_lines(path, start, end)):
+            job_history.add(*row)
+        s.add(lines=len(job_history) - rows)
+    return job_history
+
+
+def add_sync_history_data(job_history: SyncFileHistory, path, data: bytes):
+    for row in iter_history_rows(iter_lines(data)):
+        job_history.add(*row)
+
+
+def find_sync_history_logs(index: ReportIndex, job) -> Tuple[Optional[str], List[str]]:
+    log_path = get_job_log_path(index, job.name)
+    if log_path is None or not report_fs.exists(log_path):
+        return f'{log_path} not exists', list()
+    history_paths = get_history_paths(index, job.name)
+    if len(history_paths) == 0:
+        return f'{SYNC_HISTORY_LOG_FILE_NAME} not exist under {log_path}', list()
+    return None, history_paths
+
+
+def load_sync_histories(executor, index: ReportIndex, jobs,
+                        chunk_size=DEFAULT_CHUNK_SIZE, cache=None,
+                        keep_records=False, track_states=False) -> List[SyncHistoryResult]:
+    from .parse_cache import load_log_files
+    loads = [(job, *find_sync_history_logs(index, job)) for job in jobs]
+
+    groups = [paths for _, _, paths in loads]
+    parse = partial(load_sync_history_chunk, keep_records=keep_records,
+                    track_states=track_states)
+    new = partial(new_sync_file_history, keep_records, track_states)
+    kind = 'sync_records' if keep_records else 'sync_history'
+    if track_states:
+        kind += ':states'
+    results = load_log_files(executor, cache, kind, parse, new,
+                             merge_sync_file_history, groups, chunk_size)
+    return [(job, message, result) for (job, message, _), result in zip(loads, results)]
+
+
+def load_tasks(executor, index: ReportIndex, jobs, chunk_size=DEFAULT_CHUNK_SIZE,
+               cache=None) -> List[JobResult]:
+    from .parse_cache import load_log_files
+    groups = [list_job_log_file(index, job.name) for job in jobs]
+    results = load_log_files(executor, cache, 'engine_log', analyze_engine_log,
+                             make_aggregators, merge_aggregators, groups, chunk_size)
+    return list(zip(jobs, results))
+
+
+def load_timelines(executor, index: ReportIndex,
+                   job_results: List[JobResult]) -> List[JobResult]:
+    from .timeline import correlate
+    loads = list()
+    for job, result in job_results:
+        if not result.ok:
+            loads.append((job, result, None))
+            continue
+        job_files = index.get_job(job.name)
+        loads.append((job, None, (result.value, job_files.engine_logs,
+                                  job_files.sync_history_logs)))
+    results = iter(run_parallel(executor, correlate, [args for _, _, args in loads if args]))
+    return [(job, error or next(results)) for job, error, _ in loads]
+
+
+def load_server_log_stats(executor, server_log_path, job_id_name_map,
+                          chunk_size=DEFAULT_CHUNK_SIZE, cache=None) -> TaskResult:
+    import hashlib
+    from .parse_cache import load_log_files
+    from .server_log import (STDIO_PATH, ServerLogStats, merge_server_log_stats, open_input,
+                             scan_server_log, scan_server_stream)
+    if server_log_path == STDIO_PATH:
+        with open_input(server_log_path) as fp:
+            return TaskResult(value=scan_server_stream(fp, job_id_name_map))
+    if not report_fs.exists(server_log_path):
+        return TaskResult(error=f'{server_log_path} not exists')
+    # Lines are attributed with the job ids, results of other configs can't be reused
+    job_ids = json.dumps(sorted(job_id_name_map.items())).encode()
+    kind = f'server_log:{hashlib.sha1(job_ids).hexdigest()[:16]}'
+    results = load_log_files(executor, cache, kind, partial(scan_server_log, job_id_name_map),
+                             ServerLogStats, merge_server_log_stats, [[server_log_path]],
+                             chunk_size)
+    return results[0]
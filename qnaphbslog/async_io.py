@@ -0,0 +1,229 @@
+import asyncio
+import os
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from . import instrument, report_fs
+from .analysis import (JobResult, SyncHistoryResult, find_sync_history_logs,
+                       get_job_history_file, list_job_log_file, new_sync_file_history,
+                       add_sync_history_data, parse_job_history)
+from .engine_log import make_aggregators, scan_engine_data
+from .parallel import TaskResult
+from .report_index import ReportIndex, build_report_index, index_from_walk
+
+# Reports on NFS/SMB shares are latency bound: every listdir, stat, open and
+# read is a network round trip. AsyncReader keeps up to `concurrency` of them
+# in flight on a thread pool driven by asyncio, and reads files ahead of the
+# parsers in blocks. The parsers still get each file's data in order
+
+DEFAULT_CONCURRENCY = 16
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class LocalFileSystem:
+    # Each method is one blocking round trip, run on the reader's threads
+
+    def list_dir(self, path):
+        with os.scandir(path) as it:
+            return [(entry.name, entry.is_dir(), entry.is_symlink()) for entry in it]
+
+    def mtime_ns(self, path):
+        return os.stat(path).st_mtime_ns
+
+    def open(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        return fd, os.fstat(fd).st_size
+
+    def pread(self, fd, size, offset):
+        return os.pread(fd, size, offset)
+
+    def close(self, fd):
+        os.close(fd)
+
+    def read_stream(self, path):
+        # gzip-rotated logs can only be read whole, from the beginning
+        with report_fs.open_binary(path) as fp:
+            return fp.read()
+
+
+def is_stream(path):
+    return path.endswith(report_fs.GZIP_SUFFIX)
+
+
+def walk_tree(node):
+    # os.walk() order: a directory, then its subdirectories depth first
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if node is None:
+            continue
+        path, dirs, files, mtime_ns, children = node
+        yield path, dirs, files, mtime_ns
+        pending.extend(reversed(children))
+
+
+class AsyncReader:
+    def __init__(self, concurrency=None, read_ahead=None,
+                 block_size=READ_BLOCK_SIZE, fs: Optional[LocalFileSystem] = None):
+        self.concurrency = max(concurrency or DEFAULT_CONCURRENCY, 1)
+        # Blocks read ahead of the parser, memory stays below read_ahead x block_size
+        self.read_ahead = max(read_ahead or 2 * self.concurrency, 1)
+        self.block_size = block_size
+        self.fs = fs or LocalFileSystem()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                            thread_name_prefix='qnaphbslog-io')
+
+    def close(self):
+        self._executor.shutdown()
+
+    def _submit(self, func, *args) -> asyncio.Future:
+        # run_in_executor() submits right away, so reads scheduled before a
+        # long parse step proceed while it runs
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _scan_dir(self, path):
+        try:
+            entries, mtime_ns = await asyncio.gather(self._submit(self.fs.list_dir, path),
+                                                     self._submit(self.fs.mtime_ns, path))
+        except OSError:
+            # os.walk() skips directories it cannot list as well
+            return None
+        dirs = [name for name, is_dir, _ in entries if is_dir]
+        files = [name for name, is_dir, _ in entries if not is_dir]
+        children = await asyncio.gather(*(self._scan_dir(os.path.join(path, name))
+                                          for name, is_dir, is_link in entries
+                                          if is_dir and not is_link))
+        return path, dirs, files, mtime_ns, children
+
+    def build_report_index(self, report_path) -> ReportIndex:
+        report_path = os.path.abspath(report_path)
+        if report_fs.resolve(report_path)[0] is not None:
+            # Archives are listed from their own member table
+            return build_report_index(report_path)
+        with instrument.span('discovery: async walk report'):
+            tree = asyncio.run(self._scan_dir(report_path))
+            return index_from_walk(report_path, walk_tree(tree))
+
+    async def _open(self, path):
+        if is_stream(path):
+            return None
+        return await self._submit(self.fs.open, path)
+
+    def _read_unit(self, path, fd, offset):
+        if fd is None:
+            return self._submit(self.fs.read_stream, path)
+        return self._submit(self.fs.pread, fd, self.block_size, offset)
+
+    async def _read_blocks(self, paths, handle: Callable):
+        # handle(i, data, error) gets whole lines of paths[i], file after file
+        opened = await asyncio.gather(*(self._open(p) for p in paths), return_exceptions=True)
+        units = list()
+        for i, (path, f) in enumerate(zip(paths, opened)):
+            if isinstance(f, Exception):
+                handle(i, None, f)
+            elif f is None:
+                units.append((i, path, None, 0, True))
+            else:
+                fd, size = f
+                units.extend((i, path, fd, offset, offset + self.block_size >= size)
+                             for offset in range(0, size, self.block_size))
+        try:
+            pending = deque()
+            next_unit = iter(units)
+            carry = b''
+            while True:
+                while len(pending) < self.read_ahead:
+                    unit = next(next_unit, None)
+                    if unit is None:
+                        break
+                    i, path, fd, offset, _ = unit
+                    pending.append((unit, self._read_unit(path, fd, offset)))
+                if not pending:
+                    break
+                (i, path, fd, offset, last), future = pending.popleft()
+                try:
+                    data = carry + await future
+                except OSError as e:
+                    carry = b''
+                    handle(i, None, e)
+                    continue
+                if last:
+                    carry = b''
+                else:
+                    cut = data.rfind(b'\n') + 1
+                    data, carry = data[:cut], data[cut:]
+                if data:
+                    handle(i, data, None)
+        finally:
+            for f in opened:
+                if isinstance(f, tuple):
+                    self.fs.close(f[0])
+
+    def load_groups(self, name, groups: List[List[str]], new: Callable,
+                    feed: Callable) -> List[TaskResult]:
+        # Like parse_cache.load_log_files(): every group of files is parsed
+        # into one value by feed(value, path, data)
+        paths = [path for group in groups for path in group]
+        owners = [g for g, group in enumerate(groups) for _ in group]
+        values = [new() for _ in groups]
+        errors: List[Optional[TaskResult]] = [None] * len(groups)
+        bytes_read = 0
+
+        def handle(i, data, error):
+            nonlocal bytes_read
+            g = owners[i]
+            if errors[g] is not None:
+                return
+            try:
+                if error is not None:
+                    raise error
+                feed(values[g], paths[i], data)
+                bytes_read += len(data)
+            except Exception as e:
+                errors[g] = TaskResult(error=f'{type(e).__name__}: {e}',
+                                       error_traceback=traceback.format_exc())
+
+        with instrument.span(name) as s:
+            asyncio.run(self._read_blocks(paths, handle))
+            s.add(bytes=bytes_read)
+        return [errors[g] or TaskResult(value=values[g]) for g in range(len(groups))]
+
+    def read_files(self, name, paths) -> List[TaskResult]:
+        def append(buf, path, data):
+            buf += data
+        return self.load_groups(name, [[path] for path in paths], bytearray, append)
+
+
+def load_job_histories_async(reader: AsyncReader, index: ReportIndex, jobs) -> List[JobResult]:
+    loads = [(job, get_job_history_file(index, job.name)) for job in jobs]
+    loads = [(job, path) for job, path in loads if path is not None]
+    results = reader.read_files('parse: job_history.json', [path for _, path in loads])
+    job_results = list()
+    for (job, _), result in zip(loads, results):
+        if result.ok:
+            try:
+                result = TaskResult(value=parse_job_history(bytes(result.value), job.job_type))
+            except Exception as e:
+                result = TaskResult(error=f'{type(e).__name__}: {e}',
+                                    error_traceback=traceback.format_exc())
+        job_results.append((job, result))
+    return job_results
+
+
+def load_sync_histories_async(reader: AsyncReader, index: ReportIndex, jobs,
+                              keep_records=False, track_states=False) -> List[SyncHistoryResult]:
+    loads = [(job, *find_sync_history_logs(index, job)) for job in jobs]
+    results = reader.load_groups('parse: syncengine-history.log',
+                                 [paths for _, _, paths in loads],
+                                 lambda: new_sync_file_history(keep_records, track_states),
+                                 add_sync_history_data)
+    return [(job, message, result) for (job, message, _), result in zip(loads, results)]
+
+
+def load_tasks_async(reader: AsyncReader, index: ReportIndex, jobs) -> List[JobResult]:
+    groups = [list_job_log_file(index, job.name) for job in jobs]
+    results = reader.load_groups('parse: engine.log', groups, make_aggregators,
+                                 lambda aggregators, path, data: scan_engine_data(data, aggregators))
+    return list(zip(jobs, results))
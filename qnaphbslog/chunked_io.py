@@ -0,0 +1,89 @@
+import mmap
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from . import instrument, report_fs
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+Chunk = Tuple[int, int]
+
+
+@contextmanager
+def open_mmap(path):
+    with open(path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            yield b''
+            return
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+
+def split_chunks(buf, chunk_size=DEFAULT_CHUNK_SIZE, start=0, end=None) -> List[Chunk]:
+    chunks = list()
+    size = len(buf) if end is None else end
+    while start < size:
+        chunk_end = start + chunk_size
+        if chunk_end >= size:
+            chunk_end = size
+        else:
+            newline = buf.find(b'\n', max(chunk_end - 1, start), size)
+            chunk_end = size if newline < 0 else newline + 1
+        chunks.append((start, chunk_end))
+        start = chunk_end
+    return chunks
+
+
+def split_file_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, start=0, end=None) -> List[Chunk]:
+    if not report_fs.is_plain_file(path):
+        return [(start, end)]
+    size = os.path.getsize(path) if end is None else end
+    if chunk_size <= 0 or size - start <= chunk_size:
+        return [(start, end)]
+    with open_mmap(path) as buf:
+        return split_chunks(buf, chunk_size, start, size)
+
+
+def iter_lines(buf, start=0, end=None, needle: Optional[bytes] = None) -> Iterator[bytes]:
+    if end is None:
+        end = len(buf)
+    if needle is None:
+        pos = start
+        while pos < end:
+            newline = buf.find(b'\n', pos, end)
+            line_end = end if newline < 0 else newline + 1
+            yield buf[pos:line_end]
+            pos = line_end
+        return
+
+    # Jump from match to match so lines without the needle are never sliced
+    pos = buf.find(needle, start, end)
+    while pos >= 0:
+        line_start = buf.rfind(b'\n', start, pos) + 1
+        newline = buf.find(b'\n', pos, end)
+        line_end = end if newline < 0 else newline + 1
+        yield buf[max(line_start, start):line_end]
+        pos = buf.find(needle, line_end, end)
+
+
+def iter_stream_lines(fp, needle: Optional[bytes] = None) -> Iterator[bytes]:
+    for line in fp:
+        if needle is None or needle in line:
+            yield line
+
+
+def iter_file_lines(path, start=0, end=None,
+                    needle: Optional[bytes] = None) -> Iterator[bytes]:
+    if not report_fs.is_plain_file(path):
+        # Archive members and gzip-rotated logs are streams: read them whole
+        with report_fs.open_binary(path) as fp:
+            yield from iter_stream_lines(fp, needle)
+        instrument.count(bytes=report_fs.stat(path).size)
+        return
+    with open_mmap(path) as buf:
+        yield from iter_lines(buf, start, end, needle)
+        instrument.count(bytes=(len(buf) if end is None else end) - start)
@@ -0,0 +1,140 @@
+import json
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+from .sync_file_history import SyncFileHistory, SyncFileHistoryRecord, decode_is_dir
+
+# Sync history records export: a magic header followed by one block per job.
+# A block is a length-prefixed JSON header, two string tables and the raw
+# record columns, so a reader maps columns straight into arrays.
+#
+#   block  := u32 header_len, header JSON, strings(names), strings(categories),
+#             column bytes in header['columns'] order
+#   strings := u32 lengths[count] (NULL_LENGTH for None), utf-8 bytes
+
+MAGIC = b'QHBSCOL1'
+NULL_LENGTH = 0xFFFFFFFF
+LENGTH = struct.Struct('<I')
+WRITE_CHUNK_ROWS = 64 * 1024
+
+
+def _write_strings(fp: BinaryIO, values):
+    encoded = [None if v is None else v.encode('utf-8', 'surrogateescape') for v in values]
+    lengths = array('I', (NULL_LENGTH if v is None else len(v) for v in encoded))
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+    lengths.tofile(fp)
+    for v in encoded:
+        if v:
+            fp.write(v)
+
+
+def _read_strings(fp: BinaryIO, count) -> List[str]:
+    lengths = array('I')
+    lengths.frombytes(fp.read(lengths.itemsize * count))
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+    values = list()
+    for n in lengths:
+        values.append(None if n == NULL_LENGTH else fp.read(n).decode('utf-8', 'surrogateescape'))
+    return values
+
+
+def _write_column(fp: BinaryIO, column: array):
+    # Slices keep the temporary copy small for multi-million row columns
+    for start in range(0, len(column), WRITE_CHUNK_ROWS):
+        chunk = column[start:start + WRITE_CHUNK_ROWS]
+        if sys.byteorder != 'little':
+            chunk.byteswap()
+        chunk.tofile(fp)
+
+
+class ColumnarWriter:
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        fp.write(MAGIC)
+
+    def write_history(self, job_name, job_history: SyncFileHistory):
+        columns = job_history.columns()
+        names, categories = job_history.string_tables()
+        header = {
+            'job': job_name,
+            'rows': len(columns['name']),
+            'names': len(names),
+            'categories': len(categories),
+            'columns': [{'name': name, 'typecode': column.typecode,
+                         'itemsize': column.itemsize}
+                        for name, column in columns.items()],
+        }
+        header_bytes = json.dumps(header).encode()
+        self.fp.write(LENGTH.pack(len(header_bytes)))
+        self.fp.write(header_bytes)
+        _write_strings(self.fp, names)
+        _write_strings(self.fp, categories)
+        for column in columns.values():
+            _write_column(self.fp, column)
+
+    def close(self):
+        self.fp.flush()
+
+
+class ColumnBlock:
+    def __init__(self, job_name, names, categories, columns: Dict[str, array]):
+        self.job_name = job_name
+        self.names = names
+        self.categories = categories
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def records(self) -> Iterator[SyncFileHistoryRecord]:
+        c = self.columns
+        names = self.names
+        categories = self.categories
+        for row in range(len(self)):
+            yield SyncFileHistoryRecord(name=names[c['name'][row]],
+                                        timestamp=c['timestamp'][row],
+                                        action=categories[c['action'][row]],
+                                        result=categories[c['result'][row]],
+                                        exception=categories[c['exception'][row]],
+                                        is_dir=decode_is_dir(c['is_dir'][row]))
+
+
+def iter_blocks(fp: BinaryIO) -> Iterator[ColumnBlock]:
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a sync history records export')
+    while True:
+        size = fp.read(LENGTH.size)
+        if not size:
+            return
+        header = json.loads(fp.read(LENGTH.unpack(size)[0]))
+        names = _read_strings(fp, header['names'])
+        categories = _read_strings(fp, header['categories'])
+        columns = dict()
+        for spec in header['columns']:
+            column = array(spec['typecode'])
+            if column.itemsize != spec['itemsize']:
+                raise ValueError(f'Column {spec["name"]} item size differs on this platform')
+            column.frombytes(fp.read(column.itemsize * header['rows']))
+            if sys.byteorder != 'little':
+                column.byteswap()
+            columns[spec['name']] = column
+        yield ColumnBlock(header['job'], names, categories, columns)
+
+
+def export_sync_records(path, histories: Iterable[Tuple[str, SyncFileHistory]]):
+    # histories may be a generator, so only one job's columns are alive at once
+    with open(path, 'wb') as fp:
+        writer = ColumnarWriter(fp)
+        for job_name, job_history in histories:
+            writer.write_history(job_name, job_history)
+            del job_history
+        writer.close()
+
+
+def load_sync_records(path) -> List[ColumnBlock]:
+    with open(path, 'rb') as fp:
+        return list(iter_blocks(fp))
@@ -0,0 +1,98 @@
+from collections import Counter
+from typing import List
+
+from . import instrument
+from .chunked_io import iter_file_lines, iter_lines
+from .parsers import parse_task_name, parse_upload_size
+
+TASK_SUBMITTED_FILTER = b'task submitted:'
+UPLOAD_TASK_NAME = 'UploadTask'
+
+MB = 1024 * 1024
+UPLOAD_SIZE_BUCKETS = [
+    ('~5MB', 5 * MB),
+    ('5MB~100MB', 100 * MB),
+    ('100MB~1GB', 1000 * MB),
+    ('1GB~', None),
+]
+
+
+class TaskCounter:
+    def __init__(self):
+        self.counter = Counter()
+
+    def add(self, task_name, line):
+        self.counter[task_name] += 1
+
+    def merge(self, other: 'TaskCounter'):
+        self.counter.update(other.counter)
+
+    def total(self):
+        return sum(self.counter.values())
+
+    def most_common(self, n=None):
+        return self.counter.most_common(n)
+
+
+class UploadSizeHistogram:
+    def __init__(self):
+        self.counts = [0] * len(UPLOAD_SIZE_BUCKETS)
+
+    def add(self, task_name, line):
+        if task_name != UPLOAD_TASK_NAME:
+            return
+        size = parse_upload_size(line)
+        if size is not None:
+            self.add_size(size)
+
+    def add_size(self, size, count=1):
+        for i, (_, upper) in enumerate(UPLOAD_SIZE_BUCKETS):
+            if upper is None or size <= upper:
+                self.counts[i] += count
+                return
+
+    def merge(self, other: 'UploadSizeHistogram'):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def total(self):
+        return sum(self.counts)
+
+    def buckets(self):
+        return [(label, count) for (label, _), count in zip(UPLOAD_SIZE_BUCKETS, self.counts)]
+
+
+def make_aggregators():
+    return [TaskCounter(), UploadSizeHistogram()]
+
+
+def feed_task_lines(lines, aggregators):
+    for raw_line in lines:
+        task_name = parse_task_name(raw_line)
+        if task_name is None:
+            continue
+        for aggregator in aggregators:
+            aggregator.add(task_name, raw_line)
+    return aggregators
+
+
+def scan_engine_log(path, aggregators, start=0, end=None):
+    with instrument.span('parse: engine.log') as s:
+        lines = iter_file_lines(path, start, end, needle=TASK_SUBMITTED_FILTER)
+        tasks = aggregators[0].total()
+        feed_task_lines(lines, aggregators)
+        s.add(lines=aggregators[0].total() - tasks)
+    return aggregators
+
+
+def scan_engine_data(data: bytes, aggregators):
+    return feed_task_lines(iter_lines(data, needle=TASK_SUBMITTED_FILTER), aggregators)
+
+
+def analyze_engine_log(path, start=0, end=None):
+    return scan_engine_log(path, make_aggregators(), start, end)
+
+
+def merge_aggregators(aggregators: List, others: List):
+    for aggregator, other in zip(aggregators, others):
+        aggregator.merge(other)
+    return aggregators
@@ -0,0 +1,158 @@
+import sys
+from collections import Counter
+from typing import List, Optional
+
+from . import report_fs
+from .analysis import (get_hbs, load_job_histories, load_sync_histories,
+                       load_tasks)
+from .chunked_io import DEFAULT_CHUNK_SIZE
+from .engine_log import make_aggregators, merge_aggregators
+from .job_history import JobHistory
+from .parallel import iter_parallel
+from .parse_cache import ParseCache
+from .report_index import load_report_index
+from .sync_file_history import SyncFileHistory
+
+
+class FleetOptions:
+    def __init__(self, job_history=False, sync_history=False, task=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE, index_cache=True, parse_cache=True,
+                 cache_dir=None):
+        self.job_history = job_history
+        self.sync_history = sync_history
+        self.task = task
+        self.chunk_size = chunk_size
+        self.index_cache = index_cache
+        self.parse_cache = parse_cache
+        self.cache_dir = cache_dir
+
+
+# Per-report sync counts. Unique file counts are summed rather than unioned,
+# the same path on two NAS is two files
+class SyncSummary:
+    def __init__(self):
+        self.total_sync = 0
+        self.total_files = 0
+        self.total_folders = 0
+        self.action_sync: Counter = Counter()
+        self.action_files: Counter = Counter()
+        self.action_success: Counter = Counter()
+        self.action_fail: Counter = Counter()
+        self.exceptions: Counter = Counter()
+
+    def add_history(self, jh: SyncFileHistory):
+        self.total_sync += jh.total_sync()
+        self.total_files += jh.total_files()
+        self.total_folders += jh.total_folders()
+        for action in jh.action_types():
+            self.action_sync[action] += jh.total_sync(action=action)
+            self.action_files[action] += jh.count_files(action=action)
+            self.action_success[action] += jh.count_files(action=action, result='success')
+            self.action_fail[action] += jh.count_files(action=action, result='fail',
+                                                       exclude_result='success')
+        self.exceptions.update(jh.exception_counts())
+
+    def merge(self, other: 'SyncSummary'):
+        self.total_sync += other.total_sync
+        self.total_files += other.total_files
+        self.total_folders += other.total_folders
+        self.action_sync.update(other.action_sync)
+        self.action_files.update(other.action_files)
+        self.action_success.update(other.action_success)
+        self.action_fail.update(other.action_fail)
+        self.exceptions.update(other.exceptions)
+
+
+class ReportSummary:
+    def __init__(self, path):
+        self.path = path
+        self.jobs = 0
+        self.job_history: Optional[JobHistory] = None
+        self.sync: Optional[SyncSummary] = None
+        self.aggregators: Optional[list] = None
+        self.errors: List[str] = list()
+
+
+def analyze_report(path, options: FleetOptions) -> ReportSummary:
+    summary = ReportSummary(path)
+    report_path = report_fs.find_report_root(path)
+    hbs = get_hbs(report_path)
+    summary.jobs = len(hbs.jobs)
+    index = load_report_index(report_path, persist=options.index_cache,
+                              cache_dir=options.cache_dir)
+    cache = ParseCache.open(options.cache_dir) if options.parse_cache else None
+    try:
+        if options.job_history:
+            summary.job_history = JobHistory()
+            for job, result in load_job_histories(None, index, hbs.jobs, cache):
+                if not result.ok:
+                    summary.errors.append(f'{job.name}: {result.error}')
+                    continue
+                summary.job_history.merge(result.value)
+
+        if options.sync_history:
+            summary.sync = SyncSummary()
+            jobs = [job for job in hbs.jobs if job.job_type == 'sync']
+            for job, message, result in load_sync_histories(None, index, jobs,
+                                                            options.chunk_size, cache):
+                if message is None and not result.ok:
+                    summary.errors.append(f'{job.name}: {result.error}')
+                elif message is None:
+                    summary.sync.add_history(result.value)
+
+        if options.task:
+            summary.aggregators = make_aggregators()
+            for job, result in load_tasks(None, index, hbs.jobs, options.chunk_size, cache):
+                if not result.ok:
+                    summary.errors.append(f'{job.name}: {result.error}')
+                    continue
+                merge_aggregators(summary.aggregators, result.value)
+    finally:
+        if cache is not None:
+            cache.close()
+    return summary
+
+
+class FleetSummary:
+    def __init__(self):
+        self.reports: List[ReportSummary] = list()
+        self.failed: List[tuple] = list()
+        self.job_history = JobHistory()
+        self.sync = SyncSummary()
+        self.aggregators = make_aggregators()
+        # Number of reports each exception shows up in
+        self.exception_reports: Counter = Counter()
+
+    def add(self, summary: ReportSummary):
+        self.reports.append(summary)
+        if summary.job_history is not None:
+            self.job_history.merge(summary.job_history)
+        if summary.sync is not None:
+            self.sync.merge(summary.sync)
+            self.exception_reports.update(summary.sync.exceptions.keys())
+        if summary.aggregators is not None:
+            merge_aggregators(self.aggregators, summary.aggregators)
+
+    def add_failure(self, path, error):
+        self.failed.append((path, error))
+
+
+def analyze_fleet(executor, paths, options: FleetOptions, progress=sys.stderr) -> FleetSummary:
+    fleet = FleetSummary()
+    summaries = [None] * len(paths)
+    done = 0
+    for i, result in iter_parallel(executor, analyze_report,
+                                   [(path, options) for path in paths]):
+        done += 1
+        if progress is not None:
+            status = 'ok' if result.ok else f'failed: {result.error}'
+            print(f'[{done}/{len(paths)}] {paths[i]} {status}', file=progress, flush=True)
+        summaries[i] = result
+
+    # Merge in input order so the fleet totals do not depend on scheduling
+    for path, result in zip(paths, summaries):
+        if result.ok:
+            fleet.add(result.value)
+        else:
+            fleet.add_failure(path, result.error)
+    return fleet
@@ -0,0 +1,88 @@
+import os
+from typing import Callable, Dict, Iterable, Tuple
+
+from . import report_fs
+from .report_fs import GZIP_SUFFIX
+
+READ_SIZE = 4 * 1024 * 1024
+
+FileKey = Tuple[int, int]
+
+
+def list_log_files(log_path, log_name):
+    try:
+        names = os.listdir(log_path)
+    except OSError:
+        return list()
+    return [os.path.join(log_path, f) for f in sorted(names) if log_name in f]
+
+
+class FollowedFile:
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = b''
+
+
+# Follows a set of log files like `tail -F`. Files are tracked by inode, so
+# a file renamed by rotation keeps its offset and only its new name changes,
+# and each poll reads only the bytes appended since the previous one.
+class LogFollower:
+    def __init__(self, list_paths: Callable[[], Iterable[str]],
+                 handle_data: Callable[[str, bytes], None]):
+        self._list_paths = list_paths
+        self._handle_data = handle_data
+        self._files: Dict[FileKey, FollowedFile] = dict()
+        self._polled = False
+
+    def poll(self):
+        bytes_read = 0
+        seen = dict()
+        for path in self._list_paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            followed = self._files.get(key)
+            if followed is None:
+                # A compressed file showing up later is a rotated copy of
+                # lines that were already read from the plain file
+                if self._polled and path.endswith(GZIP_SUFFIX):
+                    continue
+                followed = FollowedFile(path)
+            followed.path = path
+            seen[key] = followed
+            bytes_read += self._read(followed, st.st_size)
+        self._files = seen
+        self._polled = True
+        return bytes_read
+
+    def _read(self, followed: FollowedFile, size):
+        if followed.path.endswith(GZIP_SUFFIX):
+            if followed.offset:
+                return 0
+            with report_fs.open_binary(followed.path) as fp:
+                self._handle_data(followed.path, fp.read())
+            followed.offset = size
+            return size
+
+        if size < followed.offset:
+            # Truncated in place: start over
+            followed.offset = 0
+            followed.partial = b''
+        bytes_read = 0
+        with open(followed.path, 'rb') as fp:
+            fp.seek(followed.offset)
+            while followed.offset < size:
+                data = fp.read(min(READ_SIZE, size - followed.offset))
+                if not data:
+                    break
+                followed.offset += len(data)
+                bytes_read += len(data)
+                data = followed.partial + data
+                newline = data.rfind(b'\n')
+                followed.partial = data[newline + 1:]
+                if newline >= 0:
+                    self._handle_data(followed.path, data[:newline + 1])
+        return bytes_read
@@ -1,40 +1,104 @@
-from typing import List
+from typing import Dict, List, Optional
 
-from .account import Account
-from .job import Job
+from .account import Account, make_account
+from .job import Job, make_job
 
 AccountList = List[Account]
 JobList = List[Job]
 
+LOCAL_ACCOUNT = Account(_id='', provider_type='local', name='local')
+
 
 class HybridBackupSync:
     def __init__(self,
                  hbs_version,
                  cc3_build_number,
                  accounts: AccountList,
-                 jobs: JobList):
+                 jobs: Optional[JobList],
+                 job_confs=None,
+                 other_job_names=None,
+                 config=None):
         self.hbs_version = hbs_version
         self.cc3_build_number = cc3_build_number
         self.accounts = accounts
-        self.jobs = jobs
+        # The parsed config.json when built from it, --export-db stores it
+        self.config = config
+        self._accounts_by_id: Dict[str, Account] = dict()
+        for account in accounts:
+            self._accounts_by_id.setdefault(account.id, account)
+        self._jobs = jobs
+        self._job_confs = job_confs or list()
+        # _id -> name of the configured jobs that are not cloud jobs, they
+        # have no Job but their ids still show up in server.log
+        self._other_job_names: Dict[str, str] = other_job_names or dict()
+        self._job_id_name_map: Optional[Dict[str, str]] = None
+        self._jobs_by_type: Optional[Dict[str, JobList]] = None
+        self._jobs_by_name: Dict[str, Job] = dict()
+        self._jobs_by_id: Dict[str, Job] = dict()
+
+    @classmethod
+    def from_config(cls, config, hbs_version=None, cc3_build_number=None):
+        accounts = list()
+        for acc in config['accounts']:
+            account = make_account(acc)
+            if account:
+                accounts.append(account)
+
+        job_confs = [j for j in config['jobs'] if j['_type'] == 'cloud']
+        other_job_names = dict()
+        for j in config['jobs']:
+            if j['_type'] != 'cloud':
+                other_job_names.setdefault(j['_id'], j['name'])
+        return cls(hbs_version, cc3_build_number, accounts, None,
+                   job_confs=job_confs, other_job_names=other_job_names, config=config)
+
+    @property
+    def jobs(self) -> JobList:
+        if self._jobs is None:
+            self._jobs = list()
+            for conf in self._job_confs:
+                job = make_job(conf)
+                if job:
+                    self._jobs.append(job)
+            self._job_confs = list()
+        return self._jobs
+
+    @property
+    def job_id_name_map(self) -> Dict[str, str]:
+        if self._job_id_name_map is None:
+            self._index_jobs()
+            self._job_id_name_map = {job_id: j.name for job_id, j in self._jobs_by_id.items()}
+            for job_id, name in self._other_job_names.items():
+                self._job_id_name_map.setdefault(job_id, name)
+        return self._job_id_name_map
+
+    def _index_jobs(self):
+        if self._jobs_by_type is not None:
+            return
+        self._jobs_by_type = dict()
+        for j in self.jobs:
+            self._jobs_by_type.setdefault(j.job_type, list()).append(j)
+            self._jobs_by_name.setdefault(j.name, j)
+            if j.id is not None:
+                self._jobs_by_id.setdefault(j.id, j)
 
     def get_account(self, account_id):
         if account_id == '':
-            return Account(_id='', provider_type='local', name='local')
-        for account in self.accounts:
-            if account.id == account_id:
-                return account
+            return LOCAL_ACCOUNT
+        return self._accounts_by_id.get(account_id)
 
     def job_types(self):
-        job_types = list()
-        for j in self.jobs:
-            if j.job_type not in job_types:
-                job_types.append(j.job_type)
-        return job_types
+        self._index_jobs()
+        return list(self._jobs_by_type)
 
     def get_job_by_type(self, job_type):
-        jobs = list()
-        for j in self.jobs:
-            if j.job_type == job_type:
-                jobs.append(j)
-        return jobs
+        self._index_jobs()
+        return self._jobs_by_type.get(job_type, list())
+
+    def get_job(self, name) -> Optional[Job]:
+        self._index_jobs()
+        return self._jobs_by_name.get(name)
+
+    def get_job_by_id(self, job_id) -> Optional[Job]:
+        self._index_jobs()
+        return self._jobs_by_id.get(job_id)
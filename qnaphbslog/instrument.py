@@ -0,0 +1,210 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+# Stage timings for --timings and --trace. Recording is off by default and
+# span() then costs one global lookup, so the parsers can stay instrumented
+
+
+class Span:
+    __slots__ = ('name', 'start', 'wall', 'cpu', 'bytes', 'lines', 'pid', 'tid')
+
+    def __init__(self, name, start, pid, tid):
+        self.name = name
+        self.start = start
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        self.lines = 0
+        self.pid = pid
+        self.tid = tid
+
+    def add(self, bytes=0, lines=0):
+        self.bytes += bytes
+        self.lines += lines
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def add(self, bytes=0, lines=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Recorder:
+    def __init__(self):
+        self.spans: List[Span] = list()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = list()
+        return stack
+
+    @contextmanager
+    def span(self, name):
+        s = Span(name, time.perf_counter(), os.getpid(), threading.get_ident())
+        stack = self._stack()
+        stack.append(s)
+        cpu = time.process_time()
+        try:
+            yield s
+        finally:
+            s.cpu = time.process_time() - cpu
+            s.wall = time.perf_counter() - s.start
+            stack.pop()
+            self.spans.append(s)
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else NULL_SPAN
+
+
+_recorder: Optional[Recorder] = None
+
+
+def enable():
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder()
+    return _recorder
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def init_worker(enabled):
+    if enabled:
+        enable()
+
+
+def span(name):
+    if _recorder is None:
+        return NULL_SPAN
+    return _recorder.span(name)
+
+
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(bytes=0, lines=0):
+    if _recorder is not None:
+        _recorder.current().add(bytes, lines)
+
+
+@contextmanager
+def capture():
+    # Hands the spans recorded in a worker call back to the caller, which
+    # merges them with add_spans() in the main process
+    spans: List[Span] = list()
+    if _recorder is None:
+        yield spans
+        return
+    mark = len(_recorder.spans)
+    try:
+        yield spans
+    finally:
+        spans.extend(_recorder.spans[mark:])
+        del _recorder.spans[mark:]
+
+
+def add_spans(spans):
+    if _recorder is not None and spans:
+        _recorder.spans.extend(spans)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        self.lines = 0
+
+    def add(self, s: Span):
+        self.calls += 1
+        self.wall += s.wall
+        self.cpu += s.cpu
+        self.bytes += s.bytes
+        self.lines += s.lines
+
+
+def stage_stats() -> List[StageStats]:
+    stages: Dict[str, StageStats] = dict()
+    if _recorder is None:
+        return list()
+    for s in sorted(_recorder.spans, key=lambda s: s.start):
+        stages.setdefault(s.name, StageStats(s.name)).add(s)
+    return list(stages.values())
+
+
+def peak_rss_kb():
+    # Linux reports KiB, macOS bytes
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def format_count(value):
+    if not value:
+        return '-'
+    for unit in ('', 'K', 'M', 'G'):
+        if value < 1000:
+            return f'{value:.0f}{unit}' if unit == '' else f'{value:.1f}{unit}'
+        value /= 1000
+    return f'{value:.1f}T'
+
+
+def print_timings(wall, cpu, fp=sys.stderr):
+    print(f'{"stage":<36} {"calls":>6} {"wall s":>8} {"cpu s":>8} '
+          f'{"bytes":>8} {"lines":>8} {"lines/s":>8}', file=fp)
+    for stage in stage_stats():
+        rate = stage.lines / stage.wall if stage.lines and stage.wall > 0 else 0
+        print(f'{stage.name:<36} {stage.calls:>6} {stage.wall:8.3f} {stage.cpu:8.3f} '
+              f'{format_count(stage.bytes):>8} {format_count(stage.lines):>8} '
+              f'{format_count(rate):>8}', file=fp)
+    main_rss, workers_rss = peak_rss_kb()
+    print(f'total wall {wall:.3f}s, cpu {cpu:.3f}s, peak RSS {main_rss} KiB'
+          + (f', workers {workers_rss} KiB' if workers_rss else ''), file=fp)
+
+
+def write_chrome_trace(path):
+    # chrome://tracing and Perfetto "complete" events, timestamps in us
+    spans = _recorder.spans if _recorder is not None else list()
+    origin = min((s.start for s in spans), default=0)
+    with open(path, 'w') as fp:
+        fp.write('{"traceEvents": [\n')
+        for i, s in enumerate(spans):
+            if i:
+                fp.write(',\n')
+            fp.write(json.dumps({
+                'name': s.name, 'ph': 'X', 'pid': s.pid, 'tid': s.tid,
+                'ts': (s.start - origin) * 1e6, 'dur': s.wall * 1e6,
+                'args': {'cpu_s': s.cpu, 'bytes': s.bytes, 'lines': s.lines},
+            }))
+        fp.write('\n], "displayTimeUnit": "ms"}\n')
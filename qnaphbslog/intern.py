@@ -0,0 +1,7 @@
+import sys
+
+
+def intern_str(value):
+    if type(value) is str:
+        return sys.intern(value)
+    return value
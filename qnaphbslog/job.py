@@ -1,10 +1,15 @@
 from typing import Optional
 
+from .intern import intern_str
+
 
 class Job:
-    def __init__(self, account_id, job_type, name):
-        self.account_id = account_id
-        self.job_type = job_type
+    __slots__ = ('id', 'account_id', 'job_type', 'name')
+
+    def __init__(self, account_id, job_type, name, _id=None):
+        self.id = _id
+        self.account_id = intern_str(account_id)
+        self.job_type = intern_str(job_type)
         self.name = name
 
     def __str__(self):
@@ -12,28 +17,34 @@ class Job:
 
 
 class BackupJob(Job):
-    def __init__(self, account_id, job_type, name, backup_type):
-        super().__init__(account_id, job_type, name)
-        self.backup_type = backup_type
+    __slots__ = ('backup_type',)
+
+    def __init__(self, account_id, job_type, name, backup_type, _id=None):
+        super().__init__(account_id, job_type, name, _id)
+        self.backup_type = intern_str(backup_type)
 
     def __str__(self):
         return f'BackupJob(name: {self.name}, backup_type: {self.backup_type})'
 
 
 class RestoreJob(Job):
-    def __init__(self, account_id, job_type, name, restore_type):
-        super().__init__(account_id, job_type, name)
-        self.restore_type = restore_type
+    __slots__ = ('restore_type',)
+
+    def __init__(self, account_id, job_type, name, restore_type, _id=None):
+        super().__init__(account_id, job_type, name, _id)
+        self.restore_type = intern_str(restore_type)
 
     def __str__(self):
         return f'RestoreJob(name: {self.name}, restore_type: {self.restore_type})'
 
 
 class SyncJob(Job):
-    def __init__(self, account_id, job_type, name, sync_direction, sync_operation):
-        super().__init__(account_id, job_type, name)
-        self.sync_direction = sync_direction
-        self.sync_operation = sync_operation
+    __slots__ = ('sync_direction', 'sync_operation')
+
+    def __init__(self, account_id, job_type, name, sync_direction, sync_operation, _id=None):
+        super().__init__(account_id, job_type, name, _id)
+        self.sync_direction = intern_str(sync_direction)
+        self.sync_operation = intern_str(sync_operation)
 
     def __str__(self):
         return f'SyncJob(name: {self.name}, sync_direction: {self.sync_direction}, sync_operation: {self.sync_operation})'
@@ -43,12 +54,14 @@ def make_job(job_conf) -> Optional[Job]:
     if job_conf['_type'] != 'cloud':
         return None
 
+    _id = job_conf['_id']
     account_id = job_conf['account_id']
     name = job_conf['name']
     job_type = job_conf['job_type']
     if job_type == 'backup':
-        return BackupJob(account_id, job_type, name, job_conf['backup.type'])
+        return BackupJob(account_id, job_type, name, job_conf['backup.type'], _id)
     elif job_type == 'restore':
-        return RestoreJob(account_id, job_type, name, job_conf['restore.type'])
+        return RestoreJob(account_id, job_type, name, job_conf['restore.type'], _id)
     else:
-        return SyncJob(account_id, job_type, name, job_conf['sync.direction'], job_conf['sync.operation'])
+        return SyncJob(account_id, job_type, name, job_conf['sync.direction'], job_conf['sync.operation'],
+                       _id)
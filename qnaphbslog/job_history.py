@@ -1,38 +1,125 @@
-from typing import List
+import math
+from array import array
+from bisect import insort, bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
 
 from qnaphbslog.job_history_record import JobHistoryRecord
 
 JobHistoryList = List[JobHistoryRecord]
 
+COMPLETE_STATUSES = ('Finished', 'Finished with warnings')
+FAIL_STATUS = 'Failed'
+STOP_STATUS = 'Stopped'
+METRIC_FIELDS = ('elapse_time', 'upload_bytes_per_second', 'download_bytes_per_second')
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def _to_float(value):
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def percentile(sorted_values: Sequence[float], p) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lower = math.floor(k)
+    upper = math.ceil(k)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Regression:
+    def __init__(self, run, start_time, value, baseline):
+        self.run = run
+        self.start_time = start_time
+        self.value = value
+        self.baseline = baseline
+
+    @property
+    def ratio(self):
+        return self.value / self.baseline if self.baseline else None
+
 
 class JobHistory:
     def __init__(self):
-        self._history: JobHistoryList = list()
+        self._start_times = list()
+        self._stop_times = list()
+        self._statuses = list()
+        self._metrics: Dict[str, array] = {field: array('d') for field in METRIC_FIELDS}
+        self._status_counter: Counter = Counter()
 
     def add(self, history: JobHistoryRecord):
-        self._history.append(history)
+        self._start_times.append(history.start_time)
+        self._stop_times.append(history.stop_time)
+        self._statuses.append(history.status)
+        for field, column in self._metrics.items():
+            column.append(_to_float(getattr(history, field)))
+        self._status_counter[history.status] += 1
+
+    def merge(self, other: 'JobHistory'):
+        self._start_times.extend(other._start_times)
+        self._stop_times.extend(other._stop_times)
+        self._statuses.extend(other._statuses)
+        for field, column in self._metrics.items():
+            column.extend(other._metrics[field])
+        self._status_counter.update(other._status_counter)
+
+    def records(self):
+        for i in range(len(self._statuses)):
+            values = {field: column[i] for field, column in self._metrics.items()}
+            yield JobHistoryRecord(start_time=self._start_times[i],
+                                   elapse_time=_from_float(values['elapse_time']),
+                                   stop_time=self._stop_times[i],
+                                   status=self._statuses[i],
+                                   upload_bytes_per_second=_from_float(values['upload_bytes_per_second']),
+                                   download_bytes_per_second=_from_float(values['download_bytes_per_second']))
 
     def total_run_times(self):
-        return len(self._history)
+        return len(self._statuses)
 
     def total_complete_times(self):
-        count = 0
-        for h in self._history:
-            if h.status in ['Finished', 'Finished with warnings']:
-                count += 1
-        return count
+        return sum(self._status_counter[s] for s in COMPLETE_STATUSES)
 
     def total_fail_times(self):
-        count = 0
-        for h in self._history:
-            if h.status == 'Failed':
-                count += 1
-        return count
+        return self._status_counter[FAIL_STATUS]
 
     def total_stop_times(self):
-        count = 0
-        for h in self._history:
-            if h.status == 'Stopped':
-                count += 1
-        return count
+        return self._status_counter[STOP_STATUS]
+
+    def values(self, field) -> List[float]:
+        return [v for v in self._metrics[field] if not math.isnan(v)]
+
+    def percentiles(self, field, ps=DEFAULT_PERCENTILES) -> Dict[int, Optional[float]]:
+        values = sorted(self.values(field))
+        return {p: percentile(values, p) for p in ps}
+
+    def detect_regressions(self, field='upload_bytes_per_second', window=5,
+                           threshold=0.5) -> List[Regression]:
+        # A run regresses when it falls below threshold x the rolling median
+        # of the previous `window` runs that reported the metric
+        regressions = list()
+        recent = list()
+        ordered = list()
+        for run, value in enumerate(self._metrics[field]):
+            if math.isnan(value):
+                continue
+            if len(recent) == window:
+                baseline = percentile(ordered, 50)
+                if value < baseline * threshold:
+                    regressions.append(Regression(run, self._start_times[run], value, baseline))
+                oldest = recent.pop(0)
+                del ordered[bisect_left(ordered, oldest)]
+            recent.append(value)
+            insort(ordered, value)
+        return regressions
+
 
+def _from_float(value):
+    return None if math.isnan(value) else value
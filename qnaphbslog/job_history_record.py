@@ -1,3 +1,6 @@
+from .intern import intern_str
+
+
 def get_upload_bytes_per_second_key(job_type):
     if job_type == 'backup':
         return 'transfer_bytes_per_second'
@@ -15,6 +18,9 @@ def get_download_bytes_per_second_key(job_type):
 
 
 class JobHistoryRecord:
+    __slots__ = ('start_time', 'elapse_time', 'stop_time', 'status',
+                 'upload_bytes_per_second', 'download_bytes_per_second')
+
     def __init__(self,
                  start_time,
                  elapse_time,
@@ -26,6 +32,6 @@ class JobHistoryRecord:
         self.start_time = start_time
         self.elapse_time = elapse_time
         self.stop_time = stop_time
-        self.status = status
+        self.status = intern_str(status)
         self.upload_bytes_per_second = upload_bytes_per_second
         self.download_bytes_per_second = download_bytes_per_second
\ No newline at end of file
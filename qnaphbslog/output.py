@@ -0,0 +1,81 @@
+import csv
+import json
+import sys
+from typing import TextIO
+
+FORMATS = ('text', 'json', 'jsonl', 'csv')
+CSV_COLUMNS = ('type', 'job', 'field', 'value')
+
+
+# Writers serialize one record at a time straight to the stream, memory stays
+# bounded by the largest single record whatever the number of records
+
+
+class JsonlWriter:
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+
+    def write(self, record):
+        self.fp.write(json.dumps(record))
+        self.fp.write('\n')
+
+    def close(self):
+        self.fp.flush()
+
+
+class JsonWriter:
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+        self._count = 0
+
+    def write(self, record):
+        self.fp.write('[\n' if self._count == 0 else ',\n')
+        self.fp.write(json.dumps(record))
+        self._count += 1
+
+    def close(self):
+        self.fp.write('[]\n' if self._count == 0 else '\n]\n')
+        self.fp.flush()
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from flatten(v, f'{prefix}.{k}' if prefix else str(k))
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            yield from flatten(v, f'{prefix}.{i}' if prefix else str(i))
+    else:
+        yield prefix, value
+
+
+# Long format, one row per scalar field, so records of every type share the
+# same columns and stream into a single table
+class CsvWriter:
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+        self._writer = csv.writer(fp)
+        self._writer.writerow(CSV_COLUMNS)
+
+    def write(self, record):
+        record_type = record.get('type')
+        job = record.get('job', '')
+        self._writer.writerows((record_type, job, field, '' if value is None else value)
+                               for field, value in flatten(record)
+                               if field not in ('type', 'job'))
+
+    def close(self):
+        self.fp.flush()
+
+
+WRITERS = {
+    'json': JsonWriter,
+    'jsonl': JsonlWriter,
+    'csv': CsvWriter,
+}
+
+
+def make_writer(fmt, fp: TextIO = None):
+    if fmt == 'text':
+        return None
+    return WRITERS[fmt](fp or sys.stdout)
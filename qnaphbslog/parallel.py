@@ -0,0 +1,78 @@
+import os
+import traceback
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from . import instrument
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+
+class TaskResult:
+    def __init__(self, value=None, error=None, error_traceback=None, spans=None):
+        self.value = value
+        self.error = error
+        self.error_traceback = error_traceback
+        self.spans = spans
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _safe_call(func_args) -> TaskResult:
+    func, args = func_args
+    with instrument.capture() as spans:
+        try:
+            result = TaskResult(value=func(*args))
+        except Exception as e:
+            result = TaskResult(error=f'{type(e).__name__}: {e}',
+                                error_traceback=traceback.format_exc())
+    result.spans = spans
+    return result
+
+
+def _collect(result: TaskResult) -> TaskResult:
+    instrument.add_spans(result.spans)
+    result.spans = None
+    return result
+
+
+def make_executor(workers) -> Optional['Executor']:
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    # multiprocessing is only imported when there are workers to start
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, initializer=instrument.init_worker,
+                               initargs=(instrument.is_enabled(),))
+
+
+def run_parallel(executor: Optional['Executor'], func: Callable,
+                 args_list: Iterable[tuple], chunksize=1) -> List[TaskResult]:
+    calls = [(func, args) for args in args_list]
+    if executor is None:
+        return [_collect(_safe_call(c)) for c in calls]
+    return [_collect(r) for r in executor.map(_safe_call, calls, chunksize=chunksize)]
+
+
+def run_grouped(executor: Optional['Executor'], func: Callable,
+                groups: List[List[tuple]]) -> List[List[TaskResult]]:
+    results = iter(run_parallel(executor, func,
+                                [args for group in groups for args in group]))
+    return [[next(results) for _ in group] for group in groups]
+
+
+def iter_parallel(executor: Optional['Executor'], func: Callable,
+                  args_list: Iterable[tuple]) -> Iterator[Tuple[int, TaskResult]]:
+    # Yields (position, result) in completion order, for progress reporting
+    calls = [(func, args) for args in args_list]
+    if executor is None:
+        for i, c in enumerate(calls):
+            yield i, _collect(_safe_call(c))
+        return
+    from concurrent.futures import as_completed
+    futures = {executor.submit(_safe_call, c): i for i, c in enumerate(calls)}
+    for future in as_completed(futures):
+        yield futures[future], _collect(future.result())
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+from typing import Callable, List, Optional
+
+from . import instrument, report_fs
+from .chunked_io import open_mmap, split_file_chunks
+from .parallel import TaskResult, run_grouped
+from .report_index import default_cache_dir
+
+CACHE_FILE_NAME = 'parse-cache.sqlite3'
+CACHE_VERSION = 9
+HEAD_SIZE = 4096
+SQLITE_TIMEOUT = 60
+
+
+class FileSignature:
+    def __init__(self, size, mtime_ns, head_len, head_hash):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.head_len = head_len
+        self.head_hash = head_hash
+
+
+def hash_head(path, head_len):
+    with report_fs.open_binary(path) as fp:
+        return hashlib.sha1(fp.read(head_len)).hexdigest()
+
+
+def get_file_signature(path) -> FileSignature:
+    archive, member = report_fs.resolve(path)
+    if archive is not None:
+        # Hashing the head of a member of a compressed tar means
+        # decompressing up to it. The archive's size and mtime change
+        # whenever a member does, so they stand in for the head
+        info = report_fs.stat(path)
+        return FileSignature(info.size, archive.mtime_ns, 0, f'{archive.size} {member}')
+    st = report_fs.stat(path)
+    head_len = min(st.size, HEAD_SIZE)
+    return FileSignature(st.size, st.mtime_ns, head_len, hash_head(path, head_len))
+
+
+class CacheEntry:
+    def __init__(self, signature: FileSignature, parsed_offset, payload):
+        self.signature = signature
+        self.parsed_offset = parsed_offset
+        self.payload = payload
+
+    def value(self):
+        return pickle.loads(self.payload)
+
+
+class ParseCache:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # Fleet workers share the cache, wait for the write lock instead of failing
+        self._conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS parsed_file')
+            self._conn.execute(f'PRAGMA user_version = {CACHE_VERSION}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS parsed_file ('
+                           'path TEXT NOT NULL, kind TEXT NOT NULL, '
+                           'size INTEGER, mtime_ns INTEGER, '
+                           'head_len INTEGER, head_hash TEXT, '
+                           'parsed_offset INTEGER, payload BLOB, '
+                           'PRIMARY KEY (path, kind))')
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, cache_dir=None) -> Optional['ParseCache']:
+        try:
+            return cls(os.path.join(cache_dir or default_cache_dir(), CACHE_FILE_NAME))
+        except (OSError, sqlite3.Error):
+            return None
+
+    def get(self, path, kind) -> Optional[CacheEntry]:
+        row = self._conn.execute('SELECT size, mtime_ns, head_len, head_hash, '
+                                 'parsed_offset, payload FROM parsed_file '
+                                 'WHERE path = ? AND kind = ?',
+                                 (os.path.abspath(path), kind)).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, head_len, head_hash, parsed_offset, payload = row
+        return CacheEntry(FileSignature(size, mtime_ns, head_len, head_hash),
+                          parsed_offset, payload)
+
+    def put(self, path, kind, signature: FileSignature, parsed_offset, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._conn.execute('INSERT OR REPLACE INTO parsed_file VALUES '
+                           '(?, ?, ?, ?, ?, ?, ?, ?)',
+                           (os.path.abspath(path), kind, signature.size,
+                            signature.mtime_ns, signature.head_len,
+                            signature.head_hash, parsed_offset, payload))
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+def get_cached_value(cache: Optional[ParseCache], path, kind):
+    if cache is None:
+        return None, None
+    signature = get_file_signature(path)
+    entry = cache.get(path, kind)
+    if entry is None:
+        return None, signature
+    cached = entry.signature
+    if (cached.size, cached.mtime_ns, cached.head_hash) != \
+            (signature.size, signature.mtime_ns, signature.head_hash):
+        return None, signature
+    return entry.value(), signature
+
+
+class IncrementalPlan:
+    def __init__(self, path, signature: Optional[FileSignature], value,
+                 start, end, size, plain=True):
+        self.path = path
+        self.plain = plain
+        self.signature = signature
+        self.value = value
+        self.start = start
+        # [start, end) holds complete lines and is cached, [end, size) is a
+        # trailing partial line that is parsed but not cached
+        self.end = end
+        self.size = size
+
+    def ranges(self, chunk_size):
+        if not self.plain:
+            # Streams can only be parsed whole, from the beginning
+            return [(self.path, 0, None)] if self.start < self.end else list()
+        ranges = list()
+        if self.start < self.end:
+            ranges.extend((self.path, start, end) for start, end in
+                          split_file_chunks(self.path, chunk_size, self.start, self.end))
+        if self.end < self.size:
+            ranges.append((self.path, self.end, self.size))
+        return ranges
+
+
+def get_complete_end(path, start, size):
+    if start >= size:
+        return size
+    with open_mmap(path) as buf:
+        return max(buf.rfind(b'\n', start, size) + 1, start)
+
+
+def plan_incremental(cache: Optional[ParseCache], path, kind) -> IncrementalPlan:
+    if not report_fs.is_plain_file(path):
+        value, signature = get_cached_value(cache, path, kind)
+        size = report_fs.stat(path).size
+        start = size if value is not None else 0
+        return IncrementalPlan(path, signature, value, start, size, size, plain=False)
+
+    size = os.path.getsize(path)
+    if cache is None:
+        return IncrementalPlan(path, None, None, 0, size, size)
+
+    signature = get_file_signature(path)
+    entry = cache.get(path, kind)
+    value = None
+    start = 0
+    if entry is not None:
+        cached = entry.signature
+        same_head = (cached.head_hash == signature.head_hash if cached.head_len == signature.head_len
+                     else cached.head_hash == hash_head(path, cached.head_len))
+        if same_head and entry.parsed_offset <= size and (
+                signature.size > cached.size or signature.mtime_ns == cached.mtime_ns):
+            value = entry.value()
+            start = entry.parsed_offset
+    return IncrementalPlan(path, signature, value, start,
+                           get_complete_end(path, start, size), size)
+
+
+def load_log_files(executor, cache: Optional[ParseCache], kind,
+                   parse: Callable, new: Callable, merge: Callable,
+                   groups: List[List[str]], chunk_size) -> List[TaskResult]:
+    with instrument.span(f'cache: plan {kind}'):
+        plan_groups = [[(plan, plan.ranges(chunk_size))
+                        for plan in (plan_incremental(cache, path, kind) for path in paths)]
+                       for paths in groups]
+    work = [[r for _, ranges in plans for r in ranges] for plans in plan_groups]
+    grouped_results = iter(run_grouped(executor, parse, work))
+    with instrument.span(f'aggregate: {kind}'):
+        group_results = merge_results(cache, kind, new, merge, plan_groups, grouped_results)
+    if cache is not None:
+        cache.commit()
+    return group_results
+
+
+def merge_results(cache: Optional[ParseCache], kind, new: Callable, merge: Callable,
+                  plan_groups, grouped_results) -> List[TaskResult]:
+    def merge_values(value, other):
+        return other if value is None else merge(value, other)
+
+    group_results = list()
+    for plans in plan_groups:
+        results = iter(next(grouped_results))
+        group_value = None
+        error = None
+        for plan, ranges in plans:
+            value = plan.value
+            tail = None
+            for path, start, end in ranges:
+                result = next(results)
+                if not result.ok:
+                    error = error or result
+                elif start >= plan.end:
+                    tail = result.value
+                else:
+                    value = merge_values(value, result.value)
+            if error is not None:
+                continue
+            if value is None:
+                value = new()
+            if cache is not None and plan.start < plan.end:
+                cache.put(plan.path, kind, plan.signature, plan.end, value)
+            if tail is not None:
+                value = merge(value, tail)
+            group_value = merge_values(group_value, value)
+        group_results.append(error or TaskResult(
+            value=group_value if group_value is not None else new()))
+    return group_results
@@ -0,0 +1,128 @@
+import calendar
+import json
+import re
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TASK_SUBMITTED = b'task submitted: '
+UPLOAD_SIZE = b"'size': "
+
+HISTORY_FIELDS = ('name', 'timestamp', 'action', 'result', 'exception', 'is_dir')
+HISTORY_BATCH_SIZE = 4096
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+ERROR_LEVEL = LOG_LEVELS.index('ERROR')
+# The level is part of the line header, never looked for in the message
+LEVEL_SEARCH_END = 64
+_LEVEL_PATTERN = re.compile(rb'\b(DEBUG|INFO|WARNING|WARN|ERROR|CRITICAL|FATAL)\b')
+_LEVEL_CODES = {b'DEBUG': 0, b'INFO': 1, b'WARNING': 2, b'WARN': 2, b'ERROR': 3,
+                b'CRITICAL': 4, b'FATAL': 4}
+LATENCY_KEYWORDS = (b'took', b'elapsed', b'latency', b'duration')
+_LATENCY_VALUE = re.compile(rb'[=:]?\s*(\d+(?:\.\d+)?)\s*(ms|s)\b')
+
+_get_history_fields = itemgetter(*HISTORY_FIELDS)
+_task_names: Dict[bytes, str] = dict()
+_json_loads: Optional[Callable] = None
+
+
+def get_json_loads() -> Callable:
+    # orjson takes longer to import than a --hbs-summary run, so it is only
+    # loaded with the first JSON lines to parse
+    global _json_loads
+    if _json_loads is None:
+        try:
+            import orjson
+            _json_loads = orjson.loads
+        except ImportError:
+            _json_loads = json.loads
+    return _json_loads
+
+
+def parse_task_name(line: bytes) -> Optional[str]:
+    start = line.find(TASK_SUBMITTED)
+    if start < 0:
+        return None
+    start += len(TASK_SUBMITTED)
+    end = line.find(b'(', start)
+    if end < 0:
+        return None
+    raw_name = line[start:end]
+    name = _task_names.get(raw_name)
+    if name is None:
+        name = _task_names[raw_name] = raw_name.decode('utf-8', 'replace')
+    return name
+
+
+def parse_upload_size(line: bytes) -> Optional[int]:
+    start = line.find(UPLOAD_SIZE)
+    if start < 0:
+        return None
+    start += len(UPLOAD_SIZE)
+    end = line.find(b',', start)
+    if end < 0:
+        end = line.find(b'}', start)
+    try:
+        return int(line[start:end] if end >= 0 else line[start:])
+    except ValueError:
+        return None
+
+
+def parse_log_level(line: bytes) -> Optional[Tuple[int, int]]:
+    # Index in LOG_LEVELS and the offset where the level ends
+    m = _LEVEL_PATTERN.search(line, 0, LEVEL_SEARCH_END)
+    if m is None:
+        return None
+    return _LEVEL_CODES[m.group(1)], m.end()
+
+
+def parse_latency_ms(line: bytes) -> Optional[float]:
+    # 'took 120 ms', 'elapsed=1.5s', 'latency: 80ms', ... find() skips most
+    # lines faster than a regex search for the keywords
+    for keyword in LATENCY_KEYWORDS:
+        start = line.find(keyword)
+        if start < 0:
+            continue
+        m = _LATENCY_VALUE.match(line, start + len(keyword))
+        if m is not None:
+            value = float(m.group(1))
+            return value if m.group(2) == b'ms' else value * 1000
+    return None
+
+
+# 'YYYY-MM-DD HH:MM:SS,mmm' at the start of engine.log and server.log lines,
+# read as UTC like the sync history timestamps
+def parse_log_timestamp(line: bytes) -> Optional[float]:
+    if len(line) < 19 or line[4:5] != b'-' or line[13:14] != b':':
+        return None
+    try:
+        seconds = calendar.timegm((int(line[0:4]), int(line[5:7]), int(line[8:10]),
+                                   int(line[11:13]), int(line[14:16]), int(line[17:19])))
+    except ValueError:
+        return None
+    if line[19:20] in (b',', b'.') and line[20:23].isdigit():
+        return seconds + int(line[20:23]) / 1000
+    return seconds
+
+
+def decode_history_batch(lines: List[bytes]) -> List[tuple]:
+    json_loads = get_json_loads()
+    try:
+        records = json_loads(b'[' + b','.join(lines) + b']')
+    except ValueError:
+        # Decode line by line so the error points at the broken line
+        records = [json_loads(line) for line in lines]
+    return [_get_history_fields(h) for h in records]
+
+
+def iter_history_rows(lines: Iterable[bytes],
+                      batch_size=HISTORY_BATCH_SIZE) -> Iterator[tuple]:
+    batch = list()
+    for line in lines:
+        if not line.strip():
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield from decode_history_batch(batch)
+            batch = list()
+    if batch:
+        yield from decode_history_batch(batch)
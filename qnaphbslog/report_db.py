@@ -0,0 +1,401 @@
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import instrument
+from .analysis import (find_sync_history_logs, get_cc3_version,
+                       get_hbs_version, list_job_log_file, load_job_histories)
+from .chunked_io import iter_file_lines
+from .engine_log import (TASK_SUBMITTED_FILTER, UPLOAD_TASK_NAME, TaskCounter,
+                         UploadSizeHistogram)
+from .hbs import HybridBackupSync
+from .job_history import JobHistory
+from .job_history_record import JobHistoryRecord
+from .parsers import iter_history_rows, parse_log_timestamp, parse_task_name, parse_upload_size
+from .report_index import ReportIndex
+from .results import file_state_result, format_time, job_fields
+from .sync_file_history import FileState
+
+# A report exported once into SQLite answers every later question with an
+# indexed query instead of a rescan of the logs. Rows are bulk loaded with
+# executemany in one transaction and the indexes are built after the load
+
+DB_VERSION = 1
+BATCH_SIZE = 10000
+JOB_HISTORY = 'job_history'
+SYNC_HISTORY = 'sync_history'
+TASK = 'task'
+
+SCHEMA = [
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE account (id TEXT PRIMARY KEY, name TEXT, provider_type TEXT)',
+    'CREATE TABLE job (name TEXT PRIMARY KEY, position INTEGER, job_type TEXT, '
+    'account_id TEXT, fields TEXT, has_job_history INTEGER)',
+    'CREATE TABLE job_run (job TEXT NOT NULL, run INTEGER NOT NULL, start_time INTEGER, '
+    'stop_time INTEGER, elapse_time REAL, status TEXT, '
+    'upload_bytes_per_second REAL, download_bytes_per_second REAL)',
+    # rowid keeps the log order, the reports list actions and exceptions in
+    # the order they first appear
+    'CREATE TABLE sync_file (job TEXT NOT NULL, name TEXT, timestamp REAL, action TEXT, '
+    'result TEXT, exception TEXT, is_dir INTEGER)',
+    'CREATE TABLE task (job TEXT NOT NULL, timestamp REAL, task TEXT, size INTEGER)',
+    # kind is job_history, sync_history or task. failed is 0 when the logs
+    # are missing and 1 when parsing them failed
+    'CREATE TABLE load_error (job TEXT NOT NULL, kind TEXT NOT NULL, error TEXT, '
+    'failed INTEGER)',
+]
+INDEXES = [
+    'CREATE INDEX job_run_job ON job_run (job, run)',
+    'CREATE INDEX sync_file_job_time ON sync_file (job, timestamp)',
+    'CREATE INDEX sync_file_job_action ON sync_file (job, action, result, name)',
+    'CREATE INDEX sync_file_exception ON sync_file (exception, timestamp)',
+    'CREATE INDEX sync_file_name ON sync_file (name, action, timestamp)',
+    'CREATE INDEX task_job_time ON task (job, timestamp)',
+    'CREATE INDEX task_job_task ON task (job, task, size)',
+]
+SYNC_FILE_COLUMNS = ('name', 'timestamp', 'action', 'result', 'exception', 'is_dir')
+# Per file and action state, as SyncFileHistory keeps it with track_states
+FILE_STATE_SQL = ('SELECT name, action, MIN(timestamp) AS first_time, '
+                  'MAX(timestamp) AS last_time, COUNT(*) AS attempts, '
+                  "SUM(result IS NOT 'success') AS failures, "
+                  "MIN(CASE WHEN result = 'success' THEN timestamp END) AS first_success "
+                  'FROM sync_file WHERE job = ? GROUP BY name, action')
+
+
+class ExportCounts:
+    def __init__(self):
+        self.jobs = 0
+        self.job_runs = 0
+        self.sync_files = 0
+        self.tasks = 0
+        self.errors = 0
+
+
+def insert_batches(conn, sql, rows) -> int:
+    total = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            return total
+        conn.executemany(sql, batch)
+        total += len(batch)
+
+
+def add_load_error(conn, counts: ExportCounts, job_name, kind, error, failed=True):
+    conn.execute('INSERT INTO load_error VALUES (?, ?, ?, ?)',
+                 (job_name, kind, error, int(failed)))
+    counts.errors += 1
+
+
+def load_into_job(conn, counts: ExportCounts, job_name, kind, sql, rows) -> int:
+    # A log that fails halfway leaves none of its job's rows behind
+    conn.execute('SAVEPOINT load_job')
+    try:
+        total = insert_batches(conn, sql, rows)
+    except Exception as e:
+        conn.execute('ROLLBACK TO load_job')
+        conn.execute('RELEASE load_job')
+        add_load_error(conn, counts, job_name, kind, f'{type(e).__name__}: {e}')
+        return 0
+    conn.execute('RELEASE load_job')
+    return total
+
+
+def iter_sync_file_rows(job_name, paths):
+    for path in paths:
+        for name, timestamp, action, result, exception, is_dir in \
+                iter_history_rows(iter_file_lines(path)):
+            yield (job_name, name, timestamp, action, result, exception,
+                   None if is_dir is None else int(is_dir))
+
+
+def iter_task_rows(job_name, paths):
+    for path in paths:
+        for line in iter_file_lines(path, needle=TASK_SUBMITTED_FILTER):
+            task_name = parse_task_name(line)
+            if task_name is None:
+                continue
+            yield (job_name, parse_log_timestamp(line), task_name, parse_upload_size(line))
+
+
+def read_version(read, hbs_log_path):
+    try:
+        return read(hbs_log_path)
+    except (OSError, ValueError):
+        return None
+
+
+def export_meta(conn, hbs_log_path, hbs: HybridBackupSync):
+    # Versions the caller already read (--hbs-summary) are not read again
+    meta = {
+        'db_version': DB_VERSION,
+        'report_path': os.path.abspath(hbs_log_path),
+        'hbs_version': hbs.hbs_version if hbs.hbs_version is not None
+        else read_version(get_hbs_version, hbs_log_path),
+        'cc3_build_number': hbs.cc3_build_number if hbs.cc3_build_number is not None
+        else read_version(get_cc3_version, hbs_log_path),
+        'config': json.dumps(hbs.config),
+    }
+    conn.executemany('INSERT INTO meta VALUES (?, ?)',
+                     [(k, None if v is None else str(v)) for k, v in meta.items()])
+
+
+def export_jobs(conn, counts: ExportCounts, hbs: HybridBackupSync, job_histories):
+    conn.executemany('INSERT INTO account VALUES (?, ?, ?)',
+                     [(a.id, a.name, a.provider_type) for a in hbs.accounts])
+    loaded = {job.name: result for job, result in job_histories}
+    for position, job in enumerate(hbs.jobs):
+        result = loaded.get(job.name)
+        conn.execute('INSERT OR IGNORE INTO job VALUES (?, ?, ?, ?, ?, ?)',
+                     (job.name, position, job.job_type, job.account_id,
+                      json.dumps(job_fields(job)), int(result is not None)))
+        counts.jobs += 1
+        if result is None:
+            continue
+        if not result.ok:
+            add_load_error(conn, counts, job.name, JOB_HISTORY, result.error)
+            continue
+        counts.job_runs += insert_batches(
+            conn, 'INSERT INTO job_run VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((job.name, run, r.start_time, r.stop_time, r.elapse_time, r.status,
+              r.upload_bytes_per_second, r.download_bytes_per_second)
+             for run, r in enumerate(result.value.records())))
+
+
+def export_report_db(path, hbs_log_path, hbs: HybridBackupSync, index: ReportIndex,
+                     executor=None, cache=None) -> ExportCounts:
+    # hbs comes from the caller's HybridBackupSync.from_config, its config
+    # is stored so queries rebuild the same model
+    counts = ExportCounts()
+    job_histories = load_job_histories(executor, index, hbs.jobs, cache)
+
+    # Load into a fresh file and rename it at the end, so a failed export
+    # never leaves a half written database behind
+    tmp_path = f'{path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('PRAGMA journal_mode = MEMORY')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(f'PRAGMA user_version = {DB_VERSION}')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        export_meta(conn, hbs_log_path, hbs)
+        with instrument.span('export: jobs'):
+            export_jobs(conn, counts, hbs, job_histories)
+
+        with instrument.span('export: sync history') as s:
+            for job in hbs.jobs:
+                if job.job_type != 'sync':
+                    continue
+                message, paths = find_sync_history_logs(index, job)
+                if message is not None:
+                    add_load_error(conn, counts, job.name, SYNC_HISTORY, message, failed=False)
+                    continue
+                counts.sync_files += load_into_job(
+                    conn, counts, job.name, SYNC_HISTORY,
+                    'INSERT INTO sync_file VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    iter_sync_file_rows(job.name, paths))
+            s.add(lines=counts.sync_files)
+
+        with instrument.span('export: task') as s:
+            for job in hbs.jobs:
+                counts.tasks += load_into_job(
+                    conn, counts, job.name, TASK, 'INSERT INTO task VALUES (?, ?, ?, ?)',
+                    iter_task_rows(job.name, list_job_log_file(index, job.name)))
+            s.add(lines=counts.tasks)
+
+        with instrument.span('export: index'):
+            for statement in INDEXES:
+                conn.execute(statement)
+            conn.commit()
+            conn.execute('ANALYZE')
+        conn.close()
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return counts
+
+
+def print_export_counts(path, counts: ExportCounts, fp=sys.stderr):
+    print(f'Exported {counts.jobs} jobs, {counts.job_runs} job runs, '
+          f'{counts.sync_files} sync records and {counts.tasks} tasks to {path}'
+          + (f' ({counts.errors} load errors)' if counts.errors else ''), file=fp)
+
+
+class ReportDB:
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'{path} not exists')
+        self.path = path
+        self._hbs: Optional[HybridBackupSync] = None
+        self._conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != DB_VERSION:
+            self._conn.close()
+            raise ValueError(f'{path} is not a version {DB_VERSION} report database')
+
+    def close(self):
+        self._conn.close()
+
+    def execute(self, sql, params=()) -> sqlite3.Cursor:
+        return self._conn.execute(sql, params)
+
+    def meta(self, key):
+        row = self.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def hbs(self) -> HybridBackupSync:
+        # The stored config is parsed once per database
+        if self._hbs is None:
+            cc3_build_number = self.meta('cc3_build_number')
+            self._hbs = HybridBackupSync.from_config(
+                json.loads(self.meta('config')), hbs_version=self.meta('hbs_version'),
+                cc3_build_number=int(cc3_build_number) if cc3_build_number is not None
+                else None)
+        return self._hbs
+
+    def errors(self, kind) -> Dict[str, Tuple[str, bool]]:
+        return {job: (error, bool(failed)) for job, error, failed in self.execute(
+            'SELECT job, error, failed FROM load_error WHERE kind = ?', (kind,))}
+
+    def has_job_history(self, job_name):
+        row = self.execute('SELECT has_job_history FROM job WHERE name = ?',
+                           (job_name,)).fetchone()
+        return bool(row and row[0])
+
+    def job_history(self, job_name) -> JobHistory:
+        job_history = JobHistory()
+        for start, stop, elapse, status, upload, download in self.execute(
+                'SELECT start_time, stop_time, elapse_time, status, upload_bytes_per_second, '
+                'download_bytes_per_second FROM job_run WHERE job = ? ORDER BY run',
+                (job_name,)):
+            job_history.add(JobHistoryRecord(start_time=start, elapse_time=elapse,
+                                             stop_time=stop, status=status,
+                                             upload_bytes_per_second=upload,
+                                             download_bytes_per_second=download))
+        return job_history
+
+    def _count_names(self, where, params):
+        return self.execute(f'SELECT COUNT(DISTINCT name) FROM sync_file WHERE {where}',
+                            params).fetchone()[0]
+
+    def _file_states(self, job_name, sql, params) -> List[FileState]:
+        states = list()
+        for name, action, first, last, attempts, failures, first_success in \
+                self.execute(sql, params).fetchall():
+            # The last record wins, the later line of the log on a tie
+            result, exception = self.execute(
+                'SELECT result, exception FROM sync_file WHERE job = ? AND name = ? '
+                'AND action = ? ORDER BY timestamp DESC, rowid DESC LIMIT 1',
+                (job_name, name, action)).fetchone()
+            states.append(FileState(name, action, first, last, attempts, failures,
+                                    result, exception, first_success))
+        return states
+
+    def most_retried(self, job_name, k=10) -> List[FileState]:
+        return self._file_states(
+            job_name, f'{FILE_STATE_SQL} HAVING failures > 0 '
+                      'ORDER BY failures DESC, name, action LIMIT ?',
+            (job_name, k))
+
+    def slowest_to_succeed(self, job_name, k=10) -> List[FileState]:
+        return self._file_states(
+            job_name, f'{FILE_STATE_SQL} HAVING first_success IS NOT NULL '
+                      'ORDER BY first_success - first_time DESC, name, action LIMIT ?',
+            (job_name, k))
+
+    def sync_history_result(self, job_name, top_files=0):
+        # Same record as results.sync_history_result() on the parsed logs
+        total_sync, t0, t1 = self.execute(
+            'SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM sync_file WHERE job = ?',
+            (job_name,)).fetchone()
+        total_files = self._count_names('job = ? AND is_dir = 0', (job_name,))
+        empty = total_files == 0
+        actions = list()
+        for action, sync in self.execute(
+                'SELECT action, COUNT(*) FROM sync_file WHERE job = ? '
+                'GROUP BY action ORDER BY MIN(rowid)', (job_name,)).fetchall():
+            params = (job_name, action)
+            actions.append({
+                'action': action,
+                'sync': sync,
+                'files': self._count_names('job = ? AND action = ?', params),
+                'success': self._count_names("job = ? AND action = ? AND result = 'success'",
+                                             params),
+                'fail': self.execute(
+                    "SELECT COUNT(*) FROM (SELECT name FROM sync_file "
+                    "WHERE job = ? AND action = ? AND result = 'fail' EXCEPT "
+                    "SELECT name FROM sync_file WHERE job = ? AND action = ? "
+                    "AND result = 'success')", params + params).fetchone()[0],
+            })
+        result = {
+            'type': 'sync_history',
+            'job': job_name,
+            'start_time': None if empty else format_time(datetime.utcfromtimestamp(t0)),
+            'end_time': None if empty else format_time(datetime.utcfromtimestamp(t1)),
+            'total_sync': total_sync,
+            'total_files': total_files,
+            'total_folders': self._count_names('job = ? AND is_dir = 1', (job_name,)),
+            'actions': actions,
+            'exceptions': [{'exception': e, 'count': count} for e, count in self.execute(
+                'SELECT exception, COUNT(*) FROM sync_file '
+                'WHERE job = ? AND exception IS NOT NULL '
+                'GROUP BY exception ORDER BY MIN(rowid)', (job_name,))],
+        }
+        if top_files:
+            result['most_retried'] = [file_state_result(s)
+                                      for s in self.most_retried(job_name, top_files)]
+            result['slowest_to_succeed'] = [file_state_result(s) for s in
+                                            self.slowest_to_succeed(job_name, top_files)]
+        return result
+
+    def task_aggregators(self, job_name) -> List:
+        task_counter = TaskCounter()
+        for task_name, count in self.execute(
+                'SELECT task, COUNT(*) FROM task WHERE job = ? '
+                'GROUP BY task ORDER BY MIN(rowid)', (job_name,)):
+            task_counter.counter[task_name] = count
+        upload_size_histogram = UploadSizeHistogram()
+        for size, count in self.execute(
+                'SELECT size, COUNT(*) FROM task WHERE job = ? AND task = ? '
+                'AND size IS NOT NULL GROUP BY size', (job_name, UPLOAD_TASK_NAME)):
+            upload_size_histogram.add_size(size, count)
+        return [task_counter, upload_size_histogram]
+
+    def sync_files(self, job=None, action=None, result=None, exception=None,
+                   since=None, until=None, limit=None) -> Iterator[dict]:
+        conditions = list()
+        params = list()
+        for column, value in (('job', job), ('action', action), ('result', result),
+                              ('exception', exception)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('timestamp <= ?')
+            params.append(until)
+        sql = f'SELECT job, {", ".join(SYNC_FILE_COLUMNS)} FROM sync_file'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY timestamp'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        for row in self.execute(sql, params):
+            record = {'type': 'sync_file'}
+            record.update(zip(('job',) + SYNC_FILE_COLUMNS, row))
+            if record['is_dir'] is not None:
+                record['is_dir'] = bool(record['is_dir'])
+            yield record
@@ -0,0 +1,495 @@
+import abc
+import glob
+import io
+import os
+import queue
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+GZIP_SUFFIX = '.gz'
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ZIP_SUFFIXES = ('.zip',)
+
+READ_AHEAD_CHUNK_SIZE = 1024 * 1024
+READ_AHEAD_DEPTH = 8
+# Members of compressed tars up to SPOOL_MEMBER_LIMIT are kept in memory,
+# SPOOL_MEMORY_LIMIT in total per archive, the others go to a spool file
+SPOOL_MEMBER_LIMIT = 1024 * 1024
+SPOOL_MEMORY_LIMIT = 16 * 1024 * 1024
+
+# gzip, tarfile, zipfile and tempfile are imported where archives are read,
+# plain directory reports never need them
+
+
+def is_archive_name(path):
+    return path.endswith(TAR_SUFFIXES) or path.endswith(ZIP_SUFFIXES)
+
+
+class MemberInfo:
+    def __init__(self, size, mtime_ns):
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+# Reads [offset, offset + size) of a file descriptor with pread, which does
+# not move the shared file offset, so readers stay independent even across
+# forked worker processes
+class PositionalReader(io.RawIOBase):
+    def __init__(self, fd, offset, size):
+        self._fd = fd
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        data = os.pread(self._fd, n, self._offset + self._pos)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+# Reads a decompressing stream in a background thread. zlib releases the GIL
+# while inflating, so decompressing the next chunks overlaps with parsing
+class ReadAheadReader(io.RawIOBase):
+    def __init__(self, raw: BinaryIO, chunk_size=READ_AHEAD_CHUNK_SIZE,
+                 depth=READ_AHEAD_DEPTH):
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._buffer = b''
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        try:
+            while True:
+                data = self._raw.read(self._chunk_size)
+                if not data:
+                    break
+                if not self._put(data):
+                    return
+            self._put(b'')
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if item == b'':
+                self._eof = True
+            self._buffer = item
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+
+class Archive(abc.ABC):
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.members: Dict[str, MemberInfo] = dict()
+        self.dirs: Dict[str, Tuple[List[str], List[str]]] = {'': (list(), list())}
+
+    def _add_dir(self, name):
+        if name in self.dirs:
+            return
+        parent, base = os.path.split(name)
+        self._add_dir(parent)
+        self.dirs[name] = (list(), list())
+        self.dirs[parent][0].append(base)
+
+    def _add_member(self, name, info: MemberInfo):
+        parent, base = os.path.split(name)
+        self._add_dir(parent)
+        if name not in self.members:
+            self.dirs[parent][1].append(base)
+        self.members[name] = info
+
+    @abc.abstractmethod
+    def open_member(self, name) -> BinaryIO:
+        pass
+
+    def close(self):
+        pass
+
+
+class ZipArchive(Archive):
+    def __init__(self, path):
+        import zipfile
+        super().__init__(path)
+        self._zip = zipfile.ZipFile(path)
+        self._pid = os.getpid()
+        self._names = dict()
+        for info in self._zip.infolist():
+            name = normalize_member_name(info.filename)
+            if info.is_dir():
+                self._add_dir(name)
+            else:
+                self._add_member(name, MemberInfo(info.file_size, self.mtime_ns))
+                self._names[name] = info
+
+    def open_member(self, name):
+        if self._pid != os.getpid():
+            # A forked worker shares the file offset with its parent, reopen
+            # the archive once per process
+            import zipfile
+            self._zip = zipfile.ZipFile(self.path)
+            self._pid = os.getpid()
+        return self._zip.open(self._names[name])
+
+    def close(self):
+        self._zip.close()
+
+
+class Spool:
+    # A member decompressed from a tar stream, either in memory or at
+    # offset of a spool file. written grows while it is being decompressed
+    __slots__ = ('data', 'fd', 'offset', 'written', 'done')
+
+    def __init__(self, data=None, fd=None, offset=0):
+        self.data = data
+        self.fd = fd
+        self.offset = offset
+        self.written = 0 if data is None else len(data)
+        self.done = data is not None
+
+
+# Reads a member while it is being spooled, waiting for the spool thread
+class SpoolReader(io.RawIOBase):
+    def __init__(self, archive: 'TarArchive', name):
+        self._archive = archive
+        self._name = name
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        spool = self._archive.wait_spool(self._name, self._pos)
+        n = min(len(b), spool.written - self._pos)
+        if n <= 0:
+            return 0
+        if spool.data is not None:
+            data = spool.data[self._pos:self._pos + n]
+        else:
+            data = os.pread(spool.fd, n, spool.offset + self._pos)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class TarArchive(Archive):
+    def __init__(self, path):
+        import tarfile
+        super().__init__(path)
+        self._fd = os.open(path, os.O_RDONLY)
+        self._offsets: Dict[str, int] = dict()
+        self._compressed = not path.endswith('.tar')
+        if not self._compressed:
+            # Uncompressed: read members in place, nothing is decompressed
+            with tarfile.open(path, 'r:') as tar:
+                for member in tar:
+                    if self._add_tar_member(member):
+                        self._offsets[member.name] = member.offset_data
+            return
+
+        # Compressed tar streams are not seekable. The headers are indexed in
+        # one pass that keeps only small members (config files) in memory;
+        # the others are decompressed on first open, see _advance
+        self._spools: Dict[str, Spool] = dict()
+        self._spool_files = list()
+        self._memory = 0
+        self._reset_cursor()
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if self._add_tar_member(member) and self._fits_in_memory(member.size):
+                    self._keep(member.name, Spool(tar.extractfile(member).read()))
+
+    def _reset_cursor(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._cursor_lock = threading.Lock()
+        self._cursor = None
+        self._cursor_eof = False
+        self._cursor_error: Optional[BaseException] = None
+        self._spool_fd = None
+        self._spool_end = 0
+
+    def _add_tar_member(self, member):
+        name = normalize_member_name(member.name)
+        if member.isdir():
+            self._add_dir(name)
+        elif member.isfile():
+            self._add_member(name, MemberInfo(member.size, int(member.mtime * 1e9)))
+            return True
+        return False
+
+    def _fits_in_memory(self, size):
+        return size <= SPOOL_MEMBER_LIMIT and self._memory + size <= SPOOL_MEMORY_LIMIT
+
+    def _keep(self, tar_name, spool: Spool):
+        if spool.data is not None:
+            self._memory += len(spool.data)
+        self._spools[normalize_member_name(tar_name)] = spool
+
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        # A forked worker may have copied a spool thread in the middle of a
+        # member: keep the finished spools, decompress the rest again into
+        # a spool file of its own
+        self._spools = {name: spool for name, spool in self._spools.items() if spool.done}
+        self._reset_cursor()
+
+    def _spool_to_disk(self, name, src, size):
+        if self._spool_fd is None:
+            import tempfile
+            spool_file = tempfile.TemporaryFile()
+            self._spool_files.append(spool_file)
+            self._spool_fd = spool_file.fileno()
+        fd = self._spool_fd
+        spool = Spool(fd=fd, offset=self._spool_end)
+        self._spool_end += size
+        with self._cond:
+            self._spools[name] = spool
+            self._cond.notify_all()
+        while True:
+            data = src.read(READ_AHEAD_CHUNK_SIZE)
+            if not data:
+                break
+            os.pwrite(fd, data, spool.offset + spool.written)
+            with self._cond:
+                spool.written += len(data)
+                self._cond.notify_all()
+
+    def _advance(self, target):
+        # Decompresses the archive up to and including target. Every member
+        # passed on the way is kept, small ones in memory and the others in
+        # the spool file, so the stream is decompressed once per process
+        import tarfile
+        try:
+            with self._cursor_lock:
+                if self._cursor is None:
+                    self._cursor = tarfile.open(self.path, 'r|*')
+                while target not in self._spools:
+                    member = self._cursor.next()
+                    if member is None:
+                        self._cursor.close()
+                        with self._cond:
+                            self._cursor_eof = True
+                            self._cond.notify_all()
+                        return
+                    name = normalize_member_name(member.name)
+                    if not member.isfile() or name in self._spools:
+                        continue
+                    src = self._cursor.extractfile(member)
+                    if self._fits_in_memory(member.size):
+                        spool = Spool(src.read())
+                        with self._cond:
+                            self._keep(member.name, spool)
+                            self._cond.notify_all()
+                    else:
+                        self._spool_to_disk(name, src, member.size)
+                        with self._cond:
+                            self._spools[name].done = True
+                            self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._cursor_error = e
+                self._cond.notify_all()
+
+    def wait_spool(self, name, pos) -> Spool:
+        with self._cond:
+            while True:
+                if self._cursor_error is not None:
+                    raise self._cursor_error
+                spool = self._spools.get(name)
+                if spool is not None and (spool.done or spool.written > pos):
+                    return spool
+                if spool is None and self._cursor_eof:
+                    raise FileNotFoundError(name)
+                self._cond.wait()
+
+    def open_member(self, name):
+        size = self.members[name].size
+        if not self._compressed:
+            return io.BufferedReader(PositionalReader(self._fd, self._offsets[name], size))
+        self._check_fork()
+        if name not in self._spools:
+            # Decompression runs in a thread and overlaps with the parsing
+            # of the part of the member already spooled
+            threading.Thread(target=self._advance, args=(name,), daemon=True).start()
+        return io.BufferedReader(SpoolReader(self, name))
+
+    def close(self):
+        os.close(self._fd)
+        if self._compressed:
+            for spool_file in self._spool_files:
+                spool_file.close()
+
+
+def normalize_member_name(name):
+    name = os.path.normpath(name.lstrip('/'))
+    return '' if name == '.' else name
+
+
+_archives: Dict[str, Archive] = dict()
+
+
+def mount_archive(path) -> Archive:
+    path = os.path.abspath(path)
+    archive = _archives.get(path)
+    if archive is None:
+        if path.endswith(ZIP_SUFFIXES):
+            archive = ZipArchive(path)
+        else:
+            archive = TarArchive(path)
+        _archives[path] = archive
+    return archive
+
+
+def close_archives():
+    for archive in _archives.values():
+        archive.close()
+    _archives.clear()
+
+
+def resolve(path) -> Tuple[Optional[Archive], str]:
+    abs_path = os.path.abspath(path)
+    for root, archive in _archives.items():
+        if abs_path == root:
+            return archive, ''
+        if abs_path.startswith(root + os.sep):
+            return archive, abs_path[len(root) + 1:]
+
+    if os.path.exists(abs_path):
+        if is_archive_name(abs_path) and os.path.isfile(abs_path):
+            return mount_archive(abs_path), ''
+        return None, path
+
+    parent = abs_path
+    while True:
+        parent, _ = os.path.split(parent)
+        if os.path.isfile(parent):
+            if not is_archive_name(parent):
+                break
+            archive = mount_archive(parent)
+            return archive, abs_path[len(parent) + 1:]
+        if parent == os.path.dirname(parent):
+            break
+    return None, path
+
+
+def is_plain_file(path):
+    return not path.endswith(GZIP_SUFFIX) and not is_archive_name(path) \
+        and os.path.isfile(path)
+
+
+def exists(path):
+    archive, member = resolve(path)
+    if archive is None:
+        return os.path.exists(path)
+    return member in archive.members or member in archive.dirs
+
+
+def stat(path) -> MemberInfo:
+    archive, member = resolve(path)
+    if archive is None:
+        st = os.stat(path)
+        return MemberInfo(st.st_size, st.st_mtime_ns)
+    if member not in archive.members:
+        raise FileNotFoundError(path)
+    return archive.members[member]
+
+
+def open_binary(path) -> BinaryIO:
+    archive, member = resolve(path)
+    if archive is None:
+        fp = open(path, 'rb')
+    else:
+        if member not in archive.members:
+            raise FileNotFoundError(path)
+        fp = archive.open_member(member)
+    if path.endswith(GZIP_SUFFIX):
+        import gzip
+        return io.BufferedReader(ReadAheadReader(gzip.GzipFile(fileobj=fp)))
+    return fp
+
+
+def open_text(path):
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8', errors='replace')
+
+
+def expand_report_paths(patterns) -> List[str]:
+    paths = list()
+    for pattern in patterns:
+        # A report named like rep[1] is taken as is, only missing paths are globs
+        if glob.has_magic(pattern) and not exists(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def find_report_root(path):
+    # Archives usually wrap the report in a single top-level directory
+    if exists(os.path.join(path, 'config.json')):
+        return path
+    archive, member = resolve(path)
+    if archive is None:
+        return path
+    dirs, files = archive.dirs.get(member, (list(), list()))
+    if len(dirs) == 1 and not files:
+        return os.path.join(path, dirs[0])
+    return path
+
+
+def walk(top):
+    archive, member = resolve(top)
+    if archive is None:
+        yield from os.walk(top)
+        return
+    pending = [member]
+    while pending:
+        name = pending.pop(0)
+        dirs, files = archive.dirs.get(name, (list(), list()))
+        root = top
+        if name != member:
+            root = os.path.join(top, os.path.relpath(name, member) if member else name)
+        yield root, list(dirs), list(files)
+        pending[0:0] = [os.path.join(name, d) if name else d for d in dirs]
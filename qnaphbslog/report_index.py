@@ -0,0 +1,175 @@
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+from . import instrument, report_fs
+
+SYSTEM_DIR_NAME = 'system'
+JOB_LOG_DIR_NAME = 'log'
+JOB_HISTORY_FILE_NAME = 'job_history.json'
+ENGINE_LOG_FILE_NAME = 'engine.log'
+SYNC_HISTORY_LOG_FILE_NAME = 'syncengine-history.log'
+INDEX_VERSION = 1
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.environ.get('QNAPHBSLOG_CACHE_DIR',
+                          os.path.join(cache_home, 'qnaphbslog'))
+
+
+class JobFiles:
+    def __init__(self, job_path, engine_logs=None, sync_history_logs=None):
+        self.job_path = job_path
+        self.engine_logs: List[str] = engine_logs or list()
+        self.sync_history_logs: List[str] = sync_history_logs or list()
+
+    @property
+    def job_history_path(self):
+        return os.path.join(self.job_path, JOB_HISTORY_FILE_NAME)
+
+    @property
+    def log_path(self):
+        return os.path.join(self.job_path, JOB_LOG_DIR_NAME)
+
+
+class ReportIndex:
+    def __init__(self, report_path, jobs: Dict[str, JobFiles], files: List[str],
+                 dir_mtimes: Dict[str, int]):
+        self.report_path = report_path
+        self.jobs = jobs
+        self.files = files
+        self.dir_mtimes = dir_mtimes
+
+    def get_job(self, job_name) -> Optional[JobFiles]:
+        return self.jobs.get(job_name)
+
+    def is_stale(self):
+        for rel_dir, mtime in self.dir_mtimes.items():
+            try:
+                st = os.stat(os.path.normpath(os.path.join(self.report_path, rel_dir)))
+            except OSError:
+                return True
+            if st.st_mtime_ns != mtime:
+                return True
+        return False
+
+    def to_dict(self):
+        def rel(path):
+            return os.path.relpath(path, self.report_path)
+
+        return {
+            'version': INDEX_VERSION,
+            'report_path': self.report_path,
+            'jobs': {name: {'job_path': rel(j.job_path),
+                            'engine_logs': [rel(p) for p in j.engine_logs],
+                            'sync_history_logs': [rel(p) for p in j.sync_history_logs]}
+                     for name, j in self.jobs.items()},
+            'files': self.files,
+            'dir_mtimes': self.dir_mtimes,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        report_path = d['report_path']
+
+        def full(path):
+            return os.path.normpath(os.path.join(report_path, path))
+
+        jobs = {name: JobFiles(full(j['job_path']),
+                               [full(p) for p in j['engine_logs']],
+                               [full(p) for p in j['sync_history_logs']])
+                for name, j in d['jobs'].items()}
+        return cls(report_path, jobs, d['files'], d['dir_mtimes'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.to_dict(), fp)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as fp:
+            d = json.load(fp)
+        if d.get('version') != INDEX_VERSION:
+            return None
+        return cls.from_dict(d)
+
+
+@instrument.timed('discovery: walk report')
+def build_report_index(report_path) -> ReportIndex:
+    report_path = os.path.abspath(report_path)
+    archive, _ = report_fs.resolve(report_path)
+    if archive is not None:
+        entries = ((root, dirs, file_names, None)
+                   for root, dirs, file_names in report_fs.walk(report_path))
+        return index_from_walk(report_path, entries,
+                               {os.path.relpath(archive.path, report_path): archive.mtime_ns})
+    entries = ((root, dirs, file_names, os.stat(root).st_mtime_ns)
+               for root, dirs, file_names in os.walk(report_path))
+    return index_from_walk(report_path, entries)
+
+
+def index_from_walk(report_path, walk_entries, dir_mtimes=None) -> ReportIndex:
+    # walk_entries are os.walk() tuples with the mtime of the directory, None
+    # inside archives where the archive mtime stands for every directory
+    jobs: Dict[str, JobFiles] = dict()
+    log_dirs: Dict[str, JobFiles] = dict()
+    files: List[str] = list()
+    dir_mtimes = dict(dir_mtimes or dict())
+    for root, dirs, file_names, mtime_ns in walk_entries:
+        rel_root = os.path.relpath(root, report_path)
+        if mtime_ns is not None:
+            dir_mtimes[rel_root] = mtime_ns
+        files.extend(os.path.normpath(os.path.join(rel_root, f)) for f in file_names)
+
+        if root.endswith(SYSTEM_DIR_NAME):
+            for d in dirs:
+                if d in jobs:
+                    continue
+                job_files = JobFiles(os.path.join(root, d))
+                jobs[d] = job_files
+                log_dirs[job_files.log_path] = job_files
+
+        job_files = log_dirs.get(root)
+        if job_files is None:
+            continue
+        for f in file_names:
+            if ENGINE_LOG_FILE_NAME in f:
+                job_files.engine_logs.append(os.path.join(root, f))
+            if SYNC_HISTORY_LOG_FILE_NAME in f:
+                job_files.sync_history_logs.append(os.path.join(root, f))
+    return ReportIndex(report_path, jobs, files, dir_mtimes)
+
+
+def get_index_cache_path(report_path, cache_dir=None):
+    import hashlib
+    cache_dir = cache_dir or default_cache_dir()
+    key = hashlib.sha1(os.path.abspath(report_path).encode()).hexdigest()
+    return os.path.join(cache_dir, f'index-{key}.json')
+
+
+@instrument.timed('discovery: report index')
+def load_report_index(report_path, persist=True, cache_dir=None,
+                      build: Callable[[str], ReportIndex] = build_report_index) -> ReportIndex:
+    if not persist:
+        return build(report_path)
+
+    cache_path = get_index_cache_path(report_path, cache_dir)
+    index = None
+    try:
+        index = ReportIndex.load(cache_path)
+    except (OSError, ValueError, KeyError):
+        pass
+    if index is not None and not index.is_stale():
+        return index
+
+    index = build(report_path)
+    try:
+        index.save(cache_path)
+    except OSError:
+        pass
+    return index
@@ -0,0 +1,301 @@
+import heapq
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+from .parsers import LOG_LEVELS
+
+if TYPE_CHECKING:
+    from .engine_log import TaskCounter, UploadSizeHistogram
+    from .fleet import FleetOptions, FleetSummary, ReportSummary, SyncSummary
+    from .hbs import HybridBackupSync
+    from .job import Job
+    from .job_history import JobHistory
+    from .server_log import JobServerLog, LatencyHistogram, MinuteBucket, ServerLogStats
+    from .sync_file_history import FileState, SyncFileHistory
+    from .timeline import JobTimeline, RunTimeline
+
+# Every report is also available as a flat dict record with a 'type' key, so
+# the structured writers in output.py never have to parse the text output
+
+THROUGHPUT_FIELDS = (('upload_bytes_per_second', 'upload'),
+                     ('download_bytes_per_second', 'download'))
+LATENCY_PERCENTILES = (50, 95, 99)
+TOP_MINUTES = 3
+
+
+def format_time(t: Optional[datetime]):
+    return t.isoformat() if t is not None else None
+
+
+def job_fields(job: 'Job'):
+    fields = dict()
+    for cls in reversed(type(job).__mro__):
+        for slot in getattr(cls, '__slots__', ()):
+            fields[slot] = getattr(job, slot)
+    return fields
+
+
+def hbs_summary_result(hbs: 'HybridBackupSync'):
+    jobs = list()
+    for job in hbs.jobs:
+        account = hbs.get_account(job.account_id)
+        fields = job_fields(job)
+        fields['provider_type'] = account.provider_type if account else None
+        jobs.append(fields)
+    return {
+        'type': 'hbs_summary',
+        'hbs_version': hbs.hbs_version,
+        'cc3_build_number': hbs.cc3_build_number,
+        'accounts': [{'name': a.name, 'provider_type': a.provider_type}
+                     for a in hbs.accounts],
+        'jobs': jobs,
+    }
+
+
+def job_history_result(job_name, job_history: 'JobHistory', stats=False, regressions=True):
+    result = {
+        'type': 'job_history',
+        'job': job_name,
+        'total_run': job_history.total_run_times(),
+        'complete': job_history.total_complete_times(),
+        'fail': job_history.total_fail_times(),
+        'stopped': job_history.total_stop_times(),
+    }
+    if stats:
+        result['stats'] = job_history_stats(job_history, regressions)
+    return result
+
+
+def percentile_dict(percentiles):
+    return {f'p{p}': v for p, v in percentiles.items()}
+
+
+def job_history_stats(job_history: 'JobHistory', regressions=True):
+    stats = {'duration': percentile_dict(job_history.percentiles('elapse_time'))}
+    for field, label in THROUGHPUT_FIELDS:
+        stats[label] = percentile_dict(job_history.percentiles(field))
+        if regressions:
+            stats[f'{label}_regressions'] = [
+                {'run': r.run, 'start_time': r.start_time, 'value': r.value,
+                 'baseline': r.baseline, 'ratio': r.ratio}
+                for r in job_history.detect_regressions(field)]
+    return stats
+
+
+def format_timestamp(timestamp):
+    return format_time(datetime.utcfromtimestamp(timestamp)) if timestamp is not None else None
+
+
+def file_state_result(state: 'FileState'):
+    return {
+        'name': state.name,
+        'action': state.action,
+        'attempts': state.attempts,
+        'failures': state.failures,
+        'first_time': format_timestamp(state.first_time),
+        'last_time': format_timestamp(state.last_time),
+        'last_result': state.last_result,
+        'last_exception': state.last_exception,
+        'time_to_success': state.time_to_success(),
+    }
+
+
+def sync_history_result(job_name, job_history: 'SyncFileHistory', top_files=0):
+    jh = job_history
+    empty = jh.total_files() == 0
+    actions = list()
+    for action in jh.action_types():
+        actions.append({
+            'action': action,
+            'sync': jh.total_sync(action=action),
+            'files': jh.count_files(action=action),
+            'success': jh.count_files(action=action, result='success'),
+            'fail': jh.count_files(action=action, result='fail', exclude_result='success'),
+        })
+    result = {
+        'type': 'sync_history',
+        'job': job_name,
+        'start_time': None if empty else format_time(jh.start_time()),
+        'end_time': None if empty else format_time(jh.end_time()),
+        'total_sync': jh.total_sync(),
+        'total_files': jh.total_files(),
+        'total_folders': jh.total_folders(),
+        'actions': actions,
+        'exceptions': [{'exception': e, 'count': jh.total_sync(exception=e)}
+                       for e in jh.exception_types()],
+    }
+    if top_files:
+        result['most_retried'] = [file_state_result(s) for s in jh.most_retried(top_files)]
+        result['slowest_to_succeed'] = [file_state_result(s)
+                                        for s in jh.slowest_to_succeed(top_files)]
+    return result
+
+
+def task_result(job: 'Job', task_counter: 'TaskCounter',
+                upload_size_histogram: 'UploadSizeHistogram'):
+    result = {'type': 'task', 'job': job.name, 'job_type': job.job_type}
+    result.update(aggregators_result([task_counter, upload_size_histogram]))
+    return result
+
+
+def error_result(job_name, error):
+    return {'type': 'error', 'job': job_name, 'error': error}
+
+
+def refresh_result(t: datetime):
+    return {'type': 'refresh', 'time': format_time(t)}
+
+
+def sync_summary_result(sync: 'SyncSummary', top=None):
+    return {
+        'total_sync': sync.total_sync,
+        'total_files': sync.total_files,
+        'total_folders': sync.total_folders,
+        'actions': [{'action': action, 'sync': count,
+                     'files': sync.action_files[action],
+                     'success': sync.action_success[action],
+                     'fail': sync.action_fail[action]}
+                    for action, count in sync.action_sync.items()],
+        'exceptions': [{'exception': e, 'count': count}
+                       for e, count in sync.exceptions.most_common(top)],
+    }
+
+
+def aggregators_result(aggregators, top=None):
+    task_counter, upload_size_histogram = aggregators
+    return {
+        'total_tasks': task_counter.total(),
+        'tasks': [{'task': name, 'count': count}
+                  for name, count in task_counter.most_common(top)],
+        'uploads': upload_size_histogram.total(),
+        'upload_sizes': [{'bucket': label, 'count': count}
+                         for label, count in upload_size_histogram.buckets()],
+    }
+
+
+def fleet_report_result(report: 'ReportSummary'):
+    result = {'type': 'fleet_report', 'report': report.path, 'jobs': report.jobs,
+              'errors': report.errors}
+    if report.job_history is not None:
+        result['job_history'] = job_history_result(None, report.job_history)
+    if report.sync is not None:
+        result['sync_history'] = sync_summary_result(report.sync)
+    if report.aggregators is not None:
+        result['task'] = aggregators_result(report.aggregators)
+    return result
+
+
+def fleet_summary_result(fleet: 'FleetSummary', options: 'FleetOptions', stats=False, top=10):
+    result = {
+        'type': 'fleet_summary',
+        'reports': len(fleet.reports) + len(fleet.failed),
+        'analyzed': len(fleet.reports),
+        'failed': [{'report': path, 'error': error} for path, error in fleet.failed],
+    }
+    if options.job_history:
+        result['job_history'] = job_history_result(None, fleet.job_history, stats,
+                                                   regressions=False)
+    if options.sync_history:
+        sync = sync_summary_result(fleet.sync, top)
+        for e in sync['exceptions']:
+            e['reports'] = fleet.exception_reports[e['exception']]
+        result['sync_history'] = sync
+    if options.task:
+        result['task'] = aggregators_result(fleet.aggregators, top)
+    return result
+
+
+def levels_result(levels):
+    result = {level.lower(): count for level, count in zip(LOG_LEVELS, levels)}
+    result['none'] = levels[len(LOG_LEVELS)]
+    return result
+
+
+def latency_result(latency: 'LatencyHistogram'):
+    count = latency.count()
+    result = {'count': count, 'mean': latency.mean()}
+    result.update((f'p{p}', latency.percentile(p)) for p in LATENCY_PERCENTILES)
+    result['max'] = latency.max if count else None
+    return result
+
+
+def server_log_file_result(path, stats: 'ServerLogStats'):
+    return {'type': 'server_log_file', 'path': path, 'lines': stats.lines,
+            'continuation_lines': stats.continuation_lines,
+            'jobs': sum(1 for name in stats.jobs if name is not None)}
+
+
+def server_log_minute_result(job_name, minute, bucket: 'MinuteBucket'):
+    return {
+        'type': 'server_log_minute',
+        'job': job_name,
+        'minute': format_timestamp(minute),
+        'records': bucket.records(),
+        'levels': levels_result(bucket.levels),
+        'latency': latency_result(bucket.latency),
+    }
+
+
+def server_log_result(job_name, job: 'JobServerLog', top=10):
+    total = job.total()
+    minutes = job.minutes
+    error_minutes = heapq.nlargest(
+        TOP_MINUTES, (m for m, b in minutes.items() if b.errors()),
+        key=lambda m: (minutes[m].errors(), -m))
+    slow_minutes = heapq.nlargest(
+        TOP_MINUTES, (m for m, b in minutes.items() if b.latency.count()),
+        key=lambda m: (minutes[m].latency.percentile(95), minutes[m].latency.count(), -m))
+    return {
+        'type': 'server_log',
+        'job': job_name,
+        'start_minute': format_timestamp(job.start_minute()),
+        'end_minute': format_timestamp(job.end_minute()),
+        'minutes': len(minutes),
+        'records': total.records(),
+        'levels': levels_result(total.levels),
+        'latency': latency_result(total.latency),
+        'error_minutes': [{'minute': format_timestamp(m), 'errors': minutes[m].errors()}
+                          for m in error_minutes],
+        'slowest_minutes': [{'minute': format_timestamp(m),
+                             'p95': minutes[m].latency.percentile(95),
+                             'requests': minutes[m].latency.count()}
+                            for m in slow_minutes],
+        'error_signatures': [{'signature': signature, 'count': count, 'error': error}
+                             for signature, count, error in job.errors.most_common(top)],
+    }
+
+
+def run_timeline_result(run: 'RunTimeline'):
+    return {
+        'run': run.run,
+        'start_time': format_timestamp(run.start_time),
+        'stop_time': format_timestamp(run.stop_time),
+        'status': run.status,
+        'tasks': run.total_tasks(),
+        'task_counts': dict(run.tasks.most_common()),
+        'upload_bytes': run.upload_bytes,
+        'sync_actions': run.sync_actions,
+        'sync_failures': run.sync_failures,
+    }
+
+
+def timeline_result(job_name, timeline: 'JobTimeline'):
+    first, last = timeline.first_event, timeline.last_event
+    # Runs from before the oldest rotated log or after the newest have no events to show
+    logged = [run for run in timeline.runs
+              if first is not None and run.start_time <= last
+              and (run.stop_time is None or run.stop_time >= first)]
+    outside = run_timeline_result(timeline.outside)
+    for key in ('run', 'start_time', 'stop_time', 'status'):
+        del outside[key]
+    return {
+        'type': 'timeline',
+        'job': job_name,
+        'first_event': format_timestamp(first),
+        'last_event': format_timestamp(last),
+        'events': timeline.events,
+        'untimed_events': timeline.untimed,
+        'total_runs': len(timeline.runs),
+        'runs': [run_timeline_result(run) for run in logged],
+        'outside_runs': outside,
+    }
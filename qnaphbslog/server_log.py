@@ -0,0 +1,327 @@
+import math
+import re
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterable, Optional
+
+from . import instrument, report_fs
+from .chunked_io import iter_file_lines, iter_stream_lines
+from .parsers import (ERROR_LEVEL, LOG_LEVELS, parse_latency_ms, parse_log_level,
+                      parse_log_timestamp)
+from .top_k import TopK
+
+STDIO_PATH = '-'
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# Log-scale latency buckets from 1 ms to 1000 s, LATENCY_BUCKETS_PER_DECADE
+# per power of ten (about 12% wide), percentiles interpolate within them
+LATENCY_BUCKETS_PER_DECADE = 20
+LATENCY_DECADES = 6
+LATENCY_BOUNDS_MS = tuple(10 ** (i / LATENCY_BUCKETS_PER_DECADE)
+                          for i in range(LATENCY_DECADES * LATENCY_BUCKETS_PER_DECADE + 1))
+# Lines with a timestamp but no level are counted in an extra slot
+NO_LEVEL = len(LOG_LEVELS)
+ERROR_SIGNATURES = 256
+SIGNATURE_LENGTH = 160
+SIGNATURE_CACHE_SIZE = 4096
+# Every digit is a '0' to the signature substitutions, so messages that only
+# differ in their numbers share a cached signature
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+MINUTE_PREFIX_LENGTH = len('YYYY-MM-DD HH:MM')
+_SIGNATURE_SUBSTITUTIONS = [
+    (re.compile(rb'"[^"]*"|\'[^\']*\''), b'<str>'),
+    (re.compile(rb'\b[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}\b'
+                rb'|\b(?:0x)?[0-9a-fA-F]{8,}\b'), b'<id>'),
+    (re.compile(rb'\d+(?:\.\d+)?'), b'<n>'),
+    (re.compile(rb'\s+'), b' '),
+]
+
+
+def job_id_pattern(job_ids: Iterable[bytes]):
+    # Longest ids first so an id that prefixes another never shadows it
+    job_ids = sorted((i for i in job_ids if i), key=len, reverse=True)
+    if not job_ids:
+        return None
+    return re.compile(b'|'.join(re.escape(i) for i in job_ids))
+
+
+class JobIdReplacer:
+    def __init__(self, job_id_name_map: Dict[str, str]):
+        self._names = {job_id.encode(): name.encode()
+                       for job_id, name in job_id_name_map.items() if job_id}
+        self._pattern = job_id_pattern(self._names)
+
+    def _replace_match(self, m):
+        return self._names[m.group()]
+
+    def replace(self, data: bytes) -> bytes:
+        if self._pattern is None:
+            return data
+        return self._pattern.sub(self._replace_match, data)
+
+
+def replace_stream(src_fp: BinaryIO, dst_fp: BinaryIO, replacer: JobIdReplacer,
+                   buffer_size=BUFFER_SIZE):
+    # Returns the number of bytes and lines read
+    remainder = b''
+    total_bytes = 0
+    total_lines = 0
+    while True:
+        data = src_fp.read(buffer_size)
+        if not data:
+            break
+        total_bytes += len(data)
+        total_lines += data.count(b'\n')
+        data = remainder + data
+        # Job ids never contain a newline, so line-aligned buffers are safe
+        newline = data.rfind(b'\n')
+        if newline < 0:
+            remainder = data
+            continue
+        remainder = data[newline + 1:]
+        dst_fp.write(replacer.replace(data[:newline + 1]))
+    if remainder:
+        dst_fp.write(replacer.replace(remainder))
+        total_lines += 1
+    return total_bytes, total_lines
+
+
+@contextmanager
+def open_input(path):
+    if path == STDIO_PATH:
+        yield sys.stdin.buffer
+        return
+    with report_fs.open_binary(path) as fp:
+        yield fp
+
+
+@contextmanager
+def open_output(path):
+    if path == STDIO_PATH:
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+        return
+    with open(path, 'wb', buffering=BUFFER_SIZE) as fp:
+        yield fp
+
+
+def replace_job_id_with_name(src_path, dst_path, job_id_name_map: Dict[str, str]):
+    with instrument.span('rewrite: server.log') as s:
+        replacer = JobIdReplacer(job_id_name_map)
+        with open_input(src_path) as src_fp, open_output(dst_path) as dst_fp:
+            s.add(*replace_stream(src_fp, dst_fp, replacer))
+
+
+class LatencyHistogram:
+    # Sparse bucket index -> count, most minutes only see a few buckets
+    __slots__ = ('counts', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts: Dict[int, int] = dict()
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, ms):
+        i = bisect_left(LATENCY_BOUNDS_MS, ms)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.total += ms
+        if ms < self.min:
+            self.min = ms
+        if ms > self.max:
+            self.max = ms
+
+    def merge(self, other: 'LatencyHistogram'):
+        for i, n in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def count(self):
+        return sum(self.counts.values())
+
+    def mean(self):
+        count = self.count()
+        return self.total / count if count else None
+
+    def percentile(self, p):
+        # Interpolated within the bucket the p-th percentile falls in, as if
+        # its latencies were spread evenly, and kept within [min, max]
+        count = self.count()
+        if count == 0:
+            return None
+        rank = count * p / 100
+        seen = 0
+        for i in sorted(self.counts):
+            n = self.counts[i]
+            if seen + n >= rank:
+                lower = LATENCY_BOUNDS_MS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else self.max
+                value = lower + (upper - lower) * (rank - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+
+class MinuteBucket:
+    __slots__ = ('levels', 'latency')
+
+    def __init__(self):
+        self.levels = [0] * (NO_LEVEL + 1)
+        self.latency = LatencyHistogram()
+
+    def merge(self, other: 'MinuteBucket'):
+        self.levels = [a + b for a, b in zip(self.levels, other.levels)]
+        self.latency.merge(other.latency)
+        return self
+
+    def records(self):
+        return sum(self.levels)
+
+    def errors(self):
+        return sum(self.levels[ERROR_LEVEL:NO_LEVEL])
+
+
+class JobServerLog:
+    def __init__(self):
+        # Minute start (epoch seconds) -> bucket, job totals are summed on demand
+        self.minutes: Dict[int, MinuteBucket] = dict()
+        self.errors = TopK(ERROR_SIGNATURES)
+
+    def merge(self, other: 'JobServerLog'):
+        for minute, bucket in other.minutes.items():
+            mine = self.minutes.get(minute)
+            if mine is None:
+                self.minutes[minute] = bucket
+            else:
+                mine.merge(bucket)
+        self.errors.merge(other.errors)
+        return self
+
+    def total(self) -> MinuteBucket:
+        total = MinuteBucket()
+        for bucket in self.minutes.values():
+            total.merge(bucket)
+        return total
+
+    def start_minute(self):
+        return min(self.minutes) if self.minutes else None
+
+    def end_minute(self):
+        return max(self.minutes) if self.minutes else None
+
+
+class ServerLogStats:
+    def __init__(self):
+        # Job name -> stats, None for lines that name no job
+        self.jobs: Dict[Optional[str], JobServerLog] = dict()
+        self.lines = 0
+        # Lines without a timestamp: tracebacks and other continuation lines
+        self.continuation_lines = 0
+
+    def merge(self, other: 'ServerLogStats'):
+        for name, job in other.jobs.items():
+            mine = self.jobs.get(name)
+            if mine is None:
+                self.jobs[name] = job
+            else:
+                mine.merge(job)
+        self.lines += other.lines
+        self.continuation_lines += other.continuation_lines
+        return self
+
+
+def error_signature(message: bytes, pattern=None) -> str:
+    # Ids, numbers and quoted values vary between occurrences of the same error
+    if pattern is not None:
+        message = pattern.sub(b'<job>', message)
+    for substitution, placeholder in _SIGNATURE_SUBSTITUTIONS:
+        message = substitution.sub(placeholder, message)
+    return message.strip(b' ]:-|').decode('utf-8', 'replace')[:SIGNATURE_LENGTH]
+
+
+class ServerLogScanner:
+    def __init__(self, job_id_name_map: Dict[str, str], stats: ServerLogStats = None):
+        self.stats = stats or ServerLogStats()
+        self._names = {job_id.encode(): name
+                       for job_id, name in job_id_name_map.items() if job_id}
+        self._pattern = job_id_pattern(self._names)
+        # 'YYYY-MM-DD HH:MM' -> minute start, most lines skip parsing the time
+        self._minutes: Dict[bytes, int] = dict()
+        self._signatures: Dict[bytes, str] = dict()
+
+    def signature(self, message: bytes) -> str:
+        if self._pattern is not None:
+            message = self._pattern.sub(b'<job>', message)
+        key = message.translate(_DIGITS_TO_ZERO)
+        signature = self._signatures.get(key)
+        if signature is None:
+            if len(self._signatures) >= SIGNATURE_CACHE_SIZE:
+                self._signatures.clear()
+            signature = self._signatures[key] = error_signature(key)
+        return signature
+
+    def feed(self, lines: Iterable[bytes]):
+        stats = self.stats
+        jobs = stats.jobs
+        names = self._names
+        pattern = self._pattern
+        minutes = self._minutes
+        count = 0
+        continuation = 0
+        for line in lines:
+            count += 1
+            prefix = line[:MINUTE_PREFIX_LENGTH]
+            minute = minutes.get(prefix)
+            if minute is None:
+                timestamp = parse_log_timestamp(line)
+                if timestamp is None:
+                    continuation += 1
+                    continue
+                minute = minutes[prefix] = int(timestamp // 60) * 60
+
+            m = pattern.search(line) if pattern is not None else None
+            name = names[m.group()] if m is not None else None
+            job = jobs.get(name)
+            if job is None:
+                job = jobs[name] = JobServerLog()
+            bucket = job.minutes.get(minute)
+            if bucket is None:
+                bucket = job.minutes[minute] = MinuteBucket()
+
+            level = parse_log_level(line)
+            if level is None:
+                bucket.levels[NO_LEVEL] += 1
+            else:
+                code, end = level
+                bucket.levels[code] += 1
+                if code >= ERROR_LEVEL:
+                    job.errors.add(self.signature(line[end:]))
+            latency = parse_latency_ms(line)
+            if latency is not None:
+                bucket.latency.add(latency)
+        stats.lines += count
+        stats.continuation_lines += continuation
+        return stats
+
+
+def scan_server_log(job_id_name_map: Dict[str, str], path, start=0,
+                    end=None) -> ServerLogStats:
+    with instrument.span('parse: server.log') as s:
+        stats = ServerLogScanner(job_id_name_map).feed(iter_file_lines(path, start, end))
+        s.add(lines=stats.lines)
+    return stats
+
+
+def scan_server_stream(fp: BinaryIO, job_id_name_map: Dict[str, str]) -> ServerLogStats:
+    with instrument.span('parse: server.log') as s:
+        stats = ServerLogScanner(job_id_name_map).feed(iter_stream_lines(fp))
+        s.add(lines=stats.lines)
+    return stats
+
+
+def merge_server_log_stats(stats: ServerLogStats, other: ServerLogStats):
+    return stats.merge(other)
@@ -1,8 +1,30 @@
-from datetime import datetime
-from operator import attrgetter
+import heapq
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set
+
+from .intern import intern_str
+
+IS_DIR_TRUE = 1
+IS_DIR_FALSE = 0
+IS_DIR_UNKNOWN = -1
+SUCCESS_RESULT = 'success'
+(STATE_FIRST, STATE_LAST, STATE_ATTEMPTS, STATE_FAILURES, STATE_RESULT, STATE_EXCEPTION,
+ STATE_SUCCESS) = range(7)
+
+BUCKET_SECONDS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
 
 
 class SyncFileHistoryRecord:
+    __slots__ = ('name', 'timestamp', 'action', 'result', 'exception', 'is_dir')
+
     def __init__(self,
                  name,
                  timestamp,
@@ -13,85 +35,452 @@ class SyncFileHistoryRecord:
                  ):
         self.name = name
         self.timestamp = timestamp
-        self.action = action
-        self.result = result
-        self.exception = exception
+        self.action = intern_str(action)
+        self.result = intern_str(result)
+        self.exception = intern_str(exception)
         self.is_dir = is_dir
 
 
-class SyncFileHistory:
+class FileState:
+    __slots__ = ('name', 'action', 'first_time', 'last_time', 'attempts', 'failures',
+                 'last_result', 'last_exception', 'first_success_time')
+
+    def __init__(self, name, action, first_time, last_time, attempts, failures,
+                 last_result, last_exception, first_success_time):
+        self.name = name
+        self.action = action
+        self.first_time = first_time
+        self.last_time = last_time
+        self.attempts = attempts
+        self.failures = failures
+        self.last_result = last_result
+        self.last_exception = last_exception
+        self.first_success_time = first_success_time
+
+    def time_to_success(self) -> Optional[float]:
+        if self.first_success_time is None:
+            return None
+        return self.first_success_time - self.first_time
+
+
+def encode_is_dir(is_dir):
+    if is_dir is True:
+        return IS_DIR_TRUE
+    if is_dir is False:
+        return IS_DIR_FALSE
+    return IS_DIR_UNKNOWN
+
+
+def decode_is_dir(code):
+    if code == IS_DIR_TRUE:
+        return True
+    if code == IS_DIR_FALSE:
+        return False
+    return None
+
+
+class StringTable:
     def __init__(self):
-        self._history = list()
+        self._codes: Dict[object, int] = dict()
+        self.values: List[object] = list()
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            value = intern_str(value)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def code(self, value):
+        return self._codes.get(value)
+
+
+class SyncFileHistory:
+    def __init__(self, keep_records=True, track_states=False):
+        self._keep_records = keep_records
+        self._names = StringTable()
+        self._categories = StringTable()
+
+        self._name_column = array('l')
+        self._timestamp_column = array('d')
+        self._action_column = array('I')
+        self._result_column = array('I')
+        self._exception_column = array('I')
+        self._is_dir_column = array('b')
+
+        self._total_sync = 0
+        self._min_timestamp = None
+        self._max_timestamp = None
+        self._sorted_rows: Optional[array] = None
+        self._sorted_timestamps: Optional[array] = None
+        self._action_counter: Counter = Counter()
+        self._exception_counter: Counter = Counter()
+        self._file_names: Set[int] = set()
+        self._folder_names: Set[int] = set()
+        # Results each name had per action: action code -> name id -> one
+        # bit per result, in the order results first show up (_result_codes).
+        # The number of names per (action, mask) is kept as records are
+        # added, so file counts are a sum over a handful of masks and a
+        # --follow refresh only pays for the new lines
+        self._result_masks: Dict[int, Dict[int, int]] = dict()
+        self._mask_counts: Dict[int, Dict[int, int]] = dict()
+        self._result_bits: Dict[int, int] = dict()
+        self._result_codes: List[int] = list()
+
+        # State of every file per action code as (first, last, attempts,
+        # failures, last result, last exception, first success), the first
+        # success is inf until the file succeeds. Tuples of scalars stay out
+        # of the GC. Only kept with track_states, they cost more than the rest
+        # of the index
+        self._states: Optional[Dict[int, Dict[int, tuple]]] = dict() if track_states else None
+
+    def __len__(self):
+        return self._total_sync
 
     def add_history(self, history_record: SyncFileHistoryRecord):
-        self._history.append(history_record)
+        self.add(history_record.name,
+                 history_record.timestamp,
+                 history_record.action,
+                 history_record.result,
+                 history_record.exception,
+                 history_record.is_dir)
+
+    def add(self, name, timestamp, action, result, exception, is_dir):
+        name_id = self._names.encode(name)
+        action_code = self._categories.encode(action)
+        result_code = self._categories.encode(result)
+        is_dir_code = encode_is_dir(is_dir)
+
+        self._total_sync += 1
+        if self._min_timestamp is None or timestamp < self._min_timestamp:
+            self._min_timestamp = timestamp
+        if self._max_timestamp is None or timestamp > self._max_timestamp:
+            self._max_timestamp = timestamp
+        self._action_counter[action_code] += 1
+        if exception is not None:
+            self._exception_counter[exception] += 1
+        if is_dir_code == IS_DIR_FALSE:
+            self._file_names.add(name_id)
+        elif is_dir_code == IS_DIR_TRUE:
+            self._folder_names.add(name_id)
+        self._add_result(action_code, result_code, name_id)
+        if self._states is not None:
+            states = self._states.get(action_code)
+            if states is None:
+                states = self._states[action_code] = dict()
+            state = states.get(name_id)
+            if result == SUCCESS_RESULT:
+                new_state = (timestamp, timestamp, 1, 0, result, exception, timestamp)
+            else:
+                new_state = (timestamp, timestamp, 1, 1, result, exception, math.inf)
+            states[name_id] = new_state if state is None else _merge_state(state, new_state)
+
+        if self._keep_records:
+            self._name_column.append(name_id)
+            self._timestamp_column.append(timestamp)
+            self._action_column.append(action_code)
+            self._result_column.append(result_code)
+            self._exception_column.append(self._categories.encode(exception))
+            self._is_dir_column.append(is_dir_code)
+            self._sorted_rows = None
+            self._sorted_timestamps = None
+
+    def merge(self, other: 'SyncFileHistory'):
+        name_map = [self._names.encode(name) for name in other._names.values]
+        category_map = [self._categories.encode(v) for v in other._categories.values]
+
+        self._total_sync += other._total_sync
+        for t in (other._min_timestamp, other._max_timestamp):
+            if t is None:
+                continue
+            if self._min_timestamp is None or t < self._min_timestamp:
+                self._min_timestamp = t
+            if self._max_timestamp is None or t > self._max_timestamp:
+                self._max_timestamp = t
+        for code, count in other._action_counter.items():
+            self._action_counter[category_map[code]] += count
+        self._exception_counter.update(other._exception_counter)
+        self._file_names.update(name_map[i] for i in other._file_names)
+        self._folder_names.update(name_map[i] for i in other._folder_names)
+        result_bits = [self._result_bit(category_map[code]) for code in other._result_codes]
+        for action_code, other_masks in other._result_masks.items():
+            masks, counts = self._action_masks(category_map[action_code])
+            mask_map = dict()
+            for name_id, other_mask in other_masks.items():
+                name_id = name_map[name_id]
+                mask = mask_map.get(other_mask)
+                if mask is None:
+                    mask = mask_map[other_mask] = sum(
+                        1 << result_bits[bit] for bit in range(len(result_bits))
+                        if other_mask >> bit & 1)
+                seen = masks.get(name_id, 0)
+                mask |= seen
+                if mask != seen:
+                    masks[name_id] = mask
+                    counts[mask] = counts.get(mask, 0) + 1
+                    if seen:
+                        counts[seen] -= 1
+        if self._states is not None:
+            for action_code, other_states in other._states.items():
+                states = self._states.setdefault(category_map[action_code], dict())
+                for name_id, other_state in other_states.items():
+                    name_id = name_map[name_id]
+                    state = states.get(name_id)
+                    states[name_id] = (other_state if state is None
+                                       else _merge_state(state, other_state))
+
+        if self._keep_records:
+            self._name_column.extend(name_map[i] for i in other._name_column)
+            self._timestamp_column.extend(other._timestamp_column)
+            self._action_column.extend(category_map[c] for c in other._action_column)
+            self._result_column.extend(category_map[c] for c in other._result_column)
+            self._exception_column.extend(category_map[c] for c in other._exception_column)
+            self._is_dir_column.extend(other._is_dir_column)
+            self._sorted_rows = None
+            self._sorted_timestamps = None
+
+    def _result_bit(self, result_code):
+        bit = self._result_bits.get(result_code)
+        if bit is None:
+            bit = self._result_bits[result_code] = len(self._result_codes)
+            self._result_codes.append(result_code)
+        return bit
+
+    def _action_masks(self, action_code):
+        masks = self._result_masks.get(action_code)
+        if masks is None:
+            masks = self._result_masks[action_code] = dict()
+            self._mask_counts[action_code] = dict()
+        return masks, self._mask_counts[action_code]
+
+    def _add_result(self, action_code, result_code, name_id):
+        masks = self._result_masks.get(action_code)
+        if masks is None:
+            masks, _ = self._action_masks(action_code)
+        bit = self._result_bits.get(result_code)
+        if bit is None:
+            bit = self._result_bit(result_code)
+        seen = masks.get(name_id, 0)
+        mask = seen | 1 << bit
+        if mask == seen:
+            return
+        masks[name_id] = mask
+        counts = self._mask_counts[action_code]
+        counts[mask] = counts.get(mask, 0) + 1
+        if seen:
+            counts[seen] -= 1
+
+    def _get_file_state(self, key, state) -> FileState:
+        first, last, attempts, failures, result, exception, first_success = state
+        return FileState(name=self._names.values[key[0]],
+                         action=self._categories.values[key[1]],
+                         first_time=first,
+                         last_time=last,
+                         attempts=attempts,
+                         failures=failures,
+                         last_result=result,
+                         last_exception=exception,
+                         first_success_time=None if math.isinf(first_success) else first_success)
+
+    def _check_states(self):
+        if self._states is None:
+            raise ValueError('File state queries need track_states=True')
+
+    def _state_items(self, action=None):
+        # ((name id, action code), state) of every file, or of one action
+        self._check_states()
+        if action is None:
+            action_codes = list(self._states)
+        else:
+            action_codes = [self._categories.code(action)]
+        for action_code in action_codes:
+            for name_id, state in self._states.get(action_code, dict()).items():
+                yield (name_id, action_code), state
+
+    def file_state(self, name, action) -> Optional[FileState]:
+        # Current state of one file, None if it has no record of that action
+        self._check_states()
+        key = (self._names.code(name), self._categories.code(action))
+        if key[0] is None or key[1] is None:
+            return None
+        state = self._states.get(key[1], dict()).get(key[0])
+        return self._get_file_state(key, state) if state is not None else None
+
+    def _top_states(self, k, items, key) -> List[FileState]:
+        names = self._names.values
+        categories = self._categories.values
+        top = heapq.nsmallest(k, items, key=lambda item: (
+            key(item[1]), names[item[0][0]], categories[item[0][1]]))
+        return [self._get_file_state(key, state) for key, state in top]
+
+    def most_retried(self, k=10, action=None) -> List[FileState]:
+        # Ranked by failed attempts: a file that is synced again every time
+        # it changes is not retried
+        failed = ((key, state) for key, state in self._state_items(action)
+                  if state[STATE_FAILURES])
+        return self._top_states(k, failed, lambda state: -state[STATE_FAILURES])
+
+    def slowest_to_succeed(self, k=10, action=None) -> List[FileState]:
+        succeeded = ((key, state) for key, state in self._state_items(action)
+                     if not math.isinf(state[STATE_SUCCESS]))
+        return self._top_states(k, succeeded,
+                                lambda state: state[STATE_FIRST] - state[STATE_SUCCESS])
+
+    def _get_record(self, row):
+        names = self._names.values
+        categories = self._categories.values
+        return SyncFileHistoryRecord(name=names[self._name_column[row]],
+                                     timestamp=self._timestamp_column[row],
+                                     action=categories[self._action_column[row]],
+                                     result=categories[self._result_column[row]],
+                                     exception=categories[self._exception_column[row]],
+                                     is_dir=decode_is_dir(self._is_dir_column[row]))
+
+    def records(self):
+        for row in range(len(self._name_column)):
+            yield self._get_record(row)
+
+    def columns(self) -> Dict[str, array]:
+        if not self._keep_records:
+            raise ValueError('Record columns need keep_records=True')
+        return {
+            'name': self._name_column,
+            'timestamp': self._timestamp_column,
+            'action': self._action_column,
+            'result': self._result_column,
+            'exception': self._exception_column,
+            'is_dir': self._is_dir_column,
+        }
+
+    def string_tables(self):
+        # Decode 'name' with the first table, the other code columns with the second
+        return self._names.values, self._categories.values
 
     def start_time(self):
-        self._history.sort(key=attrgetter('timestamp'))
-        first_history = self._history[0]
-        first_datetime = datetime.utcfromtimestamp(first_history.timestamp)
-        return first_datetime
+        return datetime.utcfromtimestamp(self._min_timestamp)
 
     def end_time(self):
-        self._history.sort(key=attrgetter('timestamp'))
-        last_history = self._history[-1]
-        last_datetime = datetime.utcfromtimestamp(last_history.timestamp)
-        return last_datetime
+        return datetime.utcfromtimestamp(self._max_timestamp)
 
-    def total_sync(self, action=None):
-        if action is None:
-            return len(self._history)
+    def _build_time_index(self):
+        if self._sorted_rows is not None:
+            return
+        if not self._keep_records:
+            raise ValueError('Time range queries need keep_records=True')
+        timestamps = self._timestamp_column
+        self._sorted_rows = array('l', sorted(range(len(timestamps)),
+                                              key=timestamps.__getitem__))
+        self._sorted_timestamps = array('d', (timestamps[i] for i in self._sorted_rows))
+
+    def _time_range(self, t0, t1):
+        self._build_time_index()
+        start = 0 if t0 is None else bisect_left(self._sorted_timestamps, _to_timestamp(t0))
+        end = (len(self._sorted_timestamps) if t1 is None
+               else bisect_right(self._sorted_timestamps, _to_timestamp(t1)))
+        return start, end
 
-        count = 0
-        for h in self._history:
-            if h.action == action:
-                count += 1
-        return count
+    def count_between(self, t0=None, t1=None):
+        start, end = self._time_range(t0, t1)
+        return max(end - start, 0)
+
+    def get_sync_between(self, t0=None, t1=None) -> Iterator[SyncFileHistoryRecord]:
+        # Records in [t0, t1] in time order, ties in the order they were added
+        start, end = self._time_range(t0, t1)
+        for i in range(start, end):
+            yield self._get_record(self._sorted_rows[i])
+
+    def bucket_sync(self, interval='hour', t0=None, t1=None):
+        seconds = BUCKET_SECONDS[interval]
+        start, end = self._time_range(t0, t1)
+        buckets = list()
+        timestamps = self._sorted_timestamps
+        i = start
+        while i < end:
+            bucket = timestamps[i] // seconds * seconds
+            next_i = min(bisect_left(timestamps, bucket + seconds, i, end), end)
+            buckets.append((datetime.utcfromtimestamp(bucket), next_i - i))
+            i = next_i
+        return buckets
+
+    def total_sync(self, action=None, *, exception=None):
+        if exception is not None:
+            return self._exception_counter[exception]
+        if action is None:
+            return self._total_sync
+        code = self._categories.code(action)
+        return self._action_counter[code] if code is not None else 0
 
     def total_files(self):
-        names = set()
-        for h in self._history:
-            if h.is_dir is False:
-                names.add(h.name)
-        return len(names)
+        return len(self._file_names)
 
     def total_folders(self):
-        names = set()
-        for h in self._history:
-            if h.is_dir is True:
-                names.add(h.name)
-        return len(names)
+        return len(self._folder_names)
 
     def action_types(self):
-        action_types = list()
-        for h in self._history:
-            if h.action not in action_types:
-                action_types.append(h.action)
-        return action_types
+        return [self._categories.values[code] for code in self._action_counter]
 
     def exception_types(self):
-        exception_types = list()
-        for h in self._history:
-            if h.exception is None:
+        return list(self._exception_counter)
+
+    def exception_counts(self) -> Counter:
+        return Counter(self._exception_counter)
+
+    def _get_name_ids(self, action, result) -> Set[int]:
+        action_code = self._categories.code(action) if action else None
+        bit = self._result_bits.get(self._categories.code(result)) if result else None
+        if (action and action_code is None) or (result and bit is None):
+            return set()
+        name_ids = set()
+        for a, masks in self._result_masks.items():
+            if action and a != action_code:
                 continue
-            if h.exception not in exception_types:
-                exception_types.append(h.exception)
-        return exception_types
+            if result:
+                name_ids.update(i for i, mask in masks.items() if mask >> bit & 1)
+            else:
+                name_ids.update(masks)
+        return name_ids
 
     def get_files(self, *, action=None, result=None):
-        files = set()
-        for h in self._history:
-            if action and action != h.action:
-                continue
-            if result and result != h.result:
-                continue
-            files.add(h.name)
-        return files
+        names = self._names.values
+        return {names[i] for i in self._get_name_ids(action, result)}
+
+    def count_files(self, *, action=None, result=None, exclude_result=None):
+        if action:
+            # Names of one action with the result and without exclude_result
+            bits = self._result_bits
+            counts = self._mask_counts.get(self._categories.code(action), dict())
+            need = bits.get(self._categories.code(result)) if result else None
+            avoid = bits.get(self._categories.code(exclude_result)) if exclude_result else None
+            if result and need is None:
+                return 0
+            return sum(n for mask, n in counts.items()
+                       if (need is None or mask >> need & 1)
+                       and (avoid is None or not mask >> avoid & 1))
+        name_ids = self._get_name_ids(action, result)
+        if exclude_result is None:
+            return len(name_ids)
+        return len(name_ids.difference(self._get_name_ids(action, exclude_result)))
+
+
+def _merge_state(state, other):
+    first, last, attempts, failures, result, exception, first_success = state
+    # Ties go to other, the records added last
+    if other[STATE_LAST] >= last:
+        last, result, exception = other[STATE_LAST], other[STATE_RESULT], other[STATE_EXCEPTION]
+    return (min(first, other[STATE_FIRST]), last, attempts + other[STATE_ATTEMPTS],
+            failures + other[STATE_FAILURES], result, exception,
+            min(first_success, other[STATE_SUCCESS]))
 
-    def get_sync(self, exception):
-        synces = []
-        for h in self._history:
-            if h.exception == exception:
-                synces.append(h)
-        return synces
 
+def _to_timestamp(t):
+    # Naive datetimes are UTC, like the history timestamps
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return t.timestamp()
+    return t
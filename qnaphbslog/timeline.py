@@ -0,0 +1,132 @@
+import heapq
+import math
+from bisect import bisect_right
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from . import instrument
+from .chunked_io import iter_file_lines
+from .engine_log import TASK_SUBMITTED_FILTER, UPLOAD_TASK_NAME
+from .job_history import JobHistory
+from .parsers import iter_history_rows, parse_log_timestamp, parse_task_name, parse_upload_size
+from .sync_file_history import SUCCESS_RESULT
+
+# Job runs come from job_history.json, submitted tasks from engine.log and
+# file actions from syncengine-history.log. Every log file is already in time
+# order, so the files of a job are merged into one stream with a k-way heap
+# merge and each event is charged to the run whose [start_time, stop_time]
+# contains it. Only one pending event per file is held in memory
+
+TASK_EVENT = 0
+SYNC_EVENT = 1
+
+# (timestamp, kind, name, value): task name and upload size, or action and result
+Event = Tuple[float, int, str, object]
+
+
+class RunTimeline:
+    __slots__ = ('run', 'start_time', 'stop_time', 'status', 'tasks', 'upload_bytes',
+                 'sync_actions', 'sync_failures')
+
+    def __init__(self, run=None, start_time=None, stop_time=None, status=None):
+        self.run = run
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.status = status
+        self.tasks = Counter()
+        self.upload_bytes = 0
+        self.sync_actions = 0
+        self.sync_failures = 0
+
+    def add(self, event: Event):
+        _, kind, name, value = event
+        if kind == TASK_EVENT:
+            self.tasks[name] += 1
+            if name == UPLOAD_TASK_NAME and value is not None:
+                self.upload_bytes += value
+        else:
+            self.sync_actions += 1
+            if value != SUCCESS_RESULT:
+                self.sync_failures += 1
+
+    def total_tasks(self):
+        return sum(self.tasks.values())
+
+
+class RunIndex:
+    # Runs sorted by start time; an event belongs to the last run started at
+    # or before it, if that run had not stopped yet. A run without a stop
+    # time (still running) is open ended
+    def __init__(self, runs: List[RunTimeline]):
+        self.runs = sorted(runs, key=lambda r: r.start_time)
+        self.starts = [r.start_time for r in self.runs]
+        self.stops = [math.inf if r.stop_time is None else r.stop_time for r in self.runs]
+
+    def find(self, timestamp) -> Optional[RunTimeline]:
+        i = bisect_right(self.starts, timestamp) - 1
+        if i < 0 or timestamp > self.stops[i]:
+            return None
+        return self.runs[i]
+
+
+class JobTimeline:
+    def __init__(self, runs: List[RunTimeline]):
+        self.runs = runs
+        # Events outside every run, and events without a timestamp
+        self.outside = RunTimeline()
+        self.untimed = 0
+        self.events = 0
+        self.first_event = None
+        self.last_event = None
+
+
+def job_runs(job_history: JobHistory) -> List[RunTimeline]:
+    return [RunTimeline(run, r.start_time, r.stop_time, r.status)
+            for run, r in enumerate(job_history.records()) if r.start_time is not None]
+
+
+def iter_task_events(path) -> Iterator[Event]:
+    for line in iter_file_lines(path, needle=TASK_SUBMITTED_FILTER):
+        task_name = parse_task_name(line)
+        if task_name is None:
+            continue
+        size = parse_upload_size(line) if task_name == UPLOAD_TASK_NAME else None
+        yield parse_log_timestamp(line), TASK_EVENT, task_name, size
+
+
+def iter_sync_events(path) -> Iterator[Event]:
+    for name, timestamp, action, result, exception, is_dir in \
+            iter_history_rows(iter_file_lines(path)):
+        yield timestamp, SYNC_EVENT, action, result
+
+
+def event_time(event: Event):
+    # Untimed events (a log line without a timestamp) sort first
+    return -math.inf if event[0] is None else event[0]
+
+
+def merge_events(streams: Iterable[Iterator[Event]]) -> Iterator[Event]:
+    return heapq.merge(*streams, key=event_time)
+
+
+def correlate(job_history: JobHistory, engine_logs, sync_history_logs) -> JobTimeline:
+    timeline = JobTimeline(job_runs(job_history))
+    index = RunIndex(timeline.runs)
+    streams = [iter_task_events(path) for path in engine_logs]
+    streams += [iter_sync_events(path) for path in sync_history_logs]
+    with instrument.span('aggregate: timeline') as s:
+        for event in merge_events(streams):
+            timeline.events += 1
+            timestamp = event[0]
+            if timestamp is None:
+                timeline.untimed += 1
+                timeline.outside.add(event)
+                continue
+            if timeline.first_event is None or timestamp < timeline.first_event:
+                timeline.first_event = timestamp
+            if timeline.last_event is None or timestamp > timeline.last_event:
+                timeline.last_event = timestamp
+            run = index.find(timestamp)
+            (timeline.outside if run is None else run).add(event)
+        s.add(lines=timeline.events)
+    return timeline
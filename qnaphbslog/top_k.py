@@ -0,0 +1,75 @@
+import heapq
+from typing import Dict, List, Tuple
+
+# Space-Saving (Metwally et al.): the most frequent items of a stream in a
+# fixed number of counters. A new item takes over the smallest counter, so
+# every count overestimates the true one by at most its error, and an item
+# seen more than total / capacity times is always tracked
+
+
+class TopK:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts: Dict[str, int] = dict()
+        self.errors: Dict[str, int] = dict()
+        # (count, item) per tracked item, refreshed lazily when it is at the top
+        self._heap: List[Tuple[int, str]] = list()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, count=1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        floor = 0
+        if len(counts) >= self.capacity:
+            floor = self._evict_min()
+        counts[item] = floor + count
+        self.errors[item] = floor
+        heapq.heappush(self._heap, (floor + count, item))
+
+    def _evict_min(self):
+        heap = self._heap
+        while True:
+            count, item = heap[0]
+            current = self.counts[item]
+            if current == count:
+                heapq.heappop(heap)
+                del self.counts[item]
+                del self.errors[item]
+                return count
+            heapq.heapreplace(heap, (current, item))
+
+    def min_count(self):
+        # What an untracked item may have been seen, 0 until the counters are full
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: 'TopK'):
+        # Mergeable summaries: an item missing from one side may have been
+        # seen up to that side's min_count() times
+        floor, other_floor = self.min_count(), other.min_count()
+        counts = dict()
+        errors = dict()
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+            errors[item] = self.errors.get(item, floor) + other.errors.get(item, other_floor)
+        kept = heapq.nlargest(self.capacity, counts, key=lambda i: (counts[i], i))
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+        self.total += other.total
+        return self
+
+    def most_common(self, n=None) -> List[Tuple[str, int, int]]:
+        # (item, count, error), the true count is between count - error and count
+        items = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        if n is not None:
+            items = items[:n]
+        return [(item, count, self.errors[item]) for item, count in items]